@@ -1,6 +1,6 @@
 """Administrative bot command handlers."""
 
-import httpx
+from utils.http import create_client
 from aiogram import Router, Bot
 from aiogram.filters import Command
 from aiogram.types import Message
@@ -15,11 +15,7 @@ sessions_store: dict[int, str] = {}
 router = Router()
 INSIGHTS_URL = f"{settings.bots.app_url}/api/v1/resume"
 
-client = httpx.AsyncClient(
-    base_url=settings.bots.app_url,
-    timeout=httpx.Timeout(60.0),
-    headers={"X-Server-Auth": settings.bots.server_auth_token.get_secret_value()},
-)
+client = create_client()
 
 
 @router.message(AdminFilter(), Command("admin"))
@@ -1,6 +1,6 @@
 """Basic user commands handlers."""
 
-import httpx
+from utils.http import create_client
 from aiogram import Router
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
@@ -18,9 +18,7 @@ logger = logging.getLogger(__name__)
 
 router = Router()
 
-client = httpx.AsyncClient(timeout=60.0, headers={
-    "X-Server-Auth": settings.bots.server_auth_token.get_secret_value()
-})
+client = create_client()
 
 
 @router.message(Command("start"))
@@ -3,9 +3,9 @@
 from __future__ import annotations
 
 import asyncio
+from collections import OrderedDict
 from contextlib import suppress
 import logging
-import base64
 import httpx
 from aiogram import Bot, F, Router
 from aiogram.exceptions import TelegramBadRequest
@@ -21,17 +21,14 @@ from keyboards.inline import (
     top_up_keyboard,
 )
 from settings import settings
+from utils.http import create_client, post_with_retries
 from utils.i18n import get_user_language, t
 from utils.states import GamePlay, GameSetup
 
 
 logger = logging.getLogger(__name__)
 
-http_client = httpx.AsyncClient(
-    base_url=settings.bots.app_url,
-    timeout=httpx.Timeout(60.0),
-    headers={"X-Server-Auth": settings.bots.server_auth_token.get_secret_value()}
-)
+http_client = create_client()
 
 
 router = Router()
@@ -39,6 +36,10 @@ router = Router()
 # In-memory store for active sessions
 active_sessions: dict[int, list[dict]] = {}
 
+# Telegram file ids of already uploaded scene images, by image URL
+PHOTO_CACHE_SIZE = 1024
+_photo_ids: OrderedDict[str, str] = OrderedDict()
+
 # Default game template values per language
 DEFAULT_TEMPLATES = {
     "en": {
@@ -101,6 +102,35 @@ async def _typing_loop(bot: Bot, chat_id: int, stop: asyncio.Event, interval: fl
             continue
 
 
+async def _scene_photo(image_url: str, user_id: int) -> str | BufferedInputFile | None:
+    """Photo to send for a backend image URL.
+
+    Image URLs are content-addressed, so once Telegram has a photo its file
+    id is reused instead of downloading and uploading the image again.
+    ``user_id`` is sent because older, non-hashed images are only served to
+    their owner.
+    """
+    file_id = _photo_ids.get(image_url)
+    if file_id:
+        _photo_ids.move_to_end(image_url)
+        return file_id
+    try:
+        resp = await http_client.get(image_url, headers={"X-User-Id": str(user_id)})
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching scene image: {e}")
+        return None
+    if resp.status_code != 200:
+        return None
+    return BufferedInputFile(resp.content, filename=image_url.rsplit("/", 1)[-1])
+
+
+def _remember_photo(image_url: str, msg: Message) -> None:
+    if msg.photo:
+        _photo_ids[image_url] = msg.photo[-1].file_id
+        while len(_photo_ids) > PHOTO_CACHE_SIZE:
+            _photo_ids.popitem(last=False)
+
+
 async def _send_scene(
     chat_id: int,
     bot: Bot,
@@ -125,16 +155,20 @@ async def _send_scene(
         reply_kb = kb.as_markup()
 
     is_photo = False
-    if scene.get("image_data"):
-        # Convert base64 PNG data returned by backend into aiogram-readable file
-        image_bytes = base64.b64decode(scene["image_data"])
-        photo = BufferedInputFile(image_bytes, filename="scene.png")
+    if scene.get("image_status") == "pending":
+        # Text goes out now; the photo follows once the backend attaches it
+        msg = await bot.send_message(chat_id, text, reply_markup=reply_kb)
+        asyncio.create_task(
+            _deliver_pending_image(chat_id, bot, session_id, scene["id"], state.key.user_id)
+        )
+    elif scene.get("image_url") and (photo := await _scene_photo(scene["image_url"], state.key.user_id)):
         msg = await bot.send_photo(
             chat_id,
             photo,
             caption=text,
             reply_markup=reply_kb,
         )
+        _remember_photo(scene["image_url"], msg)
         is_photo = True
     else:
         msg = await bot.send_message(chat_id, text, reply_markup=reply_kb)
@@ -156,6 +190,36 @@ async def _send_scene(
                 break
 
 
+async def _deliver_pending_image(
+    chat_id: int,
+    bot: Bot,
+    session_id: str,
+    scene_id: str,
+    user_id: int,
+    attempts: int = 4,
+):
+    """Long-poll the backend for a scene image and send it when ready."""
+    for _ in range(attempts):
+        try:
+            resp = await http_client.get(
+                f"/api/v1/sessions/{session_id}/scenes/{scene_id}/image/",
+                params={"wait": 30},
+                headers={"X-User-Id": str(user_id)},
+            )
+        except httpx.HTTPError as e:
+            logger.error(f"Error polling scene image: {e}")
+            return
+        if resp.status_code != 200:
+            return
+        data = resp.json()
+        if data.get("image_status") == "pending":
+            continue
+        if data.get("image_url") and (photo := await _scene_photo(data["image_url"], user_id)):
+            msg = await bot.send_photo(chat_id, photo)
+            _remember_photo(data["image_url"], msg)
+        return
+
+
 async def handle_create_story(tg_id: int):
     state = dp_instance.fsm.resolve_context(bot=bot_instance, chat_id=tg_id, user_id=tg_id)
     lang = await get_user_language(tg_id)
@@ -287,7 +351,8 @@ async def start_game(call: CallbackQuery, state: FSMContext):
                 await call.message.answer(t(lang, "error_story"))
             return
         story_id = resp.json()["id"]
-        resp = await http_client.post(
+        resp = await post_with_retries(
+            http_client,
             "/api/v1/sessions/",
             json={"story_id": story_id},
             headers={"X-User-Id": str(call.from_user.id)},
@@ -339,7 +404,8 @@ async def handle_external_game_start(story_id: str, user_id: int):
     else:
         await bot_instance.send_message(user_id, story.get("story_desc", ""))
     await bot_instance.send_chat_action(user_id, "typing")
-    resp = await http_client.post(
+    resp = await post_with_retries(
+        http_client,
         "/api/v1/sessions/",
         json={"story_id": story_id},
         headers={"X-User-Id": str(user_id)},
@@ -404,7 +470,8 @@ async def select_preset(call: CallbackQuery | Message, state: FSMContext):
         _typing_loop(call.bot, call.message.chat.id, stop)
     )
     try:
-        resp = await http_client.post(
+        resp = await post_with_retries(
+            http_client,
             "/api/v1/sessions/",
             json={"story_id": story_id},
             headers={"X-User-Id": str(uid)},
@@ -487,7 +554,8 @@ async def make_choice(call: CallbackQuery, state: FSMContext):
         _typing_loop(call.bot, call.message.chat.id, stop)
     )
     try:
-        resp = await http_client.post(
+        resp = await post_with_retries(
+            http_client,
             f"/api/v1/sessions/{session_id}/choice/",
             json={"choice_text": choice, "energy_cost": 1},
             headers={"X-User-Id": str(call.from_user.id)},
@@ -575,7 +643,8 @@ async def choice_text(message: Message, state: FSMContext):
         _typing_loop(message.bot, message.chat.id, stop)
     )
     try:
-        resp = await http_client.post(
+        resp = await post_with_retries(
+            http_client,
             f"/api/v1/sessions/{session_id}/choice/",
             json={"choice_text": choice, "energy_cost": 2},
             headers={"X-User-Id": str(message.from_user.id)},
@@ -1,7 +1,7 @@
 from aiogram import Router
 from aiogram import types
 from aiogram import F
-import httpx
+from utils.http import create_client
 from settings import settings
 import logging
 
@@ -9,13 +9,7 @@ logger = logging.getLogger(__name__)
 
 router = Router()
 
-http_client = httpx.AsyncClient(
-    base_url=settings.bots.app_url,
-    timeout=httpx.Timeout(60.0),
-    headers={
-        "X-Server-Auth": settings.bots.server_auth_token.get_secret_value()
-    },
-)
+http_client = create_client()
 
 
 async def notify_service(msg: types.Message, item: str, success: bool = True) -> None:
@@ -0,0 +1,62 @@
+"""HTTP clients for talking to the backend."""
+
+import asyncio
+import logging
+import uuid
+
+import httpx
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+# Generation endpoints are retried rather than waited on for a minute: with
+# the idempotency key a retry picks up the step that is already running.
+GENERATION_TIMEOUT = httpx.Timeout(20.0, connect=5.0)
+GENERATION_ATTEMPTS = 6
+RETRY_BACKOFF_SECONDS = 1.0
+
+
+async def _add_idempotency_key(request: httpx.Request) -> None:
+    # Set once per request object, so resending it keeps the same key
+    if request.method == "POST" and IDEMPOTENCY_HEADER not in request.headers:
+        request.headers[IDEMPOTENCY_HEADER] = uuid.uuid4().hex
+
+
+def create_client(**kwargs) -> httpx.AsyncClient:
+    """Backend client that authenticates and tags POSTs with an idempotency key."""
+    kwargs.setdefault("base_url", settings.bots.app_url)
+    kwargs.setdefault("timeout", httpx.Timeout(60.0))
+    headers = {"X-Server-Auth": settings.bots.server_auth_token.get_secret_value()}
+    headers.update(kwargs.pop("headers", {}))
+    return httpx.AsyncClient(
+        headers=headers,
+        event_hooks={"request": [_add_idempotency_key]},
+        **kwargs,
+    )
+
+
+async def post_with_retries(
+    client: httpx.AsyncClient,
+    url: str,
+    attempts: int = GENERATION_ATTEMPTS,
+    timeout: httpx.Timeout = GENERATION_TIMEOUT,
+    **kwargs,
+) -> httpx.Response:
+    """POST and resend the same request on timeouts and connection errors.
+
+    Every attempt carries the same ``Idempotency-Key``, so the backend runs
+    the request at most once.
+    """
+    request = client.build_request("POST", url, timeout=timeout, **kwargs)
+    request.headers.setdefault(IDEMPOTENCY_HEADER, uuid.uuid4().hex)
+    for attempt in range(1, attempts + 1):
+        try:
+            return await client.send(request)
+        except httpx.TransportError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"POST {url} failed ({e!r}), retry {attempt}/{attempts - 1}")
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * attempt)
@@ -0,0 +1,22 @@
+"""add image_status column to scenes"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3a8741c754ca"
+down_revision: Union[str, Sequence[str], None] = "b3d9d50b1f2a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("scenes", sa.Column("image_status", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("scenes", "image_status")
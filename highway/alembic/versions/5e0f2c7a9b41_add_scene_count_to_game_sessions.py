@@ -0,0 +1,37 @@
+"""add scene_count column to game_sessions"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "5e0f2c7a9b41"
+down_revision: Union[str, Sequence[str], None] = "3a8741c754ca"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "game_sessions",
+        sa.Column("scene_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+        UPDATE game_sessions AS gs
+        SET scene_count = s.max_order
+        FROM (
+            SELECT session_id, MAX(order_num) AS max_order
+            FROM scenes
+            GROUP BY session_id
+        ) AS s
+        WHERE s.session_id = gs.id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("game_sessions", "scene_count")
@@ -0,0 +1,23 @@
+"""index scenes by session and order_num"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8c4d1e2f3a5b"
+down_revision: Union[str, Sequence[str], None] = "5e0f2c7a9b41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_scenes_session_id_order_num", "scenes", ["session_id", "order_num"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_scenes_session_id_order_num", table_name="scenes")
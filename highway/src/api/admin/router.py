@@ -4,8 +4,11 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.tg_auth import authenticate_server
+from src.api.identity import invalidate_user_context
 from src.api.utils import ensure_admin
 from src.core.database import get_session
+from src.game.services.google import key_pool
+from src.utils.cache import cache_stats
 from src.models.user import User
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
@@ -55,6 +58,7 @@ async def grant_wishes(
     # Update wishes balance
     user.wishes = payload.wishes
     await db.commit()
+    await invalidate_user_context(user.tg_id)
     await db.refresh(user)
 
     return {
@@ -92,6 +96,7 @@ async def grant_energy(
 
     user.energy = payload.energy
     await db.commit()
+    await invalidate_user_context(user.tg_id)
     await db.refresh(user)
 
     return {
@@ -100,3 +105,25 @@ async def grant_energy(
         "username": user.username,
         "energy": user.energy,
     }
+
+
+@router.get("/api_keys/")
+async def api_key_metrics(tg_id: int = Depends(authenticate_server)) -> dict:
+    """Return per-key scheduler metrics of this worker.
+
+    Keys are identified by a short hash; the secrets are never exposed.
+    """
+
+    ensure_admin(tg_id)
+
+    return {"keys": key_pool.snapshot()}
+
+
+@router.get("/caches/")
+async def cache_metrics(tg_id: int = Depends(authenticate_server)) -> dict:
+    """Return hit, miss, eviction and invalidation counts of this worker's
+    caches per namespace."""
+
+    ensure_admin(tg_id)
+
+    return {"caches": cache_stats()}
@@ -5,6 +5,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
+from src.api.identity import invalidate_user_context
 from src.core.database import get_session
 from src.models.user import User
 from src.auth.tg_auth import authenticated_user
@@ -112,5 +113,6 @@ async def update_me(
     if payload.image_format is not None:
         user.image_format = payload.image_format
     await session.commit()
+    await invalidate_user_context(tg_id)
     await session.refresh(user)
     return user
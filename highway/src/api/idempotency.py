@@ -0,0 +1,149 @@
+"""Idempotency keys for endpoints that generate content.
+
+A client that retries a request with the same ``Idempotency-Key`` header
+gets the stored result of the first attempt instead of running (and paying
+for) the generation again. A retry that arrives while the first attempt is
+still running waits for it. Results live in Redis when it is configured,
+otherwise in process memory, for ``idempotency_ttl_seconds``.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from fastapi import Header, HTTPException, status
+
+from src.config import settings
+from src.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "idempotency:"
+POLL_INTERVAL_SECONDS = 0.25
+_PENDING = "pending"
+
+
+def idempotency_key(
+    key: str | None = Header(default=None, alias="Idempotency-Key", max_length=128),
+) -> str | None:
+    return key
+
+
+class _MemoryStore:
+    def __init__(self) -> None:
+        self._items: dict[str, tuple[float, dict]] = {}
+
+    async def reserve(self, key: str, value: dict, ttl: int) -> bool:
+        now = time.monotonic()
+        for k in [k for k, (exp, _) in self._items.items() if exp <= now]:
+            del self._items[k]
+        if key in self._items:
+            return False
+        self._items[key] = (now + ttl, value)
+        return True
+
+    async def get(self, key: str) -> dict | None:
+        item = self._items.get(key)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return item[1]
+
+    async def put(self, key: str, value: dict, ttl: int) -> None:
+        self._items[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+
+class _RedisStore:
+    def __init__(self, redis) -> None:
+        self.redis = redis
+
+    async def reserve(self, key: str, value: dict, ttl: int) -> bool:
+        return bool(await self.redis.set(key, json.dumps(value), nx=True, ex=ttl))
+
+    async def get(self, key: str) -> dict | None:
+        raw = await self.redis.get(key)
+        return json.loads(raw) if raw else None
+
+    async def put(self, key: str, value: dict, ttl: int) -> None:
+        await self.redis.set(key, json.dumps(value), ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.redis.delete(key)
+
+
+def _fingerprint(request: Any) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyKeys:
+    def __init__(self) -> None:
+        self._memory = _MemoryStore()
+
+    def _store(self):
+        redis = get_redis()
+        return self._memory if redis is None else _RedisStore(redis)
+
+    async def run(
+        self,
+        key: str | None,
+        scope: str,
+        request: Any,
+        call: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        """Return the stored result for ``key`` or run ``call`` and store it.
+
+        ``scope`` separates users and endpoints; ``request`` is the part of
+        the request that must match on a retry. Only successful results are
+        stored, so a failed attempt can be retried with the same key.
+        """
+        if not key:
+            return await call()
+        store = self._store()
+        full_key = f"{KEY_PREFIX}{scope}:{key}"
+        fingerprint = _fingerprint(request)
+        pending = {"state": _PENDING, "fingerprint": fingerprint}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.session_lock_ttl_seconds
+        while not await store.reserve(full_key, pending, settings.session_lock_ttl_seconds):
+            stored = await store.get(full_key)
+            if stored is None:
+                continue
+            if stored["fingerprint"] != fingerprint:
+                raise HTTPException(
+                    status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="idempotency_key_reused",
+                )
+            if stored["state"] != _PENDING:
+                logger.info("Replaying idempotent result for %s", full_key)
+                return stored["result"]
+            if loop.time() >= deadline:
+                raise HTTPException(status.HTTP_409_CONFLICT, detail="request_in_progress")
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        try:
+            result = await call()
+        except BaseException:
+            await store.delete(full_key)
+            raise
+        await store.put(
+            full_key,
+            {"state": "done", "fingerprint": fingerprint, "result": result},
+            settings.idempotency_ttl_seconds,
+        )
+        return result
+
+
+_keys = IdempotencyKeys()
+
+
+async def run_idempotent(
+    key: str | None,
+    scope: str,
+    request: Any,
+    call: Callable[[], Awaitable[dict]],
+) -> dict:
+    return await _keys.run(key, scope, request, call)
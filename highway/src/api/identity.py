@@ -0,0 +1,116 @@
+"""Cached identity of the authenticated user.
+
+Nearly every handler turns the Telegram id into a user id, and several
+also need the language, image format or Pro status. :func:`get_user_context`
+answers all of that from a small immutable snapshot cached for
+``identity_cache_ttl_seconds`` and shared between workers like the catalog
+caches. Handlers that change these fields (profile updates, payments,
+admin grants) call :func:`invalidate_user_context` after committing.
+"""
+
+from datetime import datetime, timezone
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select, true
+
+from src.config import settings
+from src.core.database import AsyncSessionLocal
+from src.core.redis_client import get_redis
+from src.models.subscription import Subscription
+from src.models.user import User
+from src.utils.cache import AsyncTTLCache, RedisCacheTier, cached, invalidate_tags
+
+
+def is_pro_subscription(
+    plan: str | None, status: str | None, expires_at: datetime | None
+) -> bool:
+    """Whether a user's latest subscription grants Pro right now.
+
+    Every Pro check goes through here so that access and the Pro image
+    model always agree.
+    """
+    if plan != "pro" or status != "active":
+        return False
+    return expires_at is None or expires_at > datetime.now(timezone.utc)
+
+
+class UserContext(BaseModel):
+    """What handlers need to know about the requesting user."""
+
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    tg_id: int
+    language: str | None = None
+    image_format: str = "vertical"
+    # Latest subscription is an active Pro one; see ``is_pro`` for expiry
+    pro: bool = False
+    pro_expires_at: datetime | None = None
+
+    @property
+    def is_pro(self) -> bool:
+        return self.pro and is_pro_subscription("pro", "active", self.pro_expires_at)
+
+
+_identity_cache: AsyncTTLCache | None = None
+
+
+def _get_identity_cache() -> AsyncTTLCache | None:
+    global _identity_cache
+    if not settings.cache_enabled:
+        return None
+    if _identity_cache is None:
+        _identity_cache = AsyncTTLCache(
+            max_items=settings.identity_cache_max_items,
+            ttl_seconds=settings.identity_cache_ttl_seconds,
+            shared=RedisCacheTier("identity", get_redis),
+            name="identity",
+        )
+    return _identity_cache
+
+
+@cached(_get_identity_cache, include=["tg_id"], prefix="identity", tags={"user": "tg_id"})
+async def _load_user_context(tg_id: int) -> UserContext | None:
+    # User and latest subscription in one round trip
+    latest = (
+        select(Subscription.plan, Subscription.status, Subscription.expires_at)
+        .where(Subscription.user_id == User.id)
+        .order_by(Subscription.started_at.desc())
+        .limit(1)
+        .lateral()
+    )
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(
+            select(User, latest.c.plan, latest.c.status, latest.c.expires_at)
+            .outerjoin(latest, true())
+            .where(User.tg_id == tg_id)
+        )
+        row = res.first()
+    if row is None:
+        return None
+    user, plan, sub_status, expires_at = row
+    return UserContext(
+        id=user.id,
+        tg_id=user.tg_id,
+        language=user.language,
+        image_format=user.image_format,
+        pro=plan == "pro" and sub_status == "active",
+        pro_expires_at=expires_at,
+    )
+
+
+async def get_user_context(tg_id: int | None) -> UserContext:
+    """Return the cached context of ``tg_id``; 404 if there is no such user."""
+    context = await _load_user_context(int(tg_id))
+    if context is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    return context
+
+
+async def invalidate_user_context(tg_id: int) -> None:
+    """Drop the cached context of ``tg_id`` on every worker."""
+    await invalidate_tags(_get_identity_cache, f"user:{tg_id}")
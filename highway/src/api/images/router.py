@@ -0,0 +1,95 @@
+"""Serving of stored scene images."""
+
+import asyncio
+import os
+
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+
+from src.api.utils import resolve_user_id
+from src.auth.tg_auth import authenticated_user
+from src.config import settings
+from src.core.database import AsyncSessionLocal
+from src.game.images.storage import (
+    IMAGE_URL_PREFIX,
+    is_content_addressed,
+    path_from_url,
+    resolve_image,
+)
+from src.models.game_session import GameSession
+from src.models.scene import Scene
+
+router = APIRouter(prefix="/api/v1/images", tags=["images"])
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+LEGACY_CACHE = "private, max-age=86400"
+
+MEDIA_TYPES = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+
+def _etag(name: str, path: str) -> str:
+    if is_content_addressed(name):
+        return f'"{name.split(".")[0]}"'
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+async def _check_legacy_owner(name: str, request: Request) -> None:
+    """Allow a legacy image only to the user whose scene shows it."""
+    tg_id = authenticated_user(
+        request,
+        request.headers.get("authorization"),
+        request.headers.get("x-server-auth"),
+        request.headers.get("x-user-id"),
+    )
+    user_id = await resolve_user_id(tg_id)
+    async with AsyncSessionLocal() as db:
+        owned = await db.scalar(
+            select(Scene.id)
+            .join(GameSession, GameSession.id == Scene.session_id)
+            .where(
+                Scene.image_path == path_from_url(IMAGE_URL_PREFIX + name),
+                GameSession.user_id == user_id,
+            )
+            .limit(1)
+        )
+    if owned is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+@router.api_route("/{name}", methods=["GET", "HEAD"])
+async def get_image(name: str, request: Request) -> Response:
+    """Return a stored image.
+
+    Content-addressed names never change, so they are served with their
+    hash as a strong ETag and cached as immutable. For them the URL itself
+    is the capability: a SHA-256 name cannot be guessed, so no user auth is
+    required and clients and proxies can cache them. Files written before
+    content addressing have timestamp names that can be enumerated; they
+    are only served to the authenticated owner of a scene that uses them.
+    Range requests are supported. With ``image_accel_redirect_prefix`` set,
+    nginx sends the file instead.
+    """
+    if not is_content_addressed(name):
+        await _check_legacy_owner(name, request)
+    path = await asyncio.to_thread(resolve_image, name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    headers = {
+        "ETag": await asyncio.to_thread(_etag, name, path),
+        "Cache-Control": IMMUTABLE_CACHE if is_content_addressed(name) else LEGACY_CACHE,
+    }
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    media_type = MEDIA_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+    if settings.image_accel_redirect_prefix:
+        headers["X-Accel-Redirect"] = settings.image_accel_redirect_prefix + name
+        return Response(media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
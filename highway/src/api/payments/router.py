@@ -9,6 +9,7 @@ from pydantic import BaseModel
 from src.auth.tg_auth import authenticated_user
 from src.core.database import get_session
 from src.models.subscription import Subscription
+from src.api.identity import invalidate_user_context
 from src.api.utils import resolve_user_id, ensure_admin
 from src.utils.tg_invoice import export_tg_invoice
 from src.models.user import User
@@ -84,7 +85,7 @@ async def subscribe(
     db: AsyncSession = Depends(get_session),
 ) -> dict:
     """Initiate a subscription purchase."""
-    user_id = await resolve_user_id(tg_id, db)
+    user_id = await resolve_user_id(tg_id)
     logger.info(f"Initiating subscription purchase for tg user {tg_id}")
     plans_list = await plans()
     plan_data = next((p for p in plans_list if p.id == plan), None)
@@ -105,6 +106,8 @@ async def subscribe(
     )
     db.add(sub)
     await db.commit()
+    # The pending subscription is now the latest one
+    await invalidate_user_context(tg_id)
     await db.refresh(sub)
     logger.info(f"Created invoice {payload} for user {user_id}")
     return {
@@ -169,6 +172,8 @@ async def confirm_subscription(
 
     sub.status = "active"
     await db.commit()
+    if user:
+        await invalidate_user_context(user.tg_id)
     await db.refresh(sub)
     logger.info(f"Successfully confirmed subscription for user {sub.user_id}!")
     return {"status": "success"}
@@ -180,7 +185,7 @@ async def get_subscription(
     db: AsyncSession = Depends(get_session),
 ) -> dict:
     """Return the current subscription plan for the user."""
-    user_id = await resolve_user_id(tg_id, db)
+    user_id = await resolve_user_id(tg_id)
     res = await db.execute(
         select(Subscription).where(
             Subscription.user_id == user_id,
@@ -200,7 +205,7 @@ async def change_plan(
     db: AsyncSession = Depends(get_session),
 ) -> dict:
     """Force change of the user's subscription plan."""
-    user_id = await resolve_user_id(tg_id, db)
+    user_id = await resolve_user_id(tg_id)
     ensure_admin(tg_id)
     if plan not in {"pro", "free"}:
         raise HTTPException(
@@ -218,6 +223,7 @@ async def change_plan(
             sub.status = "inactive"
 
         await db.commit()
+        await invalidate_user_context(tg_id)
         return {"plan": "free", "status": "active"}
     else:
         # For pro plan, activate subscription (idempotent-ish: we simply add a new active row)
@@ -230,5 +236,6 @@ async def change_plan(
             user.energy = MAX_ENERGY
 
         await db.commit()
+        await invalidate_user_context(tg_id)
         await db.refresh(sub)
         return {"id": str(sub.id), "plan": sub.plan, "status": sub.status}
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""Per-session locking of scene generation with in-flight joining.
+
+Only one scene step may run for a session at a time. A duplicate request
+(a double tap, or a client retrying after its own timeout) for the same
+choice does not start a second generation: it waits for the running one
+and gets the same scene, without being charged again. A request for a
+different choice while a step is running is rejected.
+
+Within a worker the running step is shared through a future. Across
+workers a Redis lock marks the leader; followers poll until it is released
+and then read the scene id the leader published under its lock token.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from src.config import settings
+from src.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX = "scene_lock:"
+RESULT_PREFIX = "scene_result:"
+POLL_INTERVAL_SECONDS = 0.25
+
+# Delete the lock only if it still belongs to us
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SessionBusyError(Exception):
+    """Another choice is being generated for the session."""
+
+
+@dataclass
+class _Flight:
+    choice_text: str
+    token: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: float = field(default_factory=time.monotonic)
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+class SceneFlight:
+    """Handle returned by :meth:`SceneFlights.begin`.
+
+    If ``joined`` is true the step is generated elsewhere and
+    :meth:`wait` returns its scene id. Otherwise the caller is the leader
+    and must call :meth:`finish` or :meth:`fail` exactly once.
+    """
+
+    def __init__(self, owner: "SceneFlights", session_id: str, flight: _Flight, joined: bool) -> None:
+        self._owner = owner
+        self._session_id = session_id
+        self._flight = flight
+        self.joined = joined
+
+    async def wait(self) -> uuid.UUID:
+        return await asyncio.shield(self._flight.future)
+
+    async def finish(self, scene_id: uuid.UUID) -> None:
+        await self._owner._complete(self._session_id, self._flight, scene_id, None)
+
+    async def fail(self, exc: BaseException) -> None:
+        await self._owner._complete(self._session_id, self._flight, None, exc)
+
+
+class SceneFlights:
+    def __init__(self) -> None:
+        self._local: dict[str, _Flight] = {}
+
+    async def begin(self, session_id: str, choice_text: str | None) -> SceneFlight:
+        """Start a step for ``session_id`` or join the one already running.
+
+        Raises :class:`SessionBusyError` if a step for another choice runs.
+        """
+        choice_text = choice_text or ""
+        flight = self._local.get(session_id)
+        if (
+            flight is not None
+            and time.monotonic() - flight.started_at > settings.session_lock_ttl_seconds
+        ):
+            # The leader never reported back, e.g. its stream was never read
+            del self._local[session_id]
+            flight = None
+        if flight is not None:
+            if flight.choice_text != choice_text:
+                raise SessionBusyError(session_id)
+            return SceneFlight(self, session_id, flight, joined=True)
+        flight = _Flight(choice_text)
+        flight.future.add_done_callback(_consume_exception)
+        # Registered before the first await so local duplicates join it
+        self._local[session_id] = flight
+        try:
+            leader = await self._acquire(session_id, flight)
+        except BaseException as exc:
+            self._local.pop(session_id, None)
+            if not flight.future.done():
+                flight.future.set_exception(exc)
+            raise
+        return SceneFlight(self, session_id, flight, joined=not leader)
+
+    async def _acquire(self, session_id: str, flight: _Flight) -> bool:
+        """Take the Redis lock, or wait for the remote leader's result.
+
+        Returns ``True`` if this worker leads the step. When following, the
+        local future is resolved with the remote scene id before returning.
+        """
+        redis = get_redis()
+        if redis is None:
+            return True
+        lock_key = LOCK_PREFIX + session_id
+        value = json.dumps({"token": flight.token, "choice": flight.choice_text})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.session_lock_ttl_seconds
+        try:
+            while loop.time() < deadline:
+                if await redis.set(lock_key, value, nx=True, ex=settings.session_lock_ttl_seconds):
+                    return True
+                held = await redis.get(lock_key)
+                if held is None:
+                    continue
+                remote = json.loads(held)
+                if remote["choice"] != flight.choice_text:
+                    raise SessionBusyError(session_id)
+                scene_id = await self._wait_remote(redis, lock_key, held, remote["token"], deadline)
+                if scene_id is not None:
+                    self._local.pop(session_id, None)
+                    flight.future.set_result(scene_id)
+                    return False
+                # The remote leader failed; try to lead the step ourselves
+        except SessionBusyError:
+            raise
+        except Exception:
+            logger.warning("Session lock unavailable for %s, continuing unlocked", session_id, exc_info=True)
+            return True
+        raise SessionBusyError(session_id)
+
+    async def _wait_remote(self, redis, lock_key: str, held: str, token: str, deadline: float) -> uuid.UUID | None:
+        loop = asyncio.get_running_loop()
+        while loop.time() < deadline and await redis.get(lock_key) == held:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        result = await redis.get(RESULT_PREFIX + token)
+        return uuid.UUID(result) if result else None
+
+    async def _complete(
+        self,
+        session_id: str,
+        flight: _Flight,
+        scene_id: uuid.UUID | None,
+        exc: BaseException | None,
+    ) -> None:
+        if self._local.get(session_id) is flight:
+            del self._local[session_id]
+        if not flight.future.done():
+            if exc is None:
+                flight.future.set_result(scene_id)
+            else:
+                flight.future.set_exception(exc)
+        redis = get_redis()
+        if redis is None:
+            return
+        value = json.dumps({"token": flight.token, "choice": flight.choice_text})
+        try:
+            if scene_id is not None:
+                await redis.set(
+                    RESULT_PREFIX + flight.token,
+                    str(scene_id),
+                    ex=settings.session_result_ttl_seconds,
+                )
+            await redis.eval(_RELEASE_SCRIPT, 1, LOCK_PREFIX + session_id, value)
+        except Exception:
+            logger.warning("Could not release session lock for %s", session_id, exc_info=True)
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Leaders re-raise their own error; no follower may be waiting
+    if not future.cancelled():
+        future.exception()
+
+
+_flights = SceneFlights()
+
+
+async def begin_scene_flight(session_id: str, choice_text: str | None) -> SceneFlight:
+    return await _flights.begin(session_id, choice_text)
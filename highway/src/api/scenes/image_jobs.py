@@ -0,0 +1,94 @@
+"""Background jobs that attach generated images to stored scenes."""
+
+import asyncio
+import logging
+import uuid
+
+from src.core.database import AsyncSessionLocal
+from src.game.images.image_generator import generate_image
+from src.models.scene import Scene
+
+logger = logging.getLogger(__name__)
+
+
+class SceneImageJobs:
+    """Run Imagen calls for pending scenes and keep track of them.
+
+    Each job owns its DB session, so neither the HTTP request nor its
+    session is held open while the image is generated.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: dict[uuid.UUID, asyncio.Task] = {}
+
+    def schedule(
+        self, scene_id: uuid.UUID, prompt: str, image_format: str, model: str
+    ) -> None:
+        if scene_id in self._jobs:
+            return
+        task = asyncio.create_task(self._run(scene_id, prompt, image_format, model))
+        self._jobs[scene_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(scene_id, None))
+
+    async def _run(
+        self, scene_id: uuid.UUID, prompt: str, image_format: str, model: str
+    ) -> str | None:
+        image = None
+        try:
+            image, _ = await generate_image(prompt, image_format, model)
+        except Exception:
+            logger.exception("Background image generation failed for scene %s", scene_id)
+        image_path = image.path if image else None
+        async with AsyncSessionLocal() as db:
+            scene = await db.get(Scene, scene_id)
+            if scene is None:
+                return image_path
+            scene.image_path = image_path
+            scene.image_meta = image.meta if image else None
+            scene.image_status = "ready" if image_path else "failed"
+            await db.commit()
+        logger.info("Attached image to scene %s: %s", scene_id, image_path)
+        return image_path
+
+    async def wait(self, scene_id: uuid.UUID, timeout: float) -> bool:
+        """Wait for a job running in this process.
+
+        Returns ``False`` immediately if the job is unknown here (finished
+        already or owned by another worker) or if the timeout expires.
+        """
+        task = self._jobs.get(scene_id)
+        if task is None:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def shutdown(self, timeout: float) -> None:
+        """Give running jobs a chance to finish, then cancel the rest."""
+        tasks = list(self._jobs.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Cancelled %d unfinished image jobs", len(pending))
+
+
+_jobs = SceneImageJobs()
+
+
+def schedule_scene_image(
+    scene_id: uuid.UUID, prompt: str, image_format: str, model: str
+) -> None:
+    _jobs.schedule(scene_id, prompt, image_format, model)
+
+
+async def wait_for_scene_image(scene_id: uuid.UUID, timeout: float) -> bool:
+    return await _jobs.wait(scene_id, timeout)
+
+
+async def shutdown_image_jobs(timeout: float = 30) -> None:
+    await _jobs.shutdown(timeout)
@@ -1,23 +1,44 @@
 """Scene generation and retrieval endpoints."""
 
+import asyncio
+import json
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.tg_auth import authenticated_user
 from src.core.database import get_session
+from src.game.images.encoder import public_image_meta
+from src.game.images.storage import image_url, path_from_url
 from src.models.scene import Scene
 from src.models.game_session import GameSession
-from src.models.story import Story
 from src.models.user import User
-from src.models.subscription import Subscription
-from .schemas import SceneCreate, SceneOut, scene_to_out
-from .scene_service import create_and_store_scene
-from src.api.utils import resolve_user_id
+from .schemas import (
+    HistoryPage,
+    SceneCreate,
+    SceneHistoryItem,
+    SceneImageOut,
+    SceneOut,
+    scene_to_out,
+)
+from .flights import SceneFlight, SessionBusyError, begin_scene_flight
+from .image_jobs import wait_for_scene_image
+from .scene_service import (
+    create_and_store_scene,
+    load_step_session,
+    stream_scene_events,
+)
+from src.api.idempotency import idempotency_key, run_idempotent
 
 router = APIRouter(prefix="/api/v1/sessions", tags=["scenes"])
 
+MAX_IMAGE_WAIT_SECONDS = 30
+IMAGE_POLL_INTERVAL_SECONDS = 1.0
+
 
 @router.post(
     "/{id}/scenes/",
@@ -29,32 +50,13 @@ async def generate_scene(
     payload: SceneCreate,
     tg_id: int = Depends(authenticated_user),
     db: AsyncSession = Depends(get_session),
+    key: str | None = Depends(idempotency_key),
 ) -> SceneOut:
     """Generate the next scene for a session."""
-    user_id = await resolve_user_id(tg_id, db)
-    sid = uuid.UUID(id)
-    res = await db.get(GameSession, sid)
-    if not res:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    if res.user_id != user_id :
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
-    story = None
-    if res.story_id:
-        story = await db.get(Story, res.story_id)
-        if story:
-            await db.refresh(story, ["world"])
-    try:
-        scene = await create_and_store_scene(
-            db,
-            res,
-            payload.choice_text if payload else None,
-            story,
-        )
-    except ValueError as exc:
-        raise HTTPException(
-            status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc)
-        ) from exc
-    return scene_to_out(scene)
+    session_obj = await _owned_session(db, id, tg_id)
+    return await _generate(
+        db, session_obj, payload.choice_text if payload else None, key=key
+    )
 
 
 @router.post(
@@ -67,30 +69,168 @@ async def choose_and_generate(
     payload: SceneCreate,
     tg_id: int = Depends(authenticated_user),
     db: AsyncSession = Depends(get_session),
+    key: str | None = Depends(idempotency_key),
 ) -> SceneOut:
-    """Generate the next scene using the chosen option."""
-    user_id = await resolve_user_id(tg_id, db)
-    user = await db.get(User, user_id)
+    """Generate the next scene using the chosen option.
+
+    A repeated request for the choice that is being generated joins the
+    running step and is not charged again. A retry with the same
+    ``Idempotency-Key`` returns the scene of the first attempt.
+    """
     if payload.choice_text is None:
         raise HTTPException(
             status.HTTP_422_UNPROCESSABLE_ENTITY, detail="choice_text_required"
         )
-    cost = payload.energy_cost or 1
-    sub_res = await db.execute(
-        select(Subscription).where(
-            Subscription.user_id == user_id, Subscription.status == "active"
+    session_obj = await _owned_session(db, id, tg_id)
+    return await _generate(
+        db,
+        session_obj,
+        payload.choice_text,
+        energy_cost=payload.energy_cost or 1,
+        key=key,
+    )
+
+
+async def _owned_session(db: AsyncSession, id: str, tg_id: int) -> GameSession:
+    """Load the session for a scene step and check it belongs to the caller."""
+    session_obj = await load_step_session(db, uuid.UUID(id))
+    if not session_obj:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if session_obj.user.tg_id != int(tg_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return session_obj
+
+
+async def _begin_flight(session_id: uuid.UUID, choice_text: str | None) -> SceneFlight:
+    try:
+        return await begin_scene_flight(str(session_id), choice_text)
+    except SessionBusyError as exc:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, detail="generation_in_progress"
+        ) from exc
+
+
+async def _joined_scene(db: AsyncSession, flight: SceneFlight) -> Scene:
+    scene = await db.get(Scene, await flight.wait())
+    if scene is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return scene
+
+
+async def _generate(
+    db: AsyncSession,
+    session_obj: GameSession,
+    choice_text: str | None,
+    energy_cost: int | None = None,
+    key: str | None = None,
+) -> SceneOut:
+    result = await run_idempotent(
+        key,
+        f"{session_obj.user_id}:scene:{session_obj.id}",
+        {"choice_text": choice_text, "energy_cost": energy_cost},
+        lambda: _run_step(db, session_obj, choice_text, energy_cost),
+    )
+    scene = await db.get(Scene, uuid.UUID(result["scene_id"]))
+    if scene is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return scene_to_out(scene)
+
+
+async def _run_step(
+    db: AsyncSession,
+    session_obj: GameSession,
+    choice_text: str | None,
+    energy_cost: int | None,
+) -> dict:
+    flight = await _begin_flight(session_obj.id, choice_text)
+    if flight.joined:
+        return {"scene_id": str(await flight.wait())}
+    try:
+        if energy_cost:
+            await _charge_energy(db, session_obj.user, energy_cost)
+        try:
+            scene = await create_and_store_scene(db, session_obj, choice_text)
+        except ValueError as exc:
+            raise HTTPException(
+                status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc)
+            ) from exc
+    except BaseException as exc:
+        await flight.fail(exc)
+        raise
+    await flight.finish(scene.id)
+    return {"scene_id": str(scene.id)}
+
+
+@router.post("/{id}/choice/stream/")
+async def choose_and_stream(
+    id: str,
+    payload: SceneCreate,
+    tg_id: int = Depends(authenticated_user),
+    db: AsyncSession = Depends(get_session),
+) -> StreamingResponse:
+    """Generate the next scene and stream it as server-sent events.
+
+    Events, in order: ``scene_delta`` (description text as it is generated;
+    ``scene_text`` replaces everything streamed so far), ``choices``,
+    optionally ``ending`` (the step finished the game and its text replaces
+    the streamed description), ``image_ready`` and finally ``done`` with the
+    stored scene, or ``error``.
+    """
+    if payload.choice_text is None:
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY, detail="choice_text_required"
         )
+    session_obj = await _owned_session(db, id, tg_id)
+    flight = await _begin_flight(session_obj.id, payload.choice_text)
+    if flight.joined:
+        events = _joined_events(db, flight)
+    else:
+        try:
+            await _charge_energy(db, session_obj.user, payload.energy_cost or 1)
+        except BaseException as exc:
+            await flight.fail(exc)
+            raise
+        events = stream_scene_events(session_obj.id, payload.choice_text, flight)
+    return StreamingResponse(
+        _sse(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    subscription = sub_res.scalars().first()
-    if not subscription:
-        if not user or user.energy < cost:
+
+
+async def _joined_events(
+    db: AsyncSession, flight: SceneFlight
+) -> AsyncIterator[tuple[str, dict]]:
+    """Stream the outcome of a step generated for another request."""
+    try:
+        scene = await _joined_scene(db, flight)
+    except Exception as exc:
+        detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+        yield "error", {"detail": detail}
+        return
+    if scene.image_status != "pending":
+        yield "image_ready", {"image": scene.image_path}
+    yield "done", scene_to_out(scene).model_dump()
+
+
+async def _charge_energy(db: AsyncSession, user: User, cost: int) -> None:
+    """Deduct energy for a generation unless the user has a subscription.
+
+    ``user`` must have its subscriptions loaded.
+    """
+    if not any(sub.status == "active" for sub in user.subscriptions):
+        if user.energy < cost:
             raise HTTPException(status.HTTP_403_FORBIDDEN, detail="not_enough_energy")
         user.energy -= cost
         await db.commit()
-        await db.refresh(user)
-    payload_dict = payload.model_dump()
-    payload_dict.pop("energy_cost", None)
-    return await generate_scene(id, SceneCreate(**payload_dict), tg_id, db)
+
+
+async def _sse(events: AsyncIterator[tuple[str, dict]]) -> AsyncIterator[str]:
+    """Format scene events as a server-sent events stream."""
+    async for event, data in events:
+        if event == "image_ready":
+            data = {"image_url": image_url(data.get("image"))}
+        yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 @router.get("/{id}/scenes/{scene_id}/", response_model=SceneOut)
@@ -108,21 +248,107 @@ async def get_scene(
     return scene_to_out(scene)
 
 
-@router.get("/{id}/history/", response_model=list[SceneOut])
+@router.get("/{id}/scenes/{scene_id}/image/", response_model=SceneImageOut)
+async def get_scene_image(
+    id: str,
+    scene_id: str,
+    wait: float = Query(default=0, ge=0, le=MAX_IMAGE_WAIT_SECONDS),
+    tg_id: int = Depends(authenticated_user),
+    db: AsyncSession = Depends(get_session),
+) -> SceneImageOut:
+    """Return the image of a scene once it is attached.
+
+    With ``wait`` > 0 the request is held (long-poll) until the image job
+    finishes or the timeout expires.
+    """
+    scene = await db.get(Scene, uuid.UUID(scene_id))
+    if not scene or str(scene.session_id) != id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    deadline = asyncio.get_running_loop().time() + wait
+    while scene.image_status == "pending":
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        # Jobs owned by another worker are only visible through the DB
+        if not await wait_for_scene_image(scene.id, remaining):
+            await asyncio.sleep(min(IMAGE_POLL_INTERVAL_SECONDS, remaining))
+        await db.refresh(scene)
+    return SceneImageOut(
+        id=str(scene.id),
+        image_status=scene.image_status,
+        image_url=image_url(scene.image_path),
+        image_meta=public_image_meta(scene.image_meta),
+    )
+
+
+HISTORY_FIELDS = {
+    "id": (Scene.id,),
+    "order_num": (),
+    "description": (Scene.description,),
+    "image_url": (Scene.image_path,),
+    "image_meta": (Scene.image_meta,),
+    "image_status": (Scene.image_status,),
+    "choices_json": (Scene.generated_choices,),
+}
+DEFAULT_HISTORY_FIELDS = ",".join(HISTORY_FIELDS)
+
+
+def _history_item(row, fields: list[str]) -> SceneHistoryItem:
+    values = row._mapping
+    item = {}
+    for name in fields:
+        if name == "image_url":
+            item[name] = image_url(values["image_path"])
+        elif name == "image_meta":
+            item[name] = public_image_meta(values["image_meta"])
+        elif name == "choices_json":
+            item[name] = values["generated_choices"]
+        elif name == "id":
+            item[name] = str(values["id"])
+        else:
+            item[name] = values[name]
+    return SceneHistoryItem(**item)
+
+
+@router.get(
+    "/{id}/history/",
+    response_model=HistoryPage,
+    response_model_exclude_unset=True,
+)
 async def history(
     id: str,
+    after: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=20, ge=1, le=100),
+    fields: str = Query(default=DEFAULT_HISTORY_FIELDS),
     tg_id: int = Depends(authenticated_user),
     db: AsyncSession = Depends(get_session),
-) -> list[SceneOut]:
-    """Return the full scene history for a session."""
+) -> HistoryPage:
+    """Return a page of the scene history of a session.
 
-    res = await db.execute(
-        select(Scene)
-        .where(Scene.session_id == uuid.UUID(id))
-        .order_by(Scene.order_num)
+    Pages are keyed by ``order_num``: pass ``next_cursor`` as ``after`` for
+    the next one. ``fields`` is a comma-separated subset of the item fields;
+    images are returned as ``image_url`` references, never inline.
+    """
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = set(requested) - HISTORY_FIELDS.keys()
+    if unknown:
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"unknown_fields: {','.join(sorted(unknown))}",
+        )
+    columns = {Scene.order_num}
+    for name in requested:
+        columns.update(HISTORY_FIELDS[name])
+    query = select(*columns).where(Scene.session_id == uuid.UUID(id))
+    if after is not None:
+        query = query.where(Scene.order_num > after)
+    res = await db.execute(query.order_by(Scene.order_num).limit(limit + 1))
+    rows = res.all()
+    next_cursor = rows[limit - 1].order_num if len(rows) > limit else None
+    return HistoryPage(
+        items=[_history_item(row, requested) for row in rows[:limit]],
+        next_cursor=next_cursor,
     )
-    scenes = list(res.scalars())
-    return [scene_to_out(s) for s in scenes]
 
 
 @router.put("/{id}/scenes/{scene_id}/", response_model=SceneOut)
@@ -139,9 +365,13 @@ async def update_scene(
     if not scene or str(scene.session_id) != id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     scene.description = payload.description
-    # Update only if provided (legacy clients may still send image_url)
+    # Update only if provided; clients echo back the URL they were given
     if payload.image_url:
-        scene.image_path = payload.image_url
+        path = path_from_url(payload.image_url)
+        if path != scene.image_path:
+            # Variants describe the old image only
+            scene.image_meta = None
+        scene.image_path = path
     scene.generated_choices = payload.choices_json
     await db.commit()
     await db.refresh(scene)
@@ -1,26 +1,67 @@
+import asyncio
 import uuid
 from datetime import datetime
-from sqlalchemy import select, func
+from typing import AsyncIterator
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
+from src.config import settings
+from src.core.database import AsyncSessionLocal
 from src.models.scene import Scene
 from src.models.choice import Choice
 from src.models.game_session import GameSession
 from src.models.story import Story
-from src.game.agent.runner import process_step, SceneResponse
-from src.game.agent.mongo_state import get_user_state, set_user_state
+from src.models.user import User
+from src.game.agent.runner import process_step, ProcessStepResponse, SceneResponse
+from src.game.agent.mongo_state import get_session_state, set_session_state
 from src.game.agent.models import StoryFrame, UserChoice, UserState
 from src.game.agent.tools import generate_story_frame, generate_initial_scene
-from src.api.utils import get_localized, has_pro_plan
+from src.game.agent.pregen import schedule_pregeneration, take_pregenerated
+from src.game.agent.utils import EventSink
+from src.api.utils import get_localized, is_pro_user
+from src.api.scenes.schemas import scene_to_out
+from src.api.scenes.flights import SceneFlight
+from src.api.scenes.image_jobs import schedule_scene_image, wait_for_scene_image
+from src.game.images.image_generator import get_image_model
 import logging
 
 logger = logging.getLogger(__name__)
-async def _next_order(db: AsyncSession, session_id: uuid.UUID) -> int:
+
+
+async def load_step_session(
+    db: AsyncSession, session_id: uuid.UUID
+) -> GameSession | None:
+    """Load a session with its user, subscriptions and story in one query.
+
+    These are everything a scene step reads from the database, so the step
+    itself issues no further reads on a warm agent state.
+    """
     res = await db.execute(
-        select(func.max(Scene.order_num)).where(Scene.session_id == session_id)
+        select(GameSession)
+        .where(GameSession.id == session_id)
+        .options(
+            joinedload(GameSession.user).joinedload(User.subscriptions),
+            joinedload(GameSession.story),
+        )
     )
-    max_order = res.scalar_one()
-    return 1 if max_order is None else max_order + 1
+    return res.unique().scalars().first()
+
+
+async def _replay_events(result: ProcessStepResponse, on_event: EventSink) -> None:
+    """Emit the streaming events for a step that was not generated live."""
+    if result.game_over:
+        await on_event(
+            "ending",
+            {"ending": result.ending.model_dump(), "text": result.ending.description},
+        )
+    else:
+        await on_event("scene_delta", {"text": result.scene.description})
+        await on_event(
+            "choices", {"choices": [c.model_dump() for c in result.scene.choices]}
+        )
+    if result.scene.image_prompt is None:
+        await on_event("image_ready", {"image": result.scene.image})
 
 
 async def create_and_store_scene(
@@ -28,14 +69,23 @@ async def create_and_store_scene(
     session: GameSession,
     choice_text: str | None,
     story: Story | None = None,
+    on_event: EventSink | None = None,
 ) -> Scene:
-    # Ensure single in-progress state per user by keying state by user_id
-    user_hash = str(session.user_id)
-    state = await get_user_state(user_hash)
-    state.is_pro = await has_pro_plan(db, session.user_id)
-    await db.refresh(session, ["user"])
+    """Generate the next scene of ``session`` and store it.
+
+    ``session`` must come from :func:`load_step_session`. All writes of the
+    step (scene, choice, session and story updates) go out in one commit
+    after generation, so no transaction is held open during model calls.
+    """
+    # Agent state is per session, so several games of a user never mix
+    state_key = str(session.id)
+    user_key = str(session.user_id)
+    state = await get_session_state(state_key, user_key)
+    state.is_pro = is_pro_user(session.user)
     state.language = session.user.language or state.language or "en"
     state.image_format = session.user.image_format or state.image_format or "vertical"
+    if story is None:
+        story = session.story
     if not state.story_frame:
         if session.story_frame:
             sf_data = dict(session.story_frame)
@@ -43,7 +93,6 @@ async def create_and_store_scene(
                 ("setting" not in sf_data or "character" not in sf_data or "genre" not in sf_data)
                 and session.story
             ):
-                await db.refresh(session.story, ["world"])
                 sf_data.setdefault("setting", session.story.story_desc)
                 sf_data.setdefault("character", session.story.character or {})
                 sf_data.setdefault("genre", session.story.genre)
@@ -51,7 +100,6 @@ async def create_and_store_scene(
             sf_data = get_localized(sf_data, state.language)
             state.story_frame = StoryFrame(**sf_data)
         elif session.story and session.story.story_frame:
-            await db.refresh(session.story, ["world"])
             sf_data = dict(session.story.story_frame)
             sf_data.setdefault("setting", session.story.story_desc)
             sf_data.setdefault("npc_characters", session.story.npc_characters or [])
@@ -63,7 +111,8 @@ async def create_and_store_scene(
             sf_data = get_localized(sf_data, state.language)
             state.story_frame = StoryFrame(**sf_data)
 
-    if not state.user_choices:
+    # Only sessions without stored agent state are rebuilt from the database
+    if not state.user_choices and session.scene_count:
         res = await db.execute(
             select(Scene, Choice)
             .join(Choice, isouter=True)
@@ -79,12 +128,8 @@ async def create_and_store_scene(
         if rows:
             state.current_scene_id = str(rows[-1][0].id)
 
-    order_num = await _next_order(db, session.id)
+    order_num = session.scene_count + 1
     if order_num == 1:
-        if story is None:
-            story = session.story
-            if story is not None:
-                await db.refresh(story, ["world"])
         if not story:
             raise ValueError("Story not found for session")
         if not state.story_frame:
@@ -102,78 +147,152 @@ async def create_and_store_scene(
         logger.info(f"Possible endings: {story_frame.endings}")
         initial_scene = await generate_initial_scene(state)
         result = SceneResponse(scene=initial_scene, game_over=False)
+        if on_event is not None:
+            await _replay_events(result, on_event)
     else:
         if choice_text is None:
             raise ValueError("choice_text_required")
-        logger.info("[Runner] Step %s for user %s", state.current_scene_id, user_hash)
-        result = await process_step(state, choice_text)
-
-    if order_num == 1 and not session.story_frame:
-        if state.story_frame:
-            session.story_frame = state.story_frame.model_dump(
-                exclude={
-                    "visual_style",
-                    "npc_characters",
-                    "setting",
-                    "character",
-                    "genre",
-                    "language",
-                }
-            )
-            db.add(session)
-            await db.commit()
-            await db.refresh(session)
-
-            # Persist generated story frame and related data to the Story
-            if story:
-                story.story_frame = state.story_frame.model_dump(
-                    exclude={
-                        "visual_style",
-                        "npc_characters",
-                        "setting",
-                        "character",
-                        "genre",
-                        "language",
-                    }
-                )
-                if state.story_frame.visual_style:
-                    story.visual_style = state.story_frame.visual_style
-                if state.story_frame.npc_characters:
-                    story.npc_characters = [
-                        c.model_dump() for c in state.story_frame.npc_characters
-                    ]
-                db.add(story)
-                await db.commit()
-                await db.refresh(story)
+        logger.info("[Runner] Step %s for session %s", state.current_scene_id, state_key)
+        pregenerated = await take_pregenerated(
+            state_key, order_num - 1, choice_text
+        )
+        if pregenerated is not None and (
+            pregenerated.state.language == state.language
+            and pregenerated.state.image_format == state.image_format
+        ):
+            pregenerated.state.is_pro = state.is_pro
+            state = pregenerated.state
+            result = pregenerated.response
+            if on_event is not None:
+                await _replay_events(result, on_event)
+        else:
+            result = await process_step(state, choice_text, on_event)
+
+    if order_num == 1 and not session.story_frame and state.story_frame:
+        frame_data = state.story_frame.model_dump(
+            exclude={
+                "visual_style",
+                "npc_characters",
+                "setting",
+                "character",
+                "genre",
+                "language",
+            }
+        )
+        session.story_frame = frame_data
+        # Persist generated story frame and related data to the Story
+        if story:
+            story.story_frame = frame_data
+            if state.story_frame.visual_style:
+                story.visual_style = state.story_frame.visual_style
+            if state.story_frame.npc_characters:
+                story.npc_characters = [
+                    c.model_dump() for c in state.story_frame.npc_characters
+                ]
 
     if result.game_over:
         ending = result.ending
         description = ending.description
         image_path = result.scene.image
+        image_meta = result.scene.image_meta
         choices_json = None
         session.is_finished = True
         session.ended_at = datetime.utcnow()
-        db.add(session)
     else:
         scene_data = result.scene
         description = scene_data.description
         image_path = scene_data.image
+        image_meta = scene_data.image_meta
         choices_json = {"choices": [c.model_dump() for c in scene_data.choices]}
 
+    # A scene that still carries its image prompt gets the image later
+    deferred_prompt = result.scene.image_prompt
+    if image_path:
+        image_status = "ready"
+    elif deferred_prompt:
+        image_status = "pending"
+    else:
+        image_status = None
+
     scene = Scene(
+        id=uuid.uuid4(),
         session_id=session.id,
         order_num=order_num,
         description=description,
         generated_choices=choices_json,
         image_path=image_path,
+        image_meta=image_meta,
+        image_status=image_status,
     )
-    await set_user_state(user_hash, state)
+    session.scene_count = order_num
+    # Saved before the commit and before the session lock is released, so
+    # a version conflict fails the step instead of losing it after the fact
+    await set_session_state(state_key, state, user_key)
     db.add(scene)
-    await db.flush()
-
     if choice_text:
         db.add(Choice(scene_id=scene.id, choice_text=choice_text))
-
     await db.commit()
-    await db.refresh(scene)
+
+    if image_status == "pending":
+        schedule_scene_image(
+            scene.id, deferred_prompt, state.image_format, get_image_model(state.is_pro)
+        )
+    if not result.game_over:
+        schedule_pregeneration(state_key, order_num, state)
     return scene
+
+
+_stream_tasks: set[asyncio.Task] = set()
+
+
+async def stream_scene_events(
+    session_id: uuid.UUID,
+    choice_text: str,
+    flight: SceneFlight | None = None,
+) -> AsyncIterator[tuple[str, dict]]:
+    """Generate and store the next scene, yielding progress events.
+
+    Generation runs in its own task with its own DB session so that a client
+    disconnecting mid-stream does not lose an already paid-for scene. The last
+    event is either ``done`` with the stored scene or ``error``. ``flight``
+    is finished as soon as the scene is stored, before the image wait.
+    """
+    queue: asyncio.Queue[tuple[str, dict] | None] = asyncio.Queue()
+
+    async def on_event(event: str, data: dict) -> None:
+        await queue.put((event, data))
+
+    async def run() -> None:
+        nonlocal flight
+        try:
+            async with AsyncSessionLocal() as db:
+                session = await load_step_session(db, session_id)
+                scene = await create_and_store_scene(
+                    db, session, choice_text, on_event=on_event
+                )
+                if flight is not None:
+                    await flight.finish(scene.id)
+                    flight = None
+                if scene.image_status == "pending":
+                    await wait_for_scene_image(scene.id, timeout=settings.request_timeout * 3)
+                    await db.refresh(scene)
+                    await on_event("image_ready", {"image": scene.image_path})
+                out = scene_to_out(scene)
+                await queue.put(("done", out.model_dump()))
+        except Exception as exc:
+            logger.exception("Streaming scene generation failed for %s", session_id)
+            await queue.put(("error", {"detail": str(exc)}))
+            if flight is not None:
+                await flight.fail(exc)
+                flight = None
+        finally:
+            if flight is not None:
+                await flight.fail(RuntimeError("scene generation interrupted"))
+            await queue.put(None)
+
+    task = asyncio.create_task(run())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    while (item := await queue.get()) is not None:
+        yield item
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
-import base64
-import os
 
+from src.game.images.encoder import public_image_meta
+from src.game.images.storage import image_url
 from src.models.scene import Scene
 
 
@@ -13,38 +13,57 @@ class SceneCreate(BaseModel):
 class SceneOut(BaseModel):
     id: str
     description: str | None = None
-    # Base64 encoded PNG image data (without data URI prefix) to be sent directly to clients
+    # Deprecated: images are no longer inlined, always None
     image_data: str | None = None
 
-    # Deprecated: still present for backward compatibility but will contain None for newly generated scenes
+    # Cacheable URL of the scene image (GET /api/v1/images/{name})
     image_url: str | None = None
+    # Smaller WebP/AVIF variants, original size and a blurred placeholder
+    image_meta: dict | None = None
+    # "pending" means the image is still being generated, poll the image endpoint
+    image_status: str | None = None
     choices_json: dict | None = None
 
     class Config:
         from_attributes = True
 
-def _encode_image_to_b64(image_path: str | None) -> str | None:
-    """Read image file and return base64-encoded string or None if not found."""
 
-    if not image_path:
-        return None
-    try:
-        if os.path.exists(image_path):
-            with open(image_path, "rb") as f:
-                return base64.b64encode(f.read()).decode("utf-8")
-    except Exception:
-        # In case of any IO errors, fall back to None
-        return None
-    return None
+class SceneHistoryItem(BaseModel):
+    """History entry; only the fields requested with ``fields=`` are set."""
+
+    id: str | None = None
+    order_num: int | None = None
+    description: str | None = None
+    # Where to fetch the image instead of inlining it
+    image_url: str | None = None
+    image_meta: dict | None = None
+    image_status: str | None = None
+    choices_json: dict | None = None
+
+
+class HistoryPage(BaseModel):
+    items: list[SceneHistoryItem]
+    # Pass as ``after`` to get the next page; None on the last page
+    next_cursor: int | None = None
+
+
+class SceneImageOut(BaseModel):
+    id: str
+    image_status: str | None = None
+    image_url: str | None = None
+    image_meta: dict | None = None
+    # Deprecated: always None, fetch ``image_url`` instead
+    image_data: str | None = None
 
 
 def scene_to_out(scene: Scene) -> SceneOut:
-    """Convert Scene ORM instance to SceneOut schema including image data."""
+    """Convert Scene ORM instance to SceneOut schema with an image URL."""
 
     return SceneOut(
         id=str(scene.id),
         description=scene.description,
-        image_url=None,  # Deprecated – always None for new responses
-        image_data=_encode_image_to_b64(scene.image_path),
+        image_url=image_url(scene.image_path),
+        image_meta=public_image_meta(scene.image_meta),
+        image_status=scene.image_status,
         choices_json=scene.generated_choices,
     )
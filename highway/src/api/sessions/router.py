@@ -10,11 +10,13 @@ from src.core.database import get_session
 from src.models.game_session import GameSession
 from src.models.scene import Scene
 from src.models.story import Story
-from src.api.scenes.scene_service import create_and_store_scene
+from src.api.scenes.scene_service import create_and_store_scene, load_step_session
 from .schemas import SessionCreate, SessionOut
 from src.api.scenes.schemas import SceneOut, scene_to_out
+from src.api.idempotency import idempotency_key, run_idempotent
 from src.api.utils import resolve_user_id
-from src.game.agent.mongo_state import reset_user_state
+from src.game.agent.mongo_state import reset_session_state
+from src.game.agent.pregen import discard_pregenerated
 
 router = APIRouter(prefix="/api/v1/sessions", tags=["sessions"])
 
@@ -24,10 +26,27 @@ async def create_session(
     payload: SessionCreate,
     tg_id: int = Depends(authenticated_user),
     db: AsyncSession = Depends(get_session),
+    key: str | None = Depends(idempotency_key),
 ) -> SessionOut:
-    """Create a new gameplay session."""
+    """Create a new gameplay session.
+
+    A retry with the same ``Idempotency-Key`` returns the session created by
+    the first attempt.
+    """
+
+    user_id = await resolve_user_id(tg_id)
+    result = await run_idempotent(
+        key,
+        f"{user_id}:session",
+        payload.model_dump(),
+        lambda: _create_session(db, user_id, payload),
+    )
+    return SessionOut.model_validate(result)
+
 
-    user_id = await resolve_user_id(tg_id, db)
+async def _create_session(
+    db: AsyncSession, user_id: int, payload: SessionCreate
+) -> dict:
     story_id = uuid.UUID(payload.story_id) if payload.story_id else None
 
     # For custom sessions without explicit story_id, use the most recently
@@ -43,18 +62,13 @@ async def create_session(
         if not story_id:
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail="story_not_found")
 
-    session_obj = GameSession(user_id=user_id, story_id=story_id)
+    session_obj = GameSession(user_id=user_id, story_id=story_id, scene_count=0)
     db.add(session_obj)
     await db.commit()
-    await db.refresh(session_obj)
 
-    # Ensure a fresh per-user in-progress state
-    await reset_user_state(str(user_id))
-
-    story = await db.get(Story, story_id)
-    if story:
-        await db.refresh(story, ["world"])
-        await create_and_store_scene(db, session_obj, None, story)
+    session_obj = await load_step_session(db, session_obj.id)
+    if session_obj.story:
+        await create_and_store_scene(db, session_obj, None)
 
     return SessionOut(
         id=str(session_obj.id),
@@ -62,7 +76,7 @@ async def create_session(
         share_code=str(session_obj.share_code),
         story_frame=session_obj.story_frame,
         is_finished=session_obj.is_finished,
-    )
+    ).model_dump(mode="json")
 
 
 @router.get("/{id}/", response_model=SceneOut | None)
@@ -100,5 +114,7 @@ async def delete_session(
     session_obj = await db.get(GameSession, sid)
     if not session_obj:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    discard_pregenerated(id)
     await db.delete(session_obj)
     await db.commit()
+    await reset_session_state(id)
@@ -10,7 +10,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src.auth.tg_auth import authenticated_user
 from src.api.utils import ensure_admin, resolve_user_id, get_localized
 from src.config import settings
-from src.core.database import get_session
+from src.core.database import AsyncSessionLocal, get_session
 from src.models.story import Story
 from src.models.world import World
 from src.models.user import User
@@ -18,11 +18,13 @@ from src.models.game_session import GameSession
 from src.models.scene import Scene
 from src.models.choice import Choice
 from pydantic import BaseModel, Field
-from src.utils.cache import AsyncTTLCache, cached, invalidate_prefix
+from src.core.redis_client import get_redis
+from src.api.worlds.router import _get_worlds_cache
+from src.utils.cache import AsyncTTLCache, RedisCacheTier, cached, clear_cache, invalidate_tags
 
 router = APIRouter(prefix="/api/v1", tags=["stories"])
 
-# In-process cache for stories lists and individual stories
+# Cache for stories lists and individual stories, shared via Redis
 _stories_cache: AsyncTTLCache | None = None
 
 
@@ -34,6 +36,10 @@ def _get_stories_cache() -> AsyncTTLCache | None:
         _stories_cache = AsyncTTLCache(
             max_items=settings.cache_max_items,
             ttl_seconds=settings.stories_cache_ttl_seconds,
+            stale_seconds=settings.stories_cache_stale_seconds,
+            negative_ttl_seconds=settings.cache_negative_ttl_seconds,
+            shared=RedisCacheTier("stories", get_redis),
+            name="stories",
         )
     return _stories_cache
 
@@ -72,41 +78,67 @@ def story_to_out(story: Story, lang: str) -> StoryOut:
     )
 
 
+# Cached loaders open their own DB session: a stale entry is refreshed in
+# the background, after the request that triggered it has finished
+
+
+@cached(
+    _get_stories_cache,
+    include=["lang", "world_id"],
+    prefix="stories:list",
+    tags={"world": "world_id", "lang": "lang"},
+)
+async def _load_stories(world_id: str, lang: str) -> list[StoryOut]:
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(
+            select(Story).where(Story.world_id == uuid.UUID(world_id))
+        )
+        stories = list(res.scalars())
+    return [story_to_out(s, lang) for s in stories]
+
+
+@cached(
+    _get_stories_cache,
+    include=["lang"],
+    prefix="stories:list_preset",
+    tags={"lang": "lang"},
+)
+async def _load_preset_stories(lang: str) -> list[StoryOut]:
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(
+            select(Story).where(Story.is_preset.is_(True), Story.is_free.is_(True))
+        )
+        stories = list(res.scalars())
+    return [story_to_out(s, lang) for s in stories]
+
+
+@cached(
+    _get_stories_cache,
+    include=["lang", "story_id"],
+    prefix="stories:get",
+    tags={"story": "story_id", "lang": "lang"},
+)
+async def _load_story(story_id: str, lang: str) -> StoryOut | None:
+    async with AsyncSessionLocal() as db:
+        obj = await db.get(Story, uuid.UUID(story_id))
+    return story_to_out(obj, lang) if obj else None
+
+
 @router.get("/worlds/{world_id}/stories/", response_model=list[StoryOut])
-@cached(_get_stories_cache, include=["lang", "world_id"], prefix="stories:list")
-async def list_stories(
-    world_id: str, lang: str = "ru", db: AsyncSession = Depends(get_session)
-) -> list[StoryOut]:
-    res = await db.execute(
-        select(Story).where(Story.world_id == uuid.UUID(world_id))
-    )
-    stories = list(res.scalars())
-    result = [story_to_out(s, lang) for s in stories]
-    return result
+async def list_stories(world_id: str, lang: str = "ru") -> list[StoryOut]:
+    return await _load_stories(world_id, lang)
 
 
 @router.get("/stories/preset/", response_model=list[StoryOut])
-@cached(_get_stories_cache, include=["lang"], prefix="stories:list_preset")
-async def list_preset_stories(
-    lang: str = "ru", db: AsyncSession = Depends(get_session)
-) -> list[StoryOut]:
-    res = await db.execute(
-        select(Story).where(Story.is_preset.is_(True), Story.is_free.is_(True))
-    )
-    stories = list(res.scalars())
-    result = [story_to_out(s, lang) for s in stories]
-    return result
+async def list_preset_stories(lang: str = "ru") -> list[StoryOut]:
+    return await _load_preset_stories(lang)
 
 
 @router.get("/stories/{story_id}/", response_model=StoryOut)
-@cached(_get_stories_cache, include=["lang", "story_id"], prefix="stories:get")
-async def get_story(
-    story_id: str, lang: str = "ru", db: AsyncSession = Depends(get_session)
-) -> StoryOut:
-    obj = await db.get(Story, uuid.UUID(story_id))
-    if not obj:
+async def get_story(story_id: str, lang: str = "ru") -> StoryOut:
+    result = await _load_story(story_id, lang)
+    if result is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    result = story_to_out(obj, lang)
     return result
 
 
@@ -117,14 +149,15 @@ async def create_story(
     db: AsyncSession = Depends(get_session),
     lang: str = "ru",
 ) -> StoryOut:
-    user_id = await resolve_user_id(tg_id, db)
+    user_id = await resolve_user_id(tg_id)
     user = await db.get(User, user_id)
     cost = settings.create_story_cost
     if not user or user.wishes < cost:
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="not_enough_wishes")
     res = await db.execute(select(World).where(World.user_id == user_id))
     world = res.scalars().first()
-    if not world:
+    new_world = world is None
+    if new_world:
         world = World(
             user_id=user_id,
             title={"en": "Your Stories", "ru": "Твои истории"},
@@ -138,8 +171,10 @@ async def create_story(
     db.add(story)
     await db.commit()
     await db.refresh(story)
-    # Invalidate relevant caches
-    await invalidate_prefix(_get_stories_cache, "stories:")
+    # Only the story list of the user's world changes
+    await invalidate_tags(_get_stories_cache, f"world:{world.id}")
+    if new_world:
+        await invalidate_tags(_get_worlds_cache, f"user:{tg_id}")
     return story_to_out(story, lang)
 
 
@@ -165,8 +200,6 @@ async def _import_presets(db: AsyncSession, data: dict) -> None:
     await db.execute(delete(Story).where(Story.id.in_(preset_story_ids)))
     await db.execute(delete(World).where(World.is_preset.is_(True)))
     await db.commit()
-    # Invalidate all stories cache after full preset import
-    await invalidate_prefix(_get_stories_cache, "stories:")
 
     for w in data["worlds"]:
         world = World(
@@ -197,6 +230,10 @@ async def _import_presets(db: AsyncSession, data: dict) -> None:
             )
             db.add(story)
     await db.commit()
+    # Every preset world and story was replaced; clear only after the new
+    # ones are committed so readers cannot cache the empty catalog
+    await clear_cache(_get_stories_cache)
+    await clear_cache(_get_worlds_cache)
 
 
 @router.post("/presets/upload/", status_code=status.HTTP_201_CREATED)
@@ -4,21 +4,15 @@ import os
 from fastapi import HTTPException, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from src.api.identity import UserContext, get_user_context, is_pro_subscription
 from src.models.subscription import Subscription
 from src.config import settings
 from src.models.user import User
 
 
-async def resolve_user_id(tg_id: int | None, db: AsyncSession) -> int:
-    """Resolve the user ID from the request."""
-    result = await db.execute(select(User).where(User.tg_id == int(tg_id)))
-    user = result.scalar_one_or_none()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found",
-        )
-    return user.id
+async def resolve_user_id(tg_id: int | None) -> int:
+    """Resolve the user ID from the request (cached, see src.api.identity)."""
+    return (await get_user_context(tg_id)).id
 
 async def has_pro_plan(db: AsyncSession, user_id: int) -> bool:
     """Check if the user has an active Pro subscription."""
@@ -28,23 +22,27 @@ async def has_pro_plan(db: AsyncSession, user_id: int) -> bool:
         .order_by(Subscription.started_at.desc())
     )
     sub = res.scalars().first()
-    return sub and sub.plan == "pro" and sub.status == "active"
+    return sub is not None and is_pro_subscription(sub.plan, sub.status, sub.expires_at)
+
 
+def is_pro_user(user: User) -> bool:
+    """Same check as :func:`has_pro_plan` on eagerly loaded subscriptions."""
+    if not user.subscriptions:
+        return False
+    sub = max(user.subscriptions, key=lambda s: s.started_at)
+    return is_pro_subscription(sub.plan, sub.status, sub.expires_at)
 
-async def ensure_pro_plan(db: AsyncSession, user_id: int) -> None:
+
+async def ensure_pro_plan(tg_id: int) -> UserContext:
     """Raise 403 if the user doesn't have an active Pro subscription."""
 
-    res = await db.execute(
-        select(Subscription)
-        .where(Subscription.user_id == user_id)
-        .order_by(Subscription.started_at.desc())
-    )
-    sub = res.scalars().first()
-    if not sub or sub.plan != "pro" or sub.status != "active":
+    user = await get_user_context(tg_id)
+    if not user.is_pro:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Feature available only on the Pro plan",
         )
+    return user
 
 
 def ensure_admin(tg_id: int) -> None:
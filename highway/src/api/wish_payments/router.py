@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src.core.database import get_session
 from sqlalchemy import select
 from src.utils.tg_invoice import export_tg_invoice
+from src.api.identity import invalidate_user_context
 from src.api.utils import resolve_user_id
 from src.auth.tg_auth import authenticated_user
 from src.models.bundle_purchase import BundlePurchase
@@ -144,6 +145,8 @@ async def confirm_bundle(
         user.wishes += bundle_data.wishes
     sub.status = "active"
     await db.commit()
+    if user:
+        await invalidate_user_context(user.tg_id)
     await db.refresh(sub)
     logger.info(f"Successfully confirmed bundle for user {sub.user_id}!")
     return {"status": "success"}
@@ -156,7 +159,7 @@ async def buy_bundle(
     db: AsyncSession = Depends(get_session),
 ) -> dict:
     """Initiate a bundle purchase."""
-    user_id = await resolve_user_id(tg_id, db)
+    user_id = await resolve_user_id(tg_id)
     logger.info(f"Initiating bundle purchase for tg user {tg_id}")
     bundles_list = await bundles()
     bundle_data = next((p for p in bundles_list if p.id == bundle), None)
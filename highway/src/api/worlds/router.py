@@ -8,15 +8,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.tg_auth import authenticated_user
 from src.api.utils import ensure_pro_plan, resolve_user_id, get_localized
-from src.core.database import get_session
+from src.core.database import AsyncSessionLocal, get_session
 from src.config import settings
-from src.utils.cache import AsyncTTLCache, cached, invalidate_prefix
+from src.core.redis_client import get_redis
+from src.utils.cache import AsyncTTLCache, RedisCacheTier, cached, invalidate_tags
 from src.models.world import World
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/v1/worlds", tags=["worlds"])
 
-# In-process cache for worlds listings and individual world fetches
+# Cache for worlds listings and individual world fetches, shared via Redis
 _worlds_cache: AsyncTTLCache | None = None
 
 
@@ -28,6 +29,10 @@ def _get_worlds_cache() -> AsyncTTLCache | None:
         _worlds_cache = AsyncTTLCache(
             max_items=settings.cache_max_items,
             ttl_seconds=settings.worlds_cache_ttl_seconds,
+            stale_seconds=settings.worlds_cache_stale_seconds,
+            negative_ttl_seconds=settings.cache_negative_ttl_seconds,
+            shared=RedisCacheTier("worlds", get_redis),
+            name="worlds",
         )
     return _worlds_cache
 
@@ -48,20 +53,25 @@ class WorldCreate(BaseModel):
     is_free: bool | None = None
 
 
-@router.get("/", response_model=list[WorldOut])
-@cached(_get_worlds_cache, include=["lang", "tg_id"], prefix="worlds:list")
-async def list_worlds(
-    lang: str = "ru",
-    tg_id: int = Depends(authenticated_user),
-    db: AsyncSession = Depends(get_session),
-) -> list[WorldOut]:
-    user_id = await resolve_user_id(tg_id, db)
-    res = await db.execute(
-        select(World).where(
-            (World.is_preset.is_(True)) | (World.user_id == user_id)
+# Cached loaders open their own DB session: a stale entry is refreshed in
+# the background, after the request that triggered it has finished
+
+
+@cached(
+    _get_worlds_cache,
+    include=["lang", "tg_id"],
+    prefix="worlds:list",
+    tags={"user": "tg_id", "lang": "lang"},
+)
+async def _load_worlds(lang: str, tg_id: int) -> list[WorldOut]:
+    user_id = await resolve_user_id(tg_id)
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(
+            select(World).where(
+                (World.is_preset.is_(True)) | (World.user_id == user_id)
+            )
         )
-    )
-    worlds = list(res.scalars())
+        worlds = list(res.scalars())
     result = [
         WorldOut(
             id=w.id,
@@ -76,14 +86,17 @@ async def list_worlds(
     return result
 
 
-@router.get("/{world_id}/", response_model=WorldOut)
-@cached(_get_worlds_cache, include=["lang", "world_id"], prefix="worlds:get")
-async def get_world(
-    world_id: str, lang: str = "ru", db: AsyncSession = Depends(get_session)
-) -> WorldOut:
-    obj = await db.get(World, uuid.UUID(world_id))
+@cached(
+    _get_worlds_cache,
+    include=["lang", "world_id"],
+    prefix="worlds:get",
+    tags={"world": "world_id", "lang": "lang"},
+)
+async def _load_world(world_id: str, lang: str) -> WorldOut | None:
+    async with AsyncSessionLocal() as db:
+        obj = await db.get(World, uuid.UUID(world_id))
     if not obj:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        return None
     result = WorldOut(
         id=obj.id,
         title=get_localized(obj.title, lang),
@@ -95,6 +108,22 @@ async def get_world(
     return result
 
 
+@router.get("/", response_model=list[WorldOut])
+async def list_worlds(
+    lang: str = "ru",
+    tg_id: int = Depends(authenticated_user),
+) -> list[WorldOut]:
+    return await _load_worlds(lang, tg_id)
+
+
+@router.get("/{world_id}/", response_model=WorldOut)
+async def get_world(world_id: str, lang: str = "ru") -> WorldOut:
+    result = await _load_world(world_id, lang)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return result
+
+
 @router.post("/", response_model=WorldOut, status_code=status.HTTP_201_CREATED)
 async def create_world(
     payload: WorldCreate,
@@ -102,14 +131,13 @@ async def create_world(
     db: AsyncSession = Depends(get_session),
     lang: str = "ru",
 ) -> WorldOut:
-    user_id = await resolve_user_id(tg_id, db)
-    await ensure_pro_plan(db, user_id)
-    world = World(user_id=user_id, **payload.model_dump())
+    user = await ensure_pro_plan(tg_id)
+    world = World(user_id=user.id, **payload.model_dump())
     db.add(world)
     await db.commit()
     await db.refresh(world)
-    # Invalidate caches related to this user and worlds
-    await invalidate_prefix(_get_worlds_cache, "worlds:")
+    # Only this user's world list changes
+    await invalidate_tags(_get_worlds_cache, f"user:{tg_id}")
 
     return WorldOut(
         id=world.id,
@@ -28,10 +28,59 @@ class AppSettings(BaseAppSettings):
     mongodb_uri: str = "mongodb://mongo:27017"
     mongodb_db: str = "immersia"
     mongodb_collection: str = "user_states"
+    state_cache_max_items: int = 2048
+    # Scenes kept inline in UserState; older ones go to the archive collection
+    hot_scene_window: int = 3
+    mongodb_scene_archive_collection: str = "scene_archive"
+    # Cross-worker locks; leave empty to coordinate within one process only
+    redis_url: str | None = "redis://redis:6379/0"
+    # A scene step holds its session lock at most this long
+    session_lock_ttl_seconds: int = 300
+    # How long a finished step stays joinable for duplicates on other workers
+    session_result_ttl_seconds: int = 60
+    # Results replayed for a repeated Idempotency-Key
+    idempotency_ttl_seconds: int = 86400
     top_p: float = 0.95
     temperature: float = 0.5
     pregenerate_next_scene: bool = True
+    # Speculative branches not taken within this window are dropped
+    pregenerate_ttl_seconds: int = 900
     request_timeout: int = 20
+    # Total time budget for the LLM calls of one scene step
+    scene_step_deadline_seconds: float = 90
+    # Start a duplicate scene/ending request once a call is slower than this
+    # latency percentile of recent ones (e.g. 0.95); 0 disables hedging
+    llm_hedge_percentile: float = 0
+    # API key scheduling: per-key request budget (0 = unlimited) and the
+    # cooldown applied after a 429, doubled on each consecutive one
+    api_key_rpm: int = 0
+    api_key_cooldown_seconds: float = 30
+    api_key_max_cooldown_seconds: float = 300
+    # Share key cooldowns between workers through MongoDB
+    api_key_shared_state: bool = False
+    # One LLM call for image prompt + NPC updates; False keeps two separate agents
+    fuse_scene_post_processing: bool = True
+    # Story memory: choices kept verbatim in prompts, older ones are
+    # folded into a summary once this many have piled up
+    memory_recent_choices: int = 6
+    memory_refresh_every: int = 4
+    # Send the static story-frame block as cached provider context; blocks
+    # below the provider minimum are always sent inline
+    context_cache_enabled: bool = True
+    context_cache_ttl_seconds: int = 1800
+    context_cache_min_tokens: int = 1024
+    # Internal nginx location (e.g. "/_images/") aliased to generated/images;
+    # when set, image bodies are sent by nginx via X-Accel-Redirect
+    image_accel_redirect_prefix: str | None = None
+    # Widths written for every generated image; the widest is the scene image
+    image_variant_widths: dict[str, int] = {"telegram": 1280, "app": 720, "thumb": 240}
+    image_quality: int = 80
+    # Also write AVIF next to WebP when Pillow supports it
+    image_avif: bool = False
+    # Processes encoding image variants; 0 encodes in a thread instead
+    image_encoder_workers: int = 2
+    # Store scenes right away and attach images from a background job
+    async_scene_images: bool = False
     bot_server_url: str = "http://bot:7000"
     admin_ids: list[int] = []
 
@@ -51,9 +100,19 @@ class AppSettings(BaseAppSettings):
     # In-process caching controls
     cache_enabled: bool = True
     cache_max_items: int = 1024
+    # Soft TTL: entries older than this are refreshed in the background.
     # Set to 0 for unlimited (no TTL expiration)
-    worlds_cache_ttl_seconds: int = 0
-    stories_cache_ttl_seconds: int = 0
+    worlds_cache_ttl_seconds: int = 300
+    stories_cache_ttl_seconds: int = 300
+    # How long past the soft TTL a stale entry may still be served
+    worlds_cache_stale_seconds: int = 3600
+    stories_cache_stale_seconds: int = 3600
+    # Remember missing worlds/stories this long; 0 disables negative caching
+    cache_negative_ttl_seconds: int = 30
+    # Snapshot of user id, language, image format and Pro status per tg_id;
+    # profile, payment and admin writes invalidate it explicitly
+    identity_cache_ttl_seconds: int = 300
+    identity_cache_max_items: int = 10000
 
 
 settings = AppSettings()
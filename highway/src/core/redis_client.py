@@ -0,0 +1,33 @@
+"""Shared Redis connection used for cross-worker coordination."""
+
+from typing import TYPE_CHECKING
+
+from src.config import settings
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+_client: "Redis | None" = None
+
+
+def get_redis() -> "Redis | None":
+    """Return the shared client, or ``None`` when Redis is not configured.
+
+    Callers fall back to process-local behaviour without Redis, which is
+    correct for a single worker.
+    """
+    global _client
+    if not settings.redis_url:
+        return None
+    if _client is None:
+        import redis.asyncio as redis
+
+        _client = redis.from_url(settings.redis_url, decode_responses=True)
+    return _client
+
+
+async def close_redis() -> None:
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
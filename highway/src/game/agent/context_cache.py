@@ -0,0 +1,300 @@
+"""Per-session caching of the static story-frame prompt block.
+
+Lore, goal, milestones, endings, visual style, main character and NPCs are
+the same for every call of a session. The block is rendered once, uploaded
+as provider-side cached content and referenced by name; the prompt then
+carries only a short note instead of the block. When caching is disabled,
+the block is too small for the provider, or the cache cannot be used, the
+block is sent inline as before.
+"""
+
+import asyncio
+import functools
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Protocol, TypeVar
+
+from google import genai
+from google.genai import types
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableSequence
+from pydantic import BaseModel
+
+from src.config import settings
+from src.game.agent.llm import MODEL_NAME, create_llm
+from src.game.agent.models import ContextCacheHandle, NPCCharacter, StoryFrame, UserState
+from src.game.agent.prompts import CACHED_STORY_CONTEXT_NOTE, STORY_CONTEXT_PROMPT
+from src.game.agent.utils import (
+    DEFAULT_RETRY_POLICY,
+    RetryPolicy,
+    approx_tokens,
+    log_prompt_size,
+    with_retries,
+)
+from src.game.services.google import key_pool
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+# Recreate a cache a little before the provider drops it
+EXPIRY_MARGIN_SECONDS = 60
+# After a failed create, send the block inline for this long before retrying
+FAILED_RETRY_SECONDS = 300
+
+
+def render_npcs(npcs: list[NPCCharacter]) -> str:
+    if not npcs:
+        return "(none)"
+    return "\n".join(
+        f"{c.char_name} | age:{c.char_age} | persona:{c.char_personality} | bg:{c.char_background} | visual:{c.visual_description}"
+        for c in npcs
+    )
+
+
+def render_story_context(frame: StoryFrame) -> str:
+    """Render the static settings block shared by all agent prompts."""
+    return STORY_CONTEXT_PROMPT.format(
+        lore=frame.lore,
+        goal=frame.goal,
+        milestones=",".join(m.id for m in frame.milestones),
+        endings=",".join(e.id for e in frame.endings),
+        visual_style=frame.visual_style,
+        main_character=frame.character,
+        npc_characters=render_npcs(frame.npc_characters),
+    )
+
+
+def _fingerprint(text: str) -> str:
+    # NPC changes alter the rendered block and so invalidate the cache
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+@dataclass
+class StoryContext:
+    """What a prompt should use for the ``{game_settings}`` placeholder."""
+
+    text: str
+    cached_content: str | None = None
+    # Cached content only exists for the key that created it
+    api_key: str | None = None
+
+
+class ContextCacheProvider(Protocol):
+    async def create(self, api_key: str, model: str, text: str, ttl_seconds: int) -> str:
+        """Upload ``text`` and return the cache name."""
+        ...
+
+
+class GeminiContextCacheProvider:
+    """Gemini API cached contents, one client per API key."""
+
+    def __init__(self) -> None:
+        self._clients: dict[str, genai.Client] = {}
+
+    def _client(self, api_key: str) -> genai.Client:
+        client = self._clients.get(api_key)
+        if client is None:
+            client = self._clients[api_key] = genai.Client(api_key=api_key)
+        return client
+
+    async def create(self, api_key: str, model: str, text: str, ttl_seconds: int) -> str:
+        cache = await self._client(api_key).aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part(text=text)])],
+                ttl=f"{ttl_seconds}s",
+            ),
+        )
+        return cache.name
+
+    async def close(self) -> None:
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aio.aclose()
+
+
+class FakeContextCacheProvider:
+    """In-memory provider for tests and offline runs."""
+
+    def __init__(self) -> None:
+        self.contents: dict[str, str] = {}
+
+    async def create(self, api_key: str, model: str, text: str, ttl_seconds: int) -> str:
+        name = f"cachedContents/fake-{len(self.contents) + 1}"
+        self.contents[name] = text
+        return name
+
+
+@dataclass
+class ContextCacheStats:
+    hits: int = 0
+    misses: int = 0
+    created: int = 0
+    failed: int = 0
+    inline: int = 0
+    tokens_saved: int = 0
+
+
+class StoryContextCache:
+    """Resolve the story context of a session, creating caches on demand.
+
+    The handle lives on ``UserState.context_cache`` so it survives across
+    requests and workers. Concurrent calls of the same step share one
+    create request.
+    """
+
+    def __init__(self, provider: ContextCacheProvider) -> None:
+        self.provider = provider
+        self.stats = ContextCacheStats()
+        self._creating: dict[str, asyncio.Task] = {}
+
+    async def resolve(self, state: UserState) -> StoryContext:
+        text = render_story_context(state.story_frame)
+        if not settings.context_cache_enabled:
+            return StoryContext(text)
+        fingerprint = _fingerprint(text)
+        handle = state.context_cache
+        if (
+            handle is None
+            or handle.fingerprint != fingerprint
+            or handle.expires_at - time.time() < EXPIRY_MARGIN_SECONDS
+        ):
+            self.stats.misses += 1
+            handle = await self._refresh(text, fingerprint)
+            state.context_cache = handle
+        api_key = key_pool.key_for_id(handle.key_id) if handle.name else None
+        if api_key is None:
+            self.stats.inline += 1
+            return StoryContext(text)
+        self.stats.hits += 1
+        self.stats.tokens_saved += handle.tokens
+        return StoryContext(CACHED_STORY_CONTEXT_NOTE, handle.name, api_key)
+
+    def invalidate(self, state: UserState) -> None:
+        """Stop using the session's cache, e.g. after the provider rejected it."""
+        handle = state.context_cache
+        if handle is not None:
+            state.context_cache = ContextCacheHandle(
+                fingerprint=handle.fingerprint,
+                expires_at=time.time() + FAILED_RETRY_SECONDS,
+                tokens=handle.tokens,
+            )
+
+    async def _refresh(self, text: str, fingerprint: str) -> ContextCacheHandle:
+        task = self._creating.get(fingerprint)
+        if task is None:
+            task = asyncio.create_task(self._create(text, fingerprint))
+            self._creating[fingerprint] = task
+            task.add_done_callback(lambda _: self._creating.pop(fingerprint, None))
+        return await asyncio.shield(task)
+
+    async def _create(self, text: str, fingerprint: str) -> ContextCacheHandle:
+        tokens = approx_tokens(text)
+        now = time.time()
+        ttl = settings.context_cache_ttl_seconds
+        if tokens < settings.context_cache_min_tokens:
+            return ContextCacheHandle(fingerprint=fingerprint, expires_at=now + ttl, tokens=tokens)
+        api_key = key_pool.get_key_sync()
+        try:
+            name = await asyncio.wait_for(
+                self.provider.create(api_key, MODEL_NAME, text, ttl),
+                timeout=settings.request_timeout,
+            )
+        except Exception as exc:
+            self.stats.failed += 1
+            logger.warning("Context cache create failed, sending inline: %s", exc)
+            return ContextCacheHandle(
+                fingerprint=fingerprint,
+                expires_at=now + FAILED_RETRY_SECONDS,
+                tokens=tokens,
+            )
+        self.stats.created += 1
+        logger.info("Created context cache %s (~%d tokens)", name, tokens)
+        return ContextCacheHandle(
+            name=name,
+            key_id=key_pool.key_id(api_key),
+            fingerprint=fingerprint,
+            expires_at=now + ttl,
+            tokens=tokens,
+        )
+
+
+def _structured(llm, schema: type[M], cached_content: str | None):
+    if cached_content is None:
+        return llm.with_structured_output(schema)
+    # Cached content cannot be combined with function calling, so ask for
+    # schema-constrained JSON instead
+    bound, *rest = llm.with_structured_output(schema, method="json_mode").steps
+    return RunnableSequence(bound.bind(cached_content=cached_content), *rest)
+
+
+def _without_system(messages: Any) -> Any:
+    # Requests that use cached content may not set a system instruction
+    if isinstance(messages, str):
+        return messages
+    return [
+        HumanMessage(content=m.content) if isinstance(m, SystemMessage) else m
+        for m in messages
+    ]
+
+
+_cache = StoryContextCache(GeminiContextCacheProvider())
+
+
+async def story_context(state: UserState) -> StoryContext:
+    return await _cache.resolve(state)
+
+
+async def invoke_with_story_context(
+    state: UserState,
+    build_prompt: Callable[[str], str | list[BaseMessage]],
+    schema: type[M],
+    llm_factory: Callable[..., Any] = create_llm,
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    name: str | None = None,
+) -> M:
+    """Call the model for ``schema`` with the story context of ``state``.
+
+    ``build_prompt`` receives the value for ``{game_settings}``. If the
+    cached call fails, the cache is dropped and the call is repeated with
+    the block inline.
+    """
+    context = await _cache.resolve(state)
+
+    async def call(context: StoryContext) -> M:
+        prompt = build_prompt(context.text)
+        if name:
+            text = prompt if isinstance(prompt, str) else "\n".join(str(m.content) for m in prompt)
+            log_prompt_size(name, text)
+        if context.cached_content is None:
+            factory = llm_factory
+        else:
+            prompt = _without_system(prompt)
+            factory = functools.partial(llm_factory, api_key=context.api_key)
+        return await with_retries(
+            lambda: _structured(factory(), schema, context.cached_content).ainvoke(prompt),
+            policy,
+            name=name,
+        )
+
+    if context.cached_content is None:
+        return await call(context)
+    try:
+        return await call(context)
+    except Exception as exc:
+        logger.warning("Cached context call failed, retrying inline: %s", exc)
+        _cache.invalidate(state)
+        return await call(StoryContext(render_story_context(state.story_frame)))
+
+
+def context_cache_stats() -> ContextCacheStats:
+    return _cache.stats
+
+
+async def close_context_cache() -> None:
+    provider = _cache.provider
+    if isinstance(provider, GeminiContextCacheProvider):
+        await provider.close()
@@ -1,10 +1,12 @@
 from pydantic import BaseModel, Field
+from functools import partial
 from typing import Optional
 from src.game.agent.llm import create_light_llm
 from langchain_core.messages import SystemMessage, HumanMessage
 from src.game.agent.prompts import GAME_STATE_PROMPT
 import logging
-from src.game.agent.utils import with_retries
+from src.game.agent.context_cache import invoke_with_story_context
+from src.game.agent.memory import render_history
 from src.game.agent.models import UserState
 
 logger = logging.getLogger(__name__)
@@ -71,29 +73,20 @@ async def generate_image_prompt(state: UserState, scene_description: str, last_c
     Generates a detailed image prompt string based on a scene description.
     This prompt is intended for use with an AI image generation model.
     """
-    scene = GAME_STATE_PROMPT.format(
-        lore=state.story_frame.lore,
-        goal=state.story_frame.goal,
-        milestones=",".join(m.id for m in state.story_frame.milestones),
-        endings=",".join(e.id for e in state.story_frame.endings),
-        history="; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices),
-        last_choice=last_choice,
-        scene_description=scene_description,
-        image_description=state.last_image_prompt or "No image description yet",
-        visual_style=state.story_frame.visual_style,
-        npc_characters="\n".join(
-            f"{c.char_name}: {c.visual_description}" for c in state.story_frame.npc_characters
-        ),
-        main_character=state.story_frame.character,
-    )
-    
-    image_prompt_generator_llm = create_light_llm(0.1).with_structured_output(ChangeScene)
-
-    response = await with_retries(lambda: image_prompt_generator_llm.ainvoke(
-        [
+    def build_prompt(game_settings: str) -> list:
+        scene = GAME_STATE_PROMPT.format(
+            game_settings=game_settings,
+            history=render_history(state),
+            last_choice=last_choice,
+            scene_description=scene_description,
+        )
+        return [
             SystemMessage(content=IMAGE_GENERATION_SYSTEM_PROMPT),
             HumanMessage(content=scene),
         ]
-    ))
+
+    response = await invoke_with_story_context(
+        state, build_prompt, ChangeScene, partial(create_light_llm, 0.1)
+    )
     logger.debug("Image prompt generated")
     return response
@@ -1,52 +1,125 @@
 """Utility functions for working with the language model."""
 import logging
+import threading
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 from src.config import settings
-from src.game.services.google import ApiKeyPool
+from src.game.services.google import key_pool
 
 logger = logging.getLogger(__name__)
 
-_pool = ApiKeyPool()
+_pool = key_pool
 MODEL_NAME = "gemini-2.5-flash"
 
 
 def _get_api_key() -> str:
-    """Return an API key using round-robin selection in a thread-safe way."""
+    """Return the least-loaded healthy API key in a thread-safe way."""
     return _pool.get_key_sync()
 
 
+class LLMClientRegistry:
+    """Reuse chat model clients per (api key, model, sampling params).
+
+    A ``ChatGoogleGenerativeAI`` owns its gRPC channels, so sharing one
+    instance keeps connections and auth warm across scenes. Instances are
+    safe to share: ``bind``/``with_structured_output`` wrap them without
+    mutating the underlying client.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[tuple, ChatGoogleGenerativeAI] = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str, model: str, **params) -> ChatGoogleGenerativeAI:
+        key = (api_key, model, tuple(sorted(params.items())))
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = ChatGoogleGenerativeAI(
+                    model=model,
+                    google_api_key=api_key,
+                    timeout=settings.request_timeout,
+                    # Retries, backoff and deadlines are handled by with_retries
+                    max_retries=1,
+                    callbacks=[_pool.usage_callback(api_key)],
+                    **params,
+                )
+                self._clients[key] = client
+                logger.debug("Created LLM client for %s %s", model, params)
+            return client
+
+    async def close(self) -> None:
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                if client.async_client_running is not None:
+                    await client.async_client_running.transport.close()
+                if client.client is not None:
+                    client.client.transport.close()
+            except Exception:
+                logger.exception("Failed to close LLM client")
+
+
+_registry = LLMClientRegistry()
+
+
+def _standard_llm(api_key: str, temperature: float, top_p: float) -> ChatGoogleGenerativeAI:
+    return _registry.get(
+        api_key, MODEL_NAME, temperature=temperature, top_p=top_p, thinking_budget=1024
+    )
+
+
+def _light_llm(api_key: str, temperature: float, top_p: float) -> ChatGoogleGenerativeAI:
+    return _registry.get(api_key, MODEL_NAME, temperature=temperature, top_p=top_p)
+
+
 def create_llm(
     temperature: float = settings.temperature,
     top_p: float = settings.top_p,
+    api_key: str | None = None,
 ) -> ChatGoogleGenerativeAI:
-    """Create a standard LLM instance."""
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL_NAME,
-        google_api_key=_get_api_key(),
-        temperature=temperature,
-        top_p=top_p,
-        thinking_budget=1024,
-        timeout=settings.request_timeout,
-        max_retries=3,
-    )
-    return llm
-    
-    
-def create_light_llm(temperature: float = settings.temperature, top_p: float = settings.top_p):
-    """Create a light LLM instance with a shorter timeout."""
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL_NAME,
-        google_api_key=_get_api_key(),
-        temperature=temperature,
-        top_p=top_p,
-        timeout=settings.request_timeout,
-        max_retries=3,
-    )
-    return llm
+    """Return a standard LLM instance.
+
+    ``api_key`` pins the key, e.g. for cached content that only exists
+    for that key.
+    """
+    return _standard_llm(api_key or _get_api_key(), temperature, top_p)
+
+
+def create_light_llm(
+    temperature: float = settings.temperature,
+    top_p: float = settings.top_p,
+    api_key: str | None = None,
+):
+    """Return a light LLM instance without a thinking budget."""
+    return _light_llm(api_key or _get_api_key(), temperature, top_p)
 
 
 def create_precise_llm() -> ChatGoogleGenerativeAI:
     """Return an LLM tuned for deterministic output."""
     return create_llm(temperature=0, top_p=1)
+
+
+def prewarm_llm_clients() -> None:
+    """Build the commonly used clients for every API key."""
+    try:
+        keys = _pool.keys()
+    except ValueError:
+        logger.warning("Skipping LLM client prewarm: no API keys configured")
+        return
+    for key in keys:
+        _standard_llm(key, settings.temperature, settings.top_p)
+        _light_llm(key, settings.temperature, settings.top_p)
+        # Post-processing, NPC and memory agents
+        _light_llm(key, 0.1, settings.top_p)
+    logger.info("Prewarmed LLM clients for %d API keys", len(keys))
+
+
+async def close_llm_clients() -> None:
+    await _registry.close()
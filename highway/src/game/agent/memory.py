@@ -0,0 +1,73 @@
+"""Rolling story memory that keeps prompt size bounded in long sessions.
+
+The newest ``memory_recent_choices`` choices are kept verbatim; older ones are
+folded into ``UserState.memory.summary`` every ``memory_refresh_every`` steps.
+"""
+
+import logging
+
+from src.config import settings
+from src.game.agent.llm import create_light_llm
+from src.game.agent.models import StoryMemory, UserState
+from src.game.agent.prompts import MEMORY_SUMMARY_PROMPT
+from src.game.agent.utils import approx_tokens, with_retries
+
+logger = logging.getLogger(__name__)
+
+
+def render_history(state: UserState) -> str:
+    """Return the history block for prompts: summary plus recent choices."""
+    memory = state.memory
+    recent = state.user_choices[memory.summarized_count:]
+    # Bound the verbatim part even if summarization keeps failing
+    limit = settings.memory_recent_choices + settings.memory_refresh_every
+    recent = recent[-limit:]
+    verbatim = "; ".join(f"{c.scene_id}:{c.choice_text}" for c in recent)
+    if not memory.summary:
+        return verbatim
+    return f"Story so far: {memory.summary}\nRecent choices: {verbatim}"
+
+
+async def _describe_events(state: UserState, start: int, end: int) -> str:
+    choices = state.user_choices[start:end]
+    # These are the oldest choices, so their scenes are usually archived
+    scenes = await state.load_scenes([c.scene_id for c in choices if c.scene_id])
+    lines = []
+    for choice in choices:
+        scene = scenes.get(choice.scene_id)
+        if scene is not None:
+            lines.append(f"Scene: {scene.description}")
+        lines.append(f"Player chose: {choice.choice_text}")
+    return "\n".join(lines)
+
+
+async def refresh_memory(state: UserState, pending_choices: int = 0) -> bool:
+    """Fold choices older than the verbatim window into the summary.
+
+    Does nothing until at least ``memory_refresh_every`` choices are waiting
+    to be folded. ``pending_choices`` counts choices about to be appended,
+    so the summary can be prepared before the next choice is known.
+    Returns True if the summary was updated.
+    """
+    memory = state.memory
+    total = len(state.user_choices)
+    cutoff = min(total + pending_choices - settings.memory_recent_choices, total)
+    if cutoff - memory.summarized_count < settings.memory_refresh_every:
+        return False
+
+    prompt = MEMORY_SUMMARY_PROMPT.format(
+        summary=memory.summary or "(empty)",
+        events=await _describe_events(state, memory.summarized_count, cutoff),
+        language=state.language,
+    )
+    llm = create_light_llm(0.1)
+    resp = await with_retries(lambda: llm.ainvoke(prompt))
+    # Swap in one assignment so concurrent prompt rendering stays consistent
+    state.memory = StoryMemory(summary=resp.content.strip(), summarized_count=cutoff)
+    logger.info(
+        "Story memory refreshed: %d choices summarized, ~%d tokens",
+        cutoff,
+        approx_tokens(state.memory.summary),
+    )
+    return True
+
@@ -1,8 +1,8 @@
 """Pydantic models representing game state and LLM outputs."""
 
-from typing import Dict, List, Optional, Set, Literal
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Literal
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class Milestone(BaseModel):
@@ -79,6 +79,8 @@ class Scene(BaseModel):
     description: str
     choices: List[SceneChoice]
     image: Optional[str] = None
+    # Encoded variants of ``image``, see src.game.images.encoder
+    image_meta: Optional[dict] = None
     image_prompt: Optional[str] = None
     music: Optional[str] = None
 
@@ -104,6 +106,25 @@ class UserChoice(BaseModel):
     timestamp: Optional[str] = None
 
 
+class StoryMemory(BaseModel):
+    """Rolling summary of the older part of the choice history."""
+
+    summary: str = ""
+    # Number of leading ``UserState.user_choices`` folded into ``summary``
+    summarized_count: int = 0
+
+
+class ContextCacheHandle(BaseModel):
+    """Provider-side cache of the static story-frame context."""
+
+    # None when caching was skipped or failed; the block is sent inline
+    name: Optional[str] = None
+    key_id: Optional[str] = None
+    fingerprint: str
+    expires_at: float
+    tokens: int = 0
+
+
 class UserState(BaseModel):
     """State stored for each user."""
     story_frame: Optional[StoryFrame] = None
@@ -111,9 +132,30 @@ class UserState(BaseModel):
     scenes: Dict[str, Scene] = Field(default_factory=dict)
     milestones_achieved: Set[str] = Field(default_factory=set)
     user_choices: List[UserChoice] = Field(default_factory=list)
+    memory: StoryMemory = Field(default_factory=StoryMemory)
+    context_cache: Optional[ContextCacheHandle] = None
+    # Older scenes are moved out of ``scenes`` into the scene archive
+    archived_scene_count: int = 0
     ending: Optional[Ending] = None
     last_image_prompt: Optional[str] = None
     assets: Dict[str, str] = Field(default_factory=dict)
     language: str = "en"
     image_format: str = "vertical"
     is_pro: bool = False
+    _scene_loader: Optional[Callable[[List[str]], Awaitable[Dict[str, Scene]]]] = PrivateAttr(
+        default=None
+    )
+
+    def attach_scene_loader(
+        self, loader: Callable[[List[str]], Awaitable[Dict[str, Scene]]]
+    ) -> None:
+        """Set how archived scenes are fetched; kept out of the stored data."""
+        self._scene_loader = loader
+
+    async def load_scenes(self, scene_ids: List[str]) -> Dict[str, Scene]:
+        """Return the requested scenes, fetching archived ones if needed."""
+        found = {i: self.scenes[i] for i in scene_ids if i in self.scenes}
+        missing = [i for i in scene_ids if i not in found]
+        if missing and self._scene_loader is not None:
+            found.update(await self._scene_loader(missing))
+        return found
@@ -1,23 +1,43 @@
-"""Async MongoDB-backed user state storage (replica set ready)."""
+"""Async MongoDB-backed agent state storage, one document per game session."""
 
 from __future__ import annotations
 
-import json
+import asyncio
+import functools
 import logging
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
-from src.game.agent.models import UserState
+from src.game.agent.models import Scene, UserState
+
+from src.game.agent.state_delta import diff_state, encode_state
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
 
+class StateConflictError(Exception):
+    """Another process saved a session state since this one was loaded."""
+
+    def __init__(self, session_ids: set[str]) -> None:
+        super().__init__(f"State version conflict for sessions: {sorted(session_ids)}")
+        self.session_ids = session_ids
+
+
 class UserRepository:
     """Repository for storing UserState objects in MongoDB.
 
-    Stores one document per user with `_id` = user_id and `data` = serialized state.
+    Stores one document per game session with `_id` = session_id, the owning
+    `user_id` (indexed), `data` = serialized state and `version`, incremented
+    on every save for optimistic concurrency.
+    Documents written before versioning have no `version` and count as 0.
+    Saves send only the delta against the previously stored `data`.
     """
 
     def __init__(self, mongodb_uri: Optional[str] = None, database_name: Optional[str] = None) -> None:
@@ -28,47 +48,269 @@ class UserRepository:
         self.db = self.client[db_name]
         self.collection: AsyncIOMotorCollection = self.db[settings.mongodb_collection or "user_states"]
 
-    async def get(self, user_id: str) -> UserState:
-        """Return user state for the given id, creating it if absent."""
-        logger.debug("[MongoState] Fetching state for %s", user_id)
-        doc = await self.collection.find_one({"_id": user_id})
+    async def get(self, session_id: str) -> tuple[UserState, int, dict | None]:
+        """Return session state, its version and the stored data, creating it if absent."""
+        logger.debug("[MongoState] Fetching state for session %s", session_id)
+        doc = await self.collection.find_one({"_id": session_id})
         if doc is None or "data" not in doc:
-            return UserState()
+            return UserState(), doc.get("version", 0) if doc else 0, None
         # Ensure we validate against the Pydantic model
-        return UserState.model_validate(doc["data"])  # type: ignore[arg-type]
-
-    async def set(self, user_id: str, state: UserState) -> None:
-        """Persist updated user state."""
-        logger.debug("[MongoState] Saving state for %s", user_id)
-        # Convert to plain dict to avoid non-JSON types
-        state_dict = json.loads(state.model_dump_json())
-        await self.collection.update_one(
-            {"_id": user_id},
-            {"$set": {"data": state_dict}},
-            upsert=True,
+        state = UserState.model_validate(doc["data"])  # type: ignore[arg-type]
+        return state, doc.get("version", 0), doc["data"]
+
+    async def get_version(self, session_id: str) -> int:
+        doc = await self.collection.find_one({"_id": session_id}, {"version": 1})
+        return doc.get("version", 0) if doc else 0
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("user_id")
+
+    @staticmethod
+    def _save_op(
+        session_id: str, data: dict, expected_version: int, stored: dict | None, user_id: str
+    ) -> UpdateOne:
+        if expected_version:
+            query = {"_id": session_id, "version": expected_version}
+        else:
+            query = {"_id": session_id, "version": {"$exists": False}}
+        if stored is None:
+            return UpdateOne(
+                query,
+                {"$set": {"data": data, "user_id": user_id}, "$inc": {"version": 1}},
+                upsert=True,
+            )
+        # No upsert: a delta alone must never become a new document
+        return UpdateOne(query, {**diff_state(stored, data), "$inc": {"version": 1}})
+
+    async def save_many(
+        self, states: dict[str, tuple[dict, int, dict | None, str]]
+    ) -> set[str]:
+        """Persist encoded states in one bulk write.
+
+        ``states`` maps session ids to ``(data, expected_version, stored,
+        user_id)`` where ``stored`` is the data currently saved at that
+        version, or None to write the whole document. Returns the ids whose stored version no
+        longer matched and were not written.
+        """
+        if not states:
+            return set()
+        ops = [self._save_op(sid, *args) for sid, args in states.items()]
+        try:
+            result = await self.collection.bulk_write(ops, ordered=False)
+            written = result.matched_count + result.upserted_count
+        except BulkWriteError as exc:
+            # A version mismatch turns the upsert into a duplicate _id
+            details = exc.details
+            if any(e.get("code") != 11000 for e in details.get("writeErrors", [])):
+                raise
+            written = details.get("nMatched", 0) + details.get("nUpserted", 0)
+        if written == len(ops):
+            return set()
+        stored = {
+            doc["_id"]: doc.get("version", 0)
+            async for doc in self.collection.find(
+                {"_id": {"$in": list(states)}}, {"version": 1}
+            )
+        }
+        return {
+            sid for sid, (_, version, *_) in states.items() if stored.get(sid) != version + 1
+        }
+
+    async def reset(self, session_id: str) -> None:
+        """Remove stored state for a session."""
+        logger.debug("[MongoState] Resetting state for session %s", session_id)
+        await self.collection.delete_one({"_id": session_id})
+
+
+class SceneArchive:
+    """Append-only storage for scenes that left the hot state window.
+
+    One document per scene: `_id` = "<session_id>:<scene_id>", `session_id`
+    and `data` = serialized Scene.
+    """
+
+    def __init__(self, repo: UserRepository) -> None:
+        self.collection: AsyncIOMotorCollection = repo.db[
+            settings.mongodb_scene_archive_collection
+        ]
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("session_id")
+
+    async def append(self, scenes: list[tuple[str, Scene]]) -> None:
+        if not scenes:
+            return
+        docs = [
+            {"_id": f"{sid}:{scene.scene_id}", "session_id": sid, "data": scene.model_dump(mode="json")}
+            for sid, scene in scenes
+        ]
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as exc:
+            # Re-archiving after a failed state save is harmless
+            if any(e.get("code") != 11000 for e in exc.details.get("writeErrors", [])):
+                raise
+
+    async def load(self, session_id: str, scene_ids: list[str]) -> dict[str, Scene]:
+        cursor = self.collection.find({"_id": {"$in": [f"{session_id}:{i}" for i in scene_ids]}})
+        scenes = [Scene.model_validate(doc["data"]) async for doc in cursor]
+        return {scene.scene_id: scene for scene in scenes}
+
+    async def delete(self, session_id: str) -> None:
+        await self.collection.delete_many({"session_id": session_id})
+
+
+def _cold_scene_ids(state: UserState) -> list[str]:
+    """Scenes outside the hot window: all but the newest few and the current one."""
+    window = settings.hot_scene_window
+    if len(state.scenes) <= window:
+        return []
+    ids = list(state.scenes)  # insertion order is generation order
+    return [i for i in ids[: len(ids) - window] if i != state.current_scene_id]
+
+
+@dataclass
+class _Entry:
+    state: UserState
+    # Version stored in MongoDB that ``state`` was loaded from or written as
+    version: int
+    user_id: str
+    # Encoded data stored at ``version``; saves are diffed against it
+    stored: dict | None = None
+
+
+class UserStateCache:
+    """Per-process cache of user states with write-through saves.
+
+    ``get`` serves a private copy from memory after checking the stored
+    version with a projected query, so another worker's writes are never
+    hidden. ``set`` saves at once, while the caller still holds the
+    session lock. Saves use the version as an optimistic lock: if another
+    process wrote in between, the local copy is dropped, the stored one
+    wins and :class:`StateConflictError` is raised.
+
+    Before a save, scenes outside the last ``hot_scene_window`` are moved to
+    the :class:`SceneArchive`; states load them lazily via ``load_scenes``.
+    """
+
+    def __init__(self, repo: UserRepository, archive: SceneArchive) -> None:
+        self._repo = repo
+        self._archive = archive
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # One lock per session that is being written or reset right now
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
         )
 
-    async def reset(self, user_id: str) -> None:
-        """Remove stored state for a user."""
-        logger.debug("[MongoState] Resetting state for %s", user_id)
-        await self.collection.delete_one({"_id": user_id})
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def get(self, session_id: str, user_id: str) -> UserState:
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            if await self._repo.get_version(session_id) != entry.version:
+                entry = None
+        if entry is None:
+            state, version, stored = await self._repo.get(session_id)
+            entry = _Entry(state=state, version=version, user_id=user_id, stored=stored)
+            self._entries[session_id] = entry
+            self._evict()
+        self._entries.move_to_end(session_id)
+        # Callers mutate the state across awaits; the cache must never see that
+        state = entry.state.model_copy(deep=True)
+        state.attach_scene_loader(functools.partial(self._archive.load, session_id))
+        return state
+
+    async def set(self, session_id: str, state: UserState, user_id: str) -> None:
+        """Save ``state``; the cache takes ownership of the object.
+
+        Raises :class:`StateConflictError` if another process saved the
+        session since it was loaded.
+        """
+        async with self._lock(session_id):
+            entry = self._entries.get(session_id)
+            if entry is None:
+                version = await self._repo.get_version(session_id)
+                entry = _Entry(state=state, version=version, user_id=user_id)
+                self._entries[session_id] = entry
+            entry.state = state
+            self._entries.move_to_end(session_id)
+            await self._save(session_id, entry)
+        self._evict()
+
+    async def reset(self, session_id: str) -> None:
+        # Wait for a running save, or its upsert could recreate the document
+        async with self._lock(session_id):
+            self._entries.pop(session_id, None)
+            await self._repo.reset(session_id)
+            await self._archive.delete(session_id)
+
+    async def _archive_cold_scenes(self, session_id: str, state: UserState) -> None:
+        ids = _cold_scene_ids(state)
+        if not ids:
+            return
+        try:
+            await self._archive.append([(session_id, state.scenes[i]) for i in ids])
+        except Exception:
+            logger.exception("[MongoState] Scene archiving failed; keeping scenes inline")
+            return
+        for scene_id in ids:
+            state.scenes.pop(scene_id, None)
+        state.archived_scene_count += len(ids)
+
+    async def _save(self, session_id: str, entry: _Entry) -> None:
+        await self._archive_cold_scenes(session_id, entry.state)
+        data = encode_state(entry.state)
+        if data == entry.stored:
+            return
+        conflicts = await self._repo.save_many(
+            {session_id: (data, entry.version, entry.stored, entry.user_id)}
+        )
+        if conflicts:
+            logger.error("[MongoState] Version conflict for %s; dropping local state", session_id)
+            self._entries.pop(session_id, None)
+            raise StateConflictError(conflicts)
+        entry.version += 1
+        entry.stored = data
+        logger.debug("[MongoState] Saved state for %s", session_id)
+
+    def _evict(self) -> None:
+        overflow = len(self._entries) - settings.state_cache_max_items
+        if overflow <= 0:
+            return
+        for sid in list(self._entries)[:overflow]:
+            del self._entries[sid]
+
+    async def ensure_indexes(self) -> None:
+        try:
+            await self._repo.ensure_indexes()
+            await self._archive.ensure_indexes()
+        except Exception:
+            logger.exception("[MongoState] Failed to create state indexes")
 
 
 _repo = UserRepository()
+_archive = SceneArchive(_repo)
+_cache = UserStateCache(_repo, _archive)
 
 
-async def get_user_state(user_hash: str) -> UserState:
-    logger.debug("get_user_state for %s", user_hash)
-    return await _repo.get(user_hash)
+async def get_session_state(session_id: str, user_id: str) -> UserState:
+    logger.debug("get_session_state for %s", session_id)
+    return await _cache.get(session_id, user_id)
 
 
-async def set_user_state(user_hash: str, state: UserState) -> None:
-    logger.debug("set_user_state for %s", user_hash)
-    await _repo.set(user_hash, state)
+async def set_session_state(session_id: str, state: UserState, user_id: str) -> None:
+    logger.debug("set_session_state for %s", session_id)
+    await _cache.set(session_id, state, user_id)
 
 
-async def reset_user_state(user_hash: str) -> None:
-    logger.debug("reset_user_state for %s", user_hash)
-    await _repo.reset(user_hash)
+async def reset_session_state(session_id: str) -> None:
+    logger.debug("reset_session_state for %s", session_id)
+    await _cache.reset(session_id)
 
 
+def start_state_store() -> None:
+    asyncio.create_task(_cache.ensure_indexes())
@@ -1,9 +1,10 @@
 from pydantic import BaseModel
 from src.game.agent.llm import create_light_llm
 from src.game.agent.prompts import GAME_STATE_PROMPT
+from src.game.agent.context_cache import render_story_context
 from langchain_core.messages import SystemMessage, HumanMessage
 import logging
-from src.game.agent.mongo_state import get_user_state
+from src.game.agent.mongo_state import get_session_state
 from src.game.agent.utils import with_retries
 
 logger = logging.getLogger(__name__)
@@ -38,15 +39,12 @@ class MusicPrompt(BaseModel):
     prompt: str
 
 
-async def generate_music_prompt(user_hash: str, scene_description: str, last_choice = "No choice yet") -> str:
+async def generate_music_prompt(session_id: str, user_id: str, scene_description: str, last_choice = "No choice yet") -> str:
     logger.info(f"Generating music prompt for the current scene: {scene_description}")
 
-    state = await get_user_state(user_hash)
+    state = await get_session_state(session_id, user_id)
     scene = GAME_STATE_PROMPT.format(
-        lore=state.story_frame.lore,
-        goal=state.story_frame.goal,
-        milestones=",".join(m.id for m in state.story_frame.milestones),
-        endings=",".join(e.id for e in state.story_frame.endings),
+        game_settings=render_story_context(state.story_frame),
         history="; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices),
         last_choice=last_choice,
         scene_description=scene_description
@@ -1,14 +1,15 @@
 """Agent for detecting and applying NPC updates from scene text."""
 
 import logging
+from functools import partial
 from typing import List, Literal, Optional, Tuple
 
 from pydantic import BaseModel, Field
 
+from src.game.agent.context_cache import invoke_with_story_context
 from src.game.agent.llm import create_light_llm
 from src.game.agent.models import NPCCharacter, UserState
 from src.game.agent.prompts import NPC_UPDATE_PROMPT
-from src.game.agent.utils import with_retries
 
 logger = logging.getLogger(__name__)
 
@@ -34,34 +35,18 @@ class NPCUpdates(BaseModel):
     actions: List[NPCUpdateAction] = Field(default_factory=list)
 
 
-def _npc_list_to_prompt(npcs: List[NPCCharacter]) -> str:
-    if not npcs:
-        return "(none)"
-    return "\n".join(
-        f"{c.char_name} | age:{c.char_age} | persona:{c.char_personality} | bg:{c.char_background} | visual:{c.visual_description}"
-        for c in npcs
-    )
-
-
 async def propose_npc_updates(state: UserState, scene_description: str, last_choice: str = "") -> NPCUpdates:
     """Ask the LLM to propose NPC updates based on latest scene and existing list."""
-    llm = create_light_llm(temperature=0.1).with_structured_output(NPCUpdates)
-
-    npc_context = _npc_list_to_prompt(state.story_frame.npc_characters if state.story_frame else [])
-
-    sf = state.story_frame
-    prompt = NPC_UPDATE_PROMPT.format(
-        lore=sf.lore if sf else "",
-        goal=sf.goal if sf else "",
-        milestones=",".join(m.id for m in (sf.milestones if sf else [])),
-        endings=",".join(e.id for e in (sf.endings if sf else [])),
-        npc_characters=npc_context,
-        scene_description=scene_description,
-        last_choice=last_choice or "No choice yet",
-        main_character=state.story_frame.character,
+    response: NPCUpdates = await invoke_with_story_context(
+        state,
+        lambda game_settings: NPC_UPDATE_PROMPT.format(
+            game_settings=game_settings,
+            scene_description=scene_description,
+            last_choice=last_choice or "No choice yet",
+        ),
+        NPCUpdates,
+        partial(create_light_llm, temperature=0.1),
     )
-
-    response: NPCUpdates = await with_retries(lambda: llm.ainvoke(prompt))
     return response
 
 
@@ -147,6 +132,13 @@ async def maybe_update_npcs(state: UserState, scene_description: str, last_choic
         return False
 
     updates = await propose_npc_updates(state, scene_description, last_choice)
+    return apply_npc_updates_to_state(state, updates)
+
+
+def apply_npc_updates_to_state(state: UserState, updates: NPCUpdates) -> bool:
+    """Apply updates to the story frame NPC list. Returns True if it changed."""
+    if not state.story_frame:
+        return False
     updated_list, changed = apply_npc_updates(state.story_frame.npc_characters, updates)
     if changed:
         state.story_frame.npc_characters = updated_list
@@ -154,5 +146,3 @@ async def maybe_update_npcs(state: UserState, scene_description: str, last_choic
     else:
         logger.info("NPC list unchanged")
     return changed
-
-
@@ -0,0 +1,65 @@
+"""Scene post-processor: image prompt and NPC updates in one LLM call."""
+
+import logging
+from functools import partial
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, Field
+
+from src.game.agent.context_cache import invoke_with_story_context
+from src.game.agent.image_agent import IMAGE_GENERATION_SYSTEM_PROMPT, ChangeScene
+from src.game.agent.llm import create_light_llm
+from src.game.agent.memory import render_history
+from src.game.agent.models import UserState
+from src.game.agent.npc_agent import NPCUpdates
+from src.game.agent.prompts import SCENE_POST_PROCESS_PROMPT
+
+logger = logging.getLogger(__name__)
+
+
+class ScenePostProcessing(BaseModel):
+    """Combined output of the image-prompt and NPC-update agents."""
+
+    image: ChangeScene = Field(description="Image decision and prompt for the scene")
+    npc_updates: NPCUpdates = Field(
+        default_factory=NPCUpdates,
+        description="Changes to apply to the NPC registry",
+    )
+
+
+async def post_process_scene(
+    state: UserState,
+    scene_description: str,
+    last_choice: str = "No choice yet",
+    image_description: str | None = None,
+) -> ScenePostProcessing:
+    """Return the image prompt and NPC updates for a scene in one request.
+
+    ``image_description`` is what the image prompt should depict when it
+    differs from the scene (e.g. with extra instructions); NPC updates are
+    always derived from the plain ``scene_description``.
+    """
+
+    def build_prompt(game_settings: str) -> list:
+        prompt = SCENE_POST_PROCESS_PROMPT.format(
+            game_settings=game_settings,
+            history=render_history(state),
+            last_choice=last_choice or "No choice yet",
+            last_image_description=state.last_image_prompt or "No image description yet",
+            scene_description=scene_description,
+            image_description=image_description or scene_description,
+        )
+        return [
+            SystemMessage(content=IMAGE_GENERATION_SYSTEM_PROMPT),
+            HumanMessage(content=prompt),
+        ]
+
+    response: ScenePostProcessing = await invoke_with_story_context(
+        state,
+        build_prompt,
+        ScenePostProcessing,
+        partial(create_light_llm, 0.1),
+        name="post_process",
+    )
+    logger.debug("Scene post-processing done")
+    return response
@@ -0,0 +1,165 @@
+"""Speculative pre-generation of the next scene for every offered choice.
+
+While the player reads a scene, the follow-up step for each button is
+generated in the background on a private copy of the state. When the player
+presses a button the matching branch is served and the others are dropped.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from src.config import settings
+from src.game.agent.memory import refresh_memory
+from src.game.agent.models import StoryMemory, UserState
+from src.game.agent.runner import ProcessStepResponse, process_step
+from src.game.images.image_generator import generate_image, get_image_model
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PregeneratedStep:
+    """Finished speculative step and the state it produced."""
+
+    state: UserState
+    response: ProcessStepResponse
+
+
+@dataclass
+class _Branches:
+    order_num: int
+    tasks: dict[str, asyncio.Task]
+    memory: asyncio.Task
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class ScenePregenerator:
+    """Track speculative branches per session.
+
+    Branches are keyed by the session and by the ``order_num`` of the scene
+    whose choices they answer, so a stale branch is never served for a newer
+    scene.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: dict[str, _Branches] = {}
+
+    @staticmethod
+    async def _refresh_memory(state: UserState) -> StoryMemory:
+        # The folded range ends before the choice, so it is the same for
+        # every branch: summarize once instead of once per choice
+        await refresh_memory(state, pending_choices=1)
+        return state.memory
+
+    async def _run(
+        self, state: UserState, choice_text: str, memory: asyncio.Task
+    ) -> PregeneratedStep:
+        response = await process_step(state, choice_text, memory=memory)
+        scene = response.scene
+        if scene.image is None and scene.image_prompt:
+            # The player is still reading, so there is time to render the
+            # image that async mode would otherwise attach later
+            image, _ = await generate_image(
+                scene.image_prompt, state.image_format, get_image_model(state.is_pro)
+            )
+            if image is not None:
+                scene.image, scene.image_meta = image.path, image.meta
+            scene.image_prompt = None
+        return PregeneratedStep(state=state, response=response)
+
+    def schedule(self, key: str, order_num: int, state: UserState) -> None:
+        """Start generating follow-ups for all choices of the current scene."""
+        self._purge_expired()
+        self.discard(key)
+        scene = state.scenes.get(state.current_scene_id or "")
+        if scene is None or not scene.choices:
+            return
+        memory = asyncio.create_task(self._refresh_memory(state.model_copy(deep=True)))
+        tasks: dict[str, asyncio.Task] = {}
+        for choice in scene.choices:
+            # Each branch mutates its own copy; the live state stays untouched
+            branch_state = state.model_copy(deep=True)
+            tasks[choice.text] = asyncio.create_task(
+                self._run(branch_state, choice.text, memory)
+            )
+        self._sessions[key] = _Branches(order_num=order_num, tasks=tasks, memory=memory)
+        logger.info(
+            "[Pregen] Scheduled %d branches for session %s scene #%s",
+            len(tasks),
+            key,
+            order_num,
+        )
+
+    async def take(
+        self, key: str, order_num: int, choice_text: str
+    ) -> PregeneratedStep | None:
+        """Return the branch for ``choice_text`` and cancel all the others.
+
+        Waits for the branch if it is still running. Returns ``None`` when no
+        matching branch exists or it failed.
+        """
+        branches = self._sessions.pop(key, None)
+        if branches is None:
+            return None
+        task = None
+        if branches.order_num == order_num:
+            task = branches.tasks.pop(choice_text, None)
+        for other in branches.tasks.values():
+            other.cancel()
+        if task is None:
+            branches.memory.cancel()
+            logger.info("[Pregen] Miss for session %s scene #%s", key, order_num)
+            return None
+        try:
+            step = await task
+        except Exception:
+            logger.exception("[Pregen] Branch failed for session %s", key)
+            return None
+        logger.info("[Pregen] Hit for session %s scene #%s", key, order_num)
+        return step
+
+    def discard(self, key: str) -> None:
+        """Cancel all branches of a session."""
+        branches = self._sessions.pop(key, None)
+        if branches is None:
+            return
+        for task in branches.tasks.values():
+            task.cancel()
+        branches.memory.cancel()
+
+    def _purge_expired(self) -> None:
+        ttl = settings.pregenerate_ttl_seconds
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        for key in [k for k, b in self._sessions.items() if now - b.created_at > ttl]:
+            self.discard(key)
+
+    def cancel_all(self) -> None:
+        for key in list(self._sessions):
+            self.discard(key)
+
+
+_pregenerator = ScenePregenerator()
+
+
+def schedule_pregeneration(key: str, order_num: int, state: UserState) -> None:
+    if not settings.pregenerate_next_scene:
+        return
+    _pregenerator.schedule(key, order_num, state)
+
+
+async def take_pregenerated(
+    key: str, order_num: int, choice_text: str
+) -> PregeneratedStep | None:
+    return await _pregenerator.take(key, order_num, choice_text)
+
+
+def discard_pregenerated(key: str) -> None:
+    _pregenerator.discard(key)
+
+
+def cancel_pregeneration() -> None:
+    _pregenerator.cancel_all()
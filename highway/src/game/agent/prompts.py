@@ -22,16 +22,22 @@ Quality rules:
 All returned text must be translated into {language}.
 """
 
-GAME_STATE_PROMPT = """
----Game Settings START---
+STORY_CONTEXT_PROMPT = """---Game Settings START---
 Lore: {lore}
 Goal: {goal}
 Milestones: {milestones}
 Endings: {endings}
 World visual style: {visual_style}
-NPC characters: {npc_characters}
 Main character: {main_character}
----Game Settings END---
+NPC characters (one per line):
+{npc_characters}
+---Game Settings END---"""
+
+# Replaces the settings block when it is sent as cached provider context
+CACHED_STORY_CONTEXT_NOTE = "(Game settings are provided in the cached context.)"
+
+GAME_STATE_PROMPT = """
+{game_settings}
 
 ---User's actions START---
 History: {history}
@@ -49,14 +55,7 @@ clear shift in stakes.
 
 Translate the scene description and choices into {language}.
 
----Game Settings START---
-Lore: {lore}
-Goal: {goal}
-Milestones: {milestones}
-Endings: {endings}
-NPC characters: {npc_characters}
-Main character: {main_character}
----Game Settings END---
+{game_settings}
 
 ---User's actions START---
 History: {history}
@@ -133,14 +132,7 @@ Return ONLY JSON with the schema:
 }}
 
 Context:
-Lore: {lore}
-Goal: {goal}
-Milestones: {milestones}
-Endings: {endings}
-Main character: {main_character}
-
-NPCs (one per line):
-{npc_characters}
+{game_settings}
 
 User's last choice: {last_choice}
 Next Scene: {scene_description}
@@ -149,3 +141,61 @@ NEVER add the main character to the list of NPCs.
 NEVER add the main character to the list of NPCs.
 NEVER add the main character to the list of NPCs.
 """
+
+
+SCENE_POST_PROCESS_PROMPT = """
+You post-process a freshly generated scene of a visual novel. Do TWO tasks
+in one response.
+
+Task 1 - image (field `image`): decide whether the visual scene changes and,
+if it does, write the image prompt in `scene_description` following the
+image guidelines from the system message.
+
+Task 2 - NPC registry (field `npc_updates`): propose minimal changes to the
+NPC list so that visual assets remain stable across scenes.
+- Only add a character when the scene clearly introduces a new NPC with identity.
+- Only update fields that measurably change (injury, outfit change, attitude shift, age rarely changes).
+- Remove only if the character permanently exits the story (death, leaves forever). Otherwise, keep.
+- Identify characters by char_name exactly. If unknown, infer a concise, stable name from context.
+- visual_description: immutable visual identity ONLY, ≤ 25 words, comma-separated attributes, no sentences, no second-person pronouns.
+- char_personality: 3–7 adjectives or short noun phrases, comma-separated.
+- char_background: short persistent background (≤ 10 words). No current-scene events.
+- For update operations, provide ONLY fields that truly changed; set unchanged fields to null.
+- Use the same language as the input scene.
+- Return an empty `actions` list when nothing changes.
+- Base NPC changes on the game response only, not on the scene to illustrate.
+
+{game_settings}
+
+---User's actions START---
+History: {history}
+Last choice: {last_choice}
+---User's actions END---
+
+Last image description: {last_image_description}
+
+Game response to user's action: {scene_description}
+
+Scene to illustrate (Task 1 only): {image_description}
+
+NEVER add the main character to the list of NPCs and NEVER show the main character in the image.
+"""
+
+
+MEMORY_SUMMARY_PROMPT = """
+You keep the running memory of an interactive story so that later scenes stay
+consistent without re-reading the whole history.
+
+Current summary:
+{summary}
+
+New events to fold in (oldest first):
+{events}
+
+Rewrite the summary so it also covers the new events. Keep facts that matter
+for the plot: decisions the player made, their consequences, milestones
+reached or failed, promises, injuries, items, allies and enemies. Drop
+flavour text. At most 150 words, plain prose, no lists.
+
+Write the summary in {language}. Respond ONLY with the summary text.
+"""
@@ -1,23 +1,28 @@
 """Entry point for executing a graph step."""
 
 import logging
-from typing import Literal, Optional, Union
+from typing import Awaitable, Literal, Optional, Union
 
 import datetime
 import asyncio
 from pydantic import BaseModel
+from src.game.agent.memory import refresh_memory
 from src.game.agent.models import (
     Ending,
     EndingCheckResult,
     Scene,
+    StoryMemory,
     UserState,
     UserChoice,
 )
 from src.game.agent.tools import (
+    SceneDraft,
     check_ending,
     generate_ending_scene,
     generate_scene_step,
 )
+from src.config import settings
+from src.game.agent.utils import EventSink, deadline
 
 logger = logging.getLogger(__name__)
 
@@ -39,8 +44,24 @@ ProcessStepResponse = Union[EndingResponse, SceneResponse]
 async def process_step(
     state: UserState,
     choice_text: str,
+    on_event: EventSink | None = None,
+    memory: Awaitable[StoryMemory] | None = None,
 ) -> ProcessStepResponse:
-    """Run one interaction step through the graph."""
+    """Run one interaction step through the graph.
+
+    The ending check and the next scene run concurrently. The scene pipeline
+    waits for the ending decision before its image stage and is cancelled as
+    soon as an ending is reached; its draft seeds the ending scene.
+
+    ``on_event`` receives streaming progress events, see
+    :func:`generate_scene_step`.
+
+    The story memory is refreshed in the background while the step runs;
+    prompts of this step still see the previous summary. A ``memory``
+    awaitable, shared by several speculative steps, supplies the refreshed
+    memory instead. All model calls of the step share the
+    ``scene_step_deadline_seconds`` budget.
+    """
 
     last_scene_id = state.current_scene_id
     state.user_choices.append(
@@ -51,42 +72,92 @@ async def process_step(
         )
     )
 
-    ending_task = check_ending(state)
-    next_scene_task = generate_scene_step(choice_text, state)
-    maybe_ending, next_scene = await asyncio.gather(ending_task, next_scene_task)
+    with deadline(settings.scene_step_deadline_seconds):
+        if memory is None:
+            memory_task = asyncio.create_task(refresh_memory(state))
+        else:
+            memory_task = asyncio.create_task(_adopt_memory(state, memory))
+        try:
+            return await _run_step(state, choice_text, last_scene_id, on_event)
+        finally:
+            await _finish_memory_refresh(memory_task)
+
+
+async def _adopt_memory(state: UserState, memory: Awaitable[StoryMemory]) -> None:
+    # Shielded: cancelling this step must not cancel the other sharers
+    state.memory = await asyncio.shield(memory)
+
+
+async def _finish_memory_refresh(task: asyncio.Task) -> None:
+    if not task.done() and asyncio.current_task().cancelling():
+        task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("Story memory refresh failed; keeping the old summary")
+
+
+async def _run_step(
+    state: UserState,
+    choice_text: str,
+    last_scene_id: str | None,
+    on_event: EventSink | None,
+) -> ProcessStepResponse:
+    ending_task = asyncio.create_task(check_ending(state))
+
+    async def before_image() -> bool:
+        # Imagen is the most expensive stage: never start it for a scene
+        # that the ending is about to replace
+        return _resolve_ending(await ending_task, state) is None
 
+    draft = SceneDraft()
+    next_scene_task = asyncio.create_task(
+        generate_scene_step(choice_text, state, on_event, before_image, draft)
+    )
+    try:
+        ending = _resolve_ending(await ending_task, state)
+    except BaseException:
+        next_scene_task.cancel()
+        raise
+
+    if ending is not None:
+        # Stop the scene pipeline wherever it is; ``draft`` keeps its output
+        next_scene_task.cancel()
+        await asyncio.gather(next_scene_task, return_exceptions=True)
+        state.ending = ending
+        scene = await generate_ending_scene(
+            state, ending, choice_text, last_scene_id, on_event, draft
+        )
+        return EndingResponse(scene=scene, game_over=True, ending=ending)
+
+    next_scene = await next_scene_task
+    state.current_scene_id = next_scene.scene_id
+    return SceneResponse(scene=next_scene, game_over=False)
+
+
+def _resolve_ending(
+    maybe_ending: EndingCheckResult | None, state: UserState
+) -> Ending | None:
+    """Return the ending to apply for this step, or None to continue."""
     if maybe_ending is None:
         logger.error("check_ending returned None; continuing the game")
-        maybe_ending = EndingCheckResult(ending_reached=False, ending=None)
-        
+        return None
+
     if (
         maybe_ending.ending is not None
         and maybe_ending.ending.type == "good"
         and len(state.user_choices) < 15
     ):
         logger.info(f"Ending is good but the game is too short; continuing the game")
-        maybe_ending = EndingCheckResult(ending_reached=False, ending=None)
-
-    if maybe_ending.ending_reached and maybe_ending.ending is not None:
-        state.ending = maybe_ending.ending
-        scene = await generate_ending_scene(
-            state, maybe_ending.ending, choice_text, last_scene_id
-        )
+        return None
 
-        response = EndingResponse(
-            scene=scene,
-            game_over=True,
-            ending=maybe_ending.ending,
-        )
-    else:
-        if maybe_ending.ending_reached and maybe_ending.ending is None:
-            logger.error(
-                "Ending was reported as reached but no ending data was provided; continuing the game"
-            )
-        state.current_scene_id = next_scene.scene_id
-        response = SceneResponse(
-            scene=next_scene,
-            game_over=False,
+    if maybe_ending.ending_reached and maybe_ending.ending is None:
+        logger.error(
+            "Ending was reported as reached but no ending data was provided; continuing the game"
         )
-
-    return response
+        return None
+    if not maybe_ending.ending_reached:
+        return None
+    return maybe_ending.ending
@@ -0,0 +1,77 @@
+"""Delta codec for persisting ``UserState`` documents incrementally.
+
+A stored state only grows between steps: new scenes, new choices and a few
+changed scalars. Instead of rewriting the whole ``data`` subdocument,
+:func:`diff_state` turns two encoded snapshots into a MongoDB update that
+touches only what changed, and :func:`apply_delta` applies such an update
+to a plain dict the same way MongoDB would.
+"""
+
+from typing import Any
+
+from src.game.agent.models import UserState
+
+_MISSING = object()
+
+
+def encode_state(state: UserState) -> dict[str, Any]:
+    """Encode a state the way it is stored in MongoDB."""
+    return state.model_dump(mode="json")
+
+
+def _safe_key(key: str) -> bool:
+    # Keys become dotted field paths; these could not be addressed
+    return bool(key) and "." not in key and not key.startswith("$")
+
+
+def _diff(old: Any, new: Any, path: str, update: dict[str, dict]) -> None:
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict) and all(map(_safe_key, new)):
+        for key, value in new.items():
+            _diff(old.get(key, _MISSING), value, f"{path}.{key}", update)
+        for key in old.keys() - new.keys():
+            update["$unset"][f"{path}.{key}"] = ""
+        return
+    if (
+        isinstance(old, list)
+        and isinstance(new, list)
+        and len(new) > len(old)
+        and new[: len(old)] == old
+    ):
+        # History lists only grow: append the tail
+        update["$push"][path] = {"$each": new[len(old):]}
+        return
+    update["$set"][path] = new
+
+
+def diff_state(old: dict[str, Any], new: dict[str, Any], root: str = "data") -> dict:
+    """Return the MongoDB update that turns ``old`` into ``new`` under ``root``.
+
+    Nested dicts (``scenes``, ``story_frame``) are diffed per key, lists
+    that only gained items get ``$push``, and anything else that changed is
+    ``$set``. Returns an empty dict when nothing changed.
+    """
+    update: dict[str, dict] = {"$set": {}, "$unset": {}, "$push": {}}
+    _diff(old, new, root, update)
+    return {op: fields for op, fields in update.items() if fields}
+
+
+def _parent(doc: dict, path: list[str]) -> dict:
+    for key in path[:-1]:
+        doc = doc.setdefault(key, {})
+    return doc
+
+
+def apply_delta(doc: dict[str, Any], update: dict) -> dict[str, Any]:
+    """Apply ``update`` produced by :func:`diff_state` to ``doc`` in place."""
+    for path, value in update.get("$set", {}).items():
+        keys = path.split(".")
+        _parent(doc, keys)[keys[-1]] = value
+    for path in update.get("$unset", {}):
+        keys = path.split(".")
+        _parent(doc, keys).pop(keys[-1], None)
+    for path, value in update.get("$push", {}).items():
+        keys = path.split(".")
+        _parent(doc, keys).setdefault(keys[-1], []).extend(value["$each"])
+    return doc
@@ -3,8 +3,12 @@
 import asyncio
 import logging
 import uuid
-from typing import Annotated, Dict
+from dataclasses import dataclass
+from typing import Annotated, Awaitable, Callable, Dict
 
+from langchain_core.utils.json import parse_partial_json
+
+from src.config import settings
 from src.game.agent.llm import create_llm
 from src.game.agent.models import (
     Ending,
@@ -17,10 +21,23 @@ from src.game.agent.models import (
 )
 
 from src.game.agent.prompts import ENDING_CHECK_PROMPT, SCENE_PROMPT, STORY_FRAME_PROMPT
-from src.game.agent.utils import with_retries
+from src.game.agent.context_cache import invoke_with_story_context, story_context
+from src.game.agent.memory import render_history
+from src.game.agent.utils import (
+    INTERACTIVE_RETRY_POLICY,
+    EventSink,
+    log_prompt_size,
+    with_retries,
+)
+from src.game.images.encoder import StoredImage
 from src.game.images.image_generator import generate_image, get_image_model
-from src.game.agent.image_agent import generate_image_prompt
-from src.game.agent.npc_agent import maybe_update_npcs
+from src.game.agent.image_agent import ChangeScene, generate_image_prompt
+from src.game.agent.npc_agent import (
+    NPCUpdates,
+    apply_npc_updates_to_state,
+    propose_npc_updates,
+)
+from src.game.agent.post_processor import post_process_scene
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +47,14 @@ def _err(msg: str) -> str:
     return f"{{'error': '{msg}'}}"
 
 
+@dataclass
+class SceneDraft:
+    """Work a scene step has finished so far; survives cancellation."""
+
+    description: str | None = None
+    image_prompt: str | None = None
+
+
 async def generate_story_frame(
     setting: Annotated[str, "Game world setting"],
     character: Annotated[Dict[str, str], "Character info"],
@@ -39,14 +64,15 @@ async def generate_story_frame(
     npc_characters: Annotated[list[dict], "NPC characters"],
 ) -> StoryFrame:
     """Create the initial story frame and store it in user state."""
-    llm = create_llm().with_structured_output(StoryFrameLLM)
     prompt = STORY_FRAME_PROMPT.format(
         setting=setting,
         character=character,
         genre=genre,
         language=language,
     )
-    resp: StoryFrameLLM = await with_retries(lambda: llm.ainvoke(prompt))
+    resp: StoryFrameLLM = await with_retries(
+        lambda: create_llm().with_structured_output(StoryFrameLLM).ainvoke(prompt)
+    )
     story_frame = StoryFrame(
         lore=resp.lore,
         goal=resp.goal,
@@ -62,6 +88,75 @@ async def generate_story_frame(
     return story_frame
 
 
+async def _render_image(
+    state: UserState, image_prompt: ChangeScene
+) -> tuple[StoredImage | None, str | None]:
+    """Return ``(image, deferred_prompt)`` for a new scene.
+
+    With ``async_scene_images`` Imagen is not called here; the prompt is
+    returned instead so the caller can attach the image in the background.
+    """
+    if not image_prompt.change_scene:
+        return None, None
+    if settings.async_scene_images:
+        return None, image_prompt.scene_description
+    image, _ = await generate_image(
+        image_prompt.scene_description, state.image_format, get_image_model(state.is_pro)
+    )
+    return image, None
+
+
+async def _post_process(
+    state: UserState,
+    scene_description: str,
+    last_choice: str,
+    image_description: str | None = None,
+) -> tuple[ChangeScene, NPCUpdates | asyncio.Task | None]:
+    """Produce the image prompt and pending NPC updates for a new scene.
+
+    With ``fuse_scene_post_processing`` both come from a single LLM call.
+    Otherwise the NPC agent runs as a separate task. Either way nothing is
+    applied to the state yet: the caller passes the pending updates to
+    :func:`_join_npc_update` once the scene is kept.
+    """
+    if settings.fuse_scene_post_processing:
+        result = await post_process_scene(
+            state, scene_description, last_choice, image_description
+        )
+        return result.image, result.npc_updates
+
+    # Run NPC updates in parallel with image prompt + image generation
+    npc_task = None
+    if state.story_frame:
+        npc_task = asyncio.create_task(
+            propose_npc_updates(state, scene_description, last_choice)
+        )
+    image_prompt = await generate_image_prompt(
+        state, image_description or scene_description
+    )
+    return image_prompt, npc_task
+
+
+def _discard_npc_update(pending: NPCUpdates | asyncio.Task | None) -> None:
+    if isinstance(pending, asyncio.Task):
+        pending.cancel()
+
+
+async def _join_npc_update(
+    state: UserState, pending: NPCUpdates | asyncio.Task | None, where: str
+) -> None:
+    """Apply pending NPC updates before the state is persisted."""
+    if pending is None:
+        return
+    if isinstance(pending, asyncio.Task):
+        try:
+            pending = await pending
+        except Exception:
+            logger.exception("NPC update task failed on %s", where)
+            return
+    apply_npc_updates_to_state(state, pending)
+
+
 async def generate_initial_scene(
     state: UserState,
 ) -> Scene:
@@ -72,33 +167,26 @@ async def generate_initial_scene(
         "NOTE FOR THE ASSISTANT: YOU MUST GENERATE A NEW IMAGE FOR THE STARTING SCENE. DO NOT DESCRIBE THE PLAYER CHARACTER IN THE IMAGE PROMPT."
     )
 
-    # Run NPC updates in parallel with image prompt + image generation
-    npc_task = asyncio.create_task(
-        maybe_update_npcs(state, first_scene.description, "No choice yet")
+    image_prompt, npc_updates = await _post_process(
+        state, first_scene.description, "No choice yet", init_description
     )
-    image_prompt = await generate_image_prompt(state, init_description)
     logger.info(f"Generated initial scene image prompt: {image_prompt}")
 
-    image_path = None
-    if image_prompt.change_scene:
-        image_path, _ = await generate_image(
-            image_prompt.scene_description, state.image_format, get_image_model(state.is_pro)
-        )
+    image, deferred_prompt = await _render_image(state, image_prompt)
 
-    # Ensure NPC updates (if any) are applied before returning
-    try:
-        await npc_task
-    except Exception:
-        logger.exception("NPC update task failed on initial scene")
+    await _join_npc_update(state, npc_updates, "initial scene")
 
     scene_id = str(uuid.uuid4())
     scene = Scene(
         scene_id=scene_id,
         description=first_scene.description,
         choices=first_scene.choices,
-        image=image_path,
+        image=image.path if image else None,
+        image_meta=image.meta if image else None,
+        image_prompt=deferred_prompt,
     )
     state.scenes[scene_id] = scene
+    state.current_scene_id = scene_id
     state.last_image_prompt = image_prompt.scene_description
     return scene
 
@@ -108,8 +196,18 @@ async def generate_ending_scene(
     ending: Ending,
     choice_text: str,
     last_scene_id: str,
+    on_event: EventSink | None = None,
+    draft: SceneDraft | None = None,
 ) -> Scene:
-    """Generate the ending scene for the user."""
+    """Generate the ending scene for the user.
+
+    ``draft`` holds whatever the interrupted scene step already produced and
+    is given to the image agent as a starting point.
+    """
+    if on_event is not None:
+        await on_event(
+            "ending", {"ending": ending.model_dump(), "text": ending.description}
+        )
     ending_description = (
         f"Ending ID: {ending.id}\n"
         f"{ending.condition}\n"
@@ -121,28 +219,48 @@ async def generate_ending_scene(
         f"{state.story_frame.visual_style}\n"
         f"{state.scenes.get(last_scene_id, '')}\n"
         f"Last choice: {choice_text}\n\n"
+    )
+    if draft is not None and draft.description:
+        ending_description += (
+            f"What was happening when the ending triggered: {draft.description}\n"
+        )
+    if draft is not None and draft.image_prompt:
+        ending_description += (
+            f"Image prompt drafted for that moment (reuse what fits): {draft.image_prompt}\n"
+        )
+    ending_description += (
         "NOTE FOR THE ASSISTANT: YOU MUST GENERATE A NEW IMAGE FOR THE ENDING SCENE"
     )
     image_prompt = await generate_image_prompt(state, ending_description)
     logger.info(f"Generated ending scene image prompt: {image_prompt}")
 
-    if image_prompt.change_scene:
-        image_path, _ = await generate_image(
-            image_prompt.scene_description, state.image_format, get_image_model(state.is_pro)
-        )
+    image, deferred_prompt = await _render_image(state, image_prompt)
+    if on_event is not None and deferred_prompt is None:
+        await on_event("image_ready", {"image": image.path if image else None})
 
     scene_id = str(uuid.uuid4())
     scene = Scene(
         scene_id=scene_id,
         description=ending.description,
         choices=[],
-        image=image_path,
+        image=image.path if image else None,
+        image_meta=image.meta if image else None,
+        image_prompt=deferred_prompt,
     )
     state.scenes[scene_id] = scene
     state.last_image_prompt = image_prompt.scene_description
     return scene
 
 
+def _scene_prompt(last_choice: str, state: UserState, game_settings: str) -> str:
+    return SCENE_PROMPT.format(
+        game_settings=game_settings,
+        history=render_history(state),
+        last_choice=last_choice,
+        language=state.language,
+    )
+
+
 async def generate_scene(
     last_choice: Annotated[str, "Last user choice"],
     state: UserState,
@@ -150,56 +268,126 @@ async def generate_scene(
     """Generate a new scene based on the current user state."""
     if not state.story_frame:
         return _err("Story frame not initialized")
-    llm = create_llm().with_structured_output(SceneLLM)
-    prompt = SCENE_PROMPT.format(
-        lore=state.story_frame.lore,
-        goal=state.story_frame.goal,
-        milestones=",".join(m.id for m in state.story_frame.milestones),
-        endings=",".join(e.id for e in state.story_frame.endings),
-        history="; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices),
-        last_choice=last_choice,
-        language=state.language,
-        npc_characters="\n".join(
-            f"{c.char_name}: {c.visual_description}"
-            for c in state.story_frame.npc_characters
-        ),
-        main_character=state.story_frame.character,
+    resp: SceneLLM = await invoke_with_story_context(
+        state,
+        lambda game_settings: _scene_prompt(last_choice, state, game_settings),
+        SceneLLM,
+        policy=INTERACTIVE_RETRY_POLICY,
+        name="scene",
     )
-    resp: SceneLLM = await with_retries(lambda: llm.ainvoke(prompt))
     return resp
 
 
-async def generate_scene_step(last_choice: str, state: UserState) -> Scene:
-    """Generate a new scene based on the current user state."""
-    scene = await generate_scene(last_choice, state)
+def _chunk_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in content
+    )
 
-    logger.info(f"Generated scene step: {scene}")
 
-    # Kick off NPC update in parallel with image prompt + image generation
-    npc_task = asyncio.create_task(
-        maybe_update_npcs(state, scene.description, last_choice)
+async def stream_scene(
+    last_choice: str,
+    state: UserState,
+    on_event: EventSink,
+) -> SceneLLM:
+    """Generate a scene while emitting ``scene_delta`` events for the description.
+
+    The model is asked for raw JSON and the partial document is parsed as it
+    arrives. Falls back to :func:`generate_scene` if the stream breaks or the
+    final JSON does not validate.
+    """
+    if not state.story_frame:
+        return _err("Story frame not initialized")
+    context = await story_context(state)
+    llm = create_llm(api_key=context.api_key).bind(
+        response_mime_type="application/json",
+        cached_content=context.cached_content,
     )
-    image_prompt = await generate_image_prompt(state, scene.description)
-    logger.info(f"Generated scene step image prompt: {image_prompt}")
+    prompt = _scene_prompt(last_choice, state, context.text)
+    log_prompt_size("scene", prompt)
+    buffer = ""
+    sent = ""
+    try:
+        async for chunk in llm.astream(prompt):
+            buffer += _chunk_text(chunk.content)
+            try:
+                partial = parse_partial_json(buffer)
+            except ValueError:
+                continue
+            description = partial.get("description") if isinstance(partial, dict) else None
+            if isinstance(description, str) and description.startswith(sent) and len(description) > len(sent):
+                await on_event("scene_delta", {"text": description[len(sent):]})
+                sent = description
+        return SceneLLM.model_validate(parse_partial_json(buffer))
+    except Exception as exc:
+        logger.warning("Scene stream unusable, falling back to a regular call: %s", exc)
+
+    scene = await generate_scene(last_choice, state)
+    if scene.description != sent:
+        # Tell the client to replace whatever was streamed so far
+        await on_event("scene_text", {"text": scene.description})
+    return scene
+
+
+async def generate_scene_step(
+    last_choice: str,
+    state: UserState,
+    on_event: EventSink | None = None,
+    before_image: Callable[[], Awaitable[bool]] | None = None,
+    draft: SceneDraft | None = None,
+) -> Scene | None:
+    """Generate a new scene based on the current user state.
 
-    image_path = None
-    if image_prompt.change_scene:
-        image_path, _ = await generate_image(
-            image_prompt.scene_description, state.image_format, get_image_model(state.is_pro)
+    When ``on_event`` is given the description is streamed, and ``choices``
+    and ``image_ready`` events are emitted as soon as each stage finishes.
+
+    ``before_image`` is awaited right before the image stage; if it returns
+    False the step stops without calling Imagen, leaves the state untouched
+    and returns None. Finished stages are recorded in ``draft``.
+    """
+    draft = draft if draft is not None else SceneDraft()
+    if on_event is None:
+        scene = await generate_scene(last_choice, state)
+    else:
+        scene = await stream_scene(last_choice, state, on_event)
+        await on_event(
+            "choices", {"choices": [c.model_dump() for c in scene.choices]}
         )
+    draft.description = scene.description
+
+    logger.info(f"Generated scene step: {scene}")
 
-    # Ensure NPC update is applied before returning so persistence sees it
+    npc_updates = None
     try:
-        await npc_task
-    except Exception:
-        logger.exception("NPC update task failed on scene step")
+        image_prompt, npc_updates = await _post_process(state, scene.description, last_choice)
+        logger.info(f"Generated scene step image prompt: {image_prompt}")
+        draft.image_prompt = image_prompt.scene_description
+
+        if before_image is not None and not await before_image():
+            logger.info("Scene step stopped before the image stage")
+            _discard_npc_update(npc_updates)
+            return None
+
+        image, deferred_prompt = await _render_image(state, image_prompt)
+    except asyncio.CancelledError:
+        _discard_npc_update(npc_updates)
+        raise
+
+    if on_event is not None and deferred_prompt is None:
+        await on_event("image_ready", {"image": image.path if image else None})
+
+    await _join_npc_update(state, npc_updates, "scene step")
 
     scene_id = str(uuid.uuid4())
     scene = Scene(
         scene_id=scene_id,
         description=scene.description,
         choices=scene.choices,
-        image=image_path,
+        image=image.path if image else None,
+        image_meta=image.meta if image else None,
+        image_prompt=deferred_prompt,
     )
     state.scenes[scene_id] = scene
     state.last_image_prompt = image_prompt.scene_description
@@ -212,12 +400,16 @@ async def check_ending(
     """Check whether an ending has been reached."""
     if not state.story_frame:
         return _err("No story frame")
-    llm = create_llm().with_structured_output(EndingCheckResult)
-    history = "; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices)
+    history = render_history(state)
     prompt = ENDING_CHECK_PROMPT.format(
         history=history,
         language=state.language,
         endings=",".join(f"{e.id}:{e.condition}" for e in state.story_frame.endings),
     )
-    resp: EndingCheckResult = await with_retries(lambda: llm.ainvoke(prompt))
+    log_prompt_size("ending_check", prompt)
+    resp: EndingCheckResult = await with_retries(
+        lambda: create_llm().with_structured_output(EndingCheckResult).ainvoke(prompt),
+        INTERACTIVE_RETRY_POLICY,
+        name="ending_check",
+    )
     return resp
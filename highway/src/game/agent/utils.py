@@ -1,8 +1,16 @@
 """Agent-related utilities."""
 
 import asyncio
+import contextvars
 import logging
-from typing import Awaitable, Callable, TypeVar
+import random
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+from google.genai import errors as genai_errors
 
 from src.config import settings
 
@@ -10,23 +18,199 @@ logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
 
+# Receives progress events (name, payload) while a scene is being generated
+EventSink = Callable[[str, dict[str, Any]], Awaitable[None]]
+
+# Requests that fail the same way however often they are repeated
+_NON_RETRYABLE = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+    google_exceptions.NotFound,
+)
+_NON_RETRYABLE_MARKERS = ("INVALID_ARGUMENT", "PERMISSION_DENIED", "UNAUTHENTICATED")
+_NON_RETRYABLE_CODES = {400, 401, 403, 404}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Return False for errors that another attempt cannot fix."""
+    if isinstance(exc, _NON_RETRYABLE):
+        return False
+    if isinstance(exc, genai_errors.ClientError) and exc.code in _NON_RETRYABLE_CODES:
+        return False
+    text = str(exc)
+    return not any(marker in text for marker in _NON_RETRYABLE_MARKERS)
+
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "agent_deadline", default=None
+)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Bound every ``with_retries`` call inside the block by a shared budget.
+
+    Nested deadlines never extend an outer one. Tasks created inside the
+    block inherit it.
+    """
+    at = asyncio.get_running_loop().time() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """Seconds left until the current deadline, or None without one."""
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - asyncio.get_running_loop().time()
+
+
+class LatencyTracker:
+    """Recent successful latencies of one kind of call."""
+
+    def __init__(self, size: int = 200) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 20) -> float | None:
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(p * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+
+_latencies: dict[str, LatencyTracker] = {}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How ``with_retries`` repeats a failing call.
+
+    ``attempts`` includes the first try. Backoff before attempt ``n`` is
+    ``backoff * 2 ** (n - 1)`` capped at ``max_backoff``, with up to
+    ``jitter`` of it randomised. With ``hedge_percentile`` set, a duplicate
+    request is started once the call has been running longer than that
+    latency percentile of recent calls with the same name.
+    """
+
+    attempts: int = 2
+    timeout: float = settings.request_timeout
+    backoff: float = 0.5
+    max_backoff: float = 4.0
+    jitter: float = 0.5
+    hedge_percentile: float | None = None
+
+    def delay(self, attempt: int) -> float:
+        base = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return base * (1 - self.jitter * random.random())
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+# Player-facing calls: duplicate slow requests to cut tail latency
+INTERACTIVE_RETRY_POLICY = RetryPolicy(
+    attempts=3, hedge_percentile=settings.llm_hedge_percentile or None
+)
+
+
+async def _hedged(
+    awaitable_factory: Callable[[], Awaitable[T]], after: float
+) -> T:
+    """Run the call and start one duplicate if it is slower than ``after``."""
+    first = asyncio.ensure_future(awaitable_factory())
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=after)
+        if not done:
+            logger.info("Hedging request still running after %.2fs", after)
+            tasks.add(asyncio.ensure_future(awaitable_factory()))
+        error: BaseException | None = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        if not first.done():
+            first.cancel()
+
 
 async def with_retries(
     awaitable_factory: Callable[[], Awaitable[T]],
-    retries: int = 2,
-    timeout: int = settings.request_timeout,
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    name: str | None = None,
 ) -> T:
-    """Execute an awaitable with retries and timeout."""
-    last_exception = None
-    for attempt in range(retries):
+    """Execute an awaitable with retries, backoff and timeouts.
+
+    Each attempt is limited by ``policy.timeout`` and by the enclosing
+    :func:`deadline`, if any. Non-retryable errors are raised at once.
+    ``name`` groups latency samples for hedging.
+    """
+    loop = asyncio.get_running_loop()
+    tracker = _latencies.setdefault(name, LatencyTracker()) if name else None
+    last_exception: BaseException | None = None
+    for attempt in range(policy.attempts):
+        if attempt:
+            pause = policy.delay(attempt)
+            left = remaining_time()
+            if left is not None and left <= pause:
+                break
+            await asyncio.sleep(pause)
+        timeout = policy.timeout
+        left = remaining_time()
+        if left is not None:
+            if left <= 0:
+                break
+            timeout = min(timeout, left)
+
+        hedge_after = None
+        if tracker and policy.hedge_percentile:
+            hedge_after = tracker.percentile(policy.hedge_percentile)
+        started = loop.time()
         try:
-            return await asyncio.wait_for(awaitable_factory(), timeout=timeout)
+            if hedge_after is not None and hedge_after < timeout:
+                call = _hedged(awaitable_factory, hedge_after)
+            else:
+                call = awaitable_factory()
+            result = await asyncio.wait_for(call, timeout=timeout)
         except Exception as exc:
             logger.warning(
                 "Attempt %s/%s failed with error: %s",
                 attempt + 1,
-                retries,
+                policy.attempts,
                 exc,
             )
             last_exception = exc
+            if not is_retryable(exc):
+                raise
+            continue
+        if tracker:
+            tracker.record(loop.time() - started)
+        return result
+    if last_exception is None:
+        raise asyncio.TimeoutError("Deadline exceeded before the request started")
     raise last_exception
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for instrumentation."""
+    return (len(text) + 3) // 4
+
+
+def log_prompt_size(name: str, prompt: str) -> int:
+    """Log the approximate token count of a prompt and return it."""
+    tokens = approx_tokens(prompt)
+    logger.info("Prompt %s: ~%d tokens", name, tokens)
+    return tokens
@@ -0,0 +1,148 @@
+"""Encoding of generated images into compressed size variants.
+
+Imagen returns one large PNG. Decoding and re-encoding it is CPU-bound, so
+it runs in a process pool: each configured width is written as WebP (and
+AVIF if enabled) to content-addressed storage. The largest variant becomes
+the scene image; all variants, the original dimensions and a tiny blurred
+placeholder are recorded as the image metadata.
+"""
+
+import asyncio
+import base64
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image, ImageFilter, features
+
+from src.config import settings
+from src.game.images import storage
+from src.game.images.storage import IMAGE_URL_PREFIX, write_image_bytes
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_WIDTH = 16
+
+
+@dataclass
+class StoredImage:
+    """Path of the main variant and the metadata of all variants."""
+
+    path: str
+    meta: dict
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def _resized(image: Image.Image, width: int) -> Image.Image:
+    if image.width <= width:
+        return image
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def encode_variants(
+    data: bytes,
+    widths: dict[str, int],
+    quality: int,
+    avif: bool,
+    directory: str,
+) -> dict:
+    """Write all variants of ``data`` and return the image metadata.
+
+    Runs in a worker process, so it only takes and returns plain values.
+    Variants are ordered from the largest width down.
+    """
+    with Image.open(BytesIO(data)) as source:
+        image = source.convert("RGB")
+    formats = ["webp"] + (["avif"] if avif and features.check("avif") else [])
+    variants = {}
+    for name, width in sorted(widths.items(), key=lambda item: -item[1]):
+        resized = _resized(image, width)
+        variant = {"width": resized.width, "height": resized.height}
+        for fmt in formats:
+            path = write_image_bytes(_encode(resized, fmt, quality), fmt, directory)
+            variant[fmt] = os.path.basename(path)
+        variants[name] = variant
+    tiny = _resized(image, PLACEHOLDER_WIDTH).filter(ImageFilter.GaussianBlur(1))
+    placeholder = base64.b64encode(_encode(tiny, "webp", 30)).decode()
+    return {
+        "width": image.width,
+        "height": image.height,
+        "placeholder": f"data:image/webp;base64,{placeholder}",
+        "variants": variants,
+    }
+
+
+def public_image_meta(meta: dict | None) -> dict | None:
+    """Metadata for clients, with file names replaced by URLs."""
+    if not meta:
+        return None
+    variants = {
+        name: {
+            key: IMAGE_URL_PREFIX + value if key in ("webp", "avif") else value
+            for key, value in variant.items()
+        }
+        for name, variant in meta.get("variants", {}).items()
+    }
+    return {**meta, "variants": variants}
+
+
+class ImageEncoder:
+    """Run :func:`encode_variants` in a lazily started process pool."""
+
+    def __init__(self) -> None:
+        self._pool: Executor | None = None
+
+    def _executor(self) -> Executor | None:
+        if settings.image_encoder_workers <= 0:
+            return None
+        if self._pool is None:
+            # Forking a process that runs event loop and driver threads is
+            # unsafe; spawned workers only import this module
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.image_encoder_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def encode(self, data: bytes) -> StoredImage:
+        args = (
+            data,
+            settings.image_variant_widths,
+            settings.image_quality,
+            settings.image_avif,
+            storage.IMAGE_DIR,
+        )
+        executor = self._executor()
+        if executor is None:
+            meta = await asyncio.to_thread(encode_variants, *args)
+        else:
+            meta = await asyncio.get_running_loop().run_in_executor(
+                executor, encode_variants, *args
+            )
+        main = next(iter(meta["variants"].values()))
+        return StoredImage(path=os.path.join(storage.IMAGE_DIR, main["webp"]), meta=meta)
+
+    def shutdown(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_encoder = ImageEncoder()
+
+
+async def encode_image(data: bytes) -> StoredImage:
+    return await _encoder.encode(data)
+
+
+def shutdown_image_encoder() -> None:
+    _encoder.shutdown()
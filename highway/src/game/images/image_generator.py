@@ -1,10 +1,8 @@
 from google.genai import types
 import os
 from PIL import Image
-from io import BytesIO
-from datetime import datetime
 import logging
-import asyncio
+from src.game.images.encoder import StoredImage, encode_image
 from src.game.services.google import GoogleClientFactory
 from src.game.agent.utils import with_retries
 
@@ -34,19 +32,16 @@ image_negative_prompt = """"""
 def get_image_model(is_pro: bool) -> str:
     return "imagen-4.0-fast-generate-preview-06-06" if not is_pro else "imagen-4.0-ultra-generate-preview-06-06"
 
-async def generate_image(prompt: str, image_format: str, model: str = get_image_model(False)) -> tuple[str, str] | None:
+async def generate_image(prompt: str, image_format: str, model: str = get_image_model(False)) -> tuple[StoredImage | None, str | None]:
     """
-    Generate an image using Google's Gemini model and save it to generated/images directory.
+    Generate an image using Google's Gemini model and store its encoded variants.
 
     Args:
         prompt (str): The text prompt to generate the image from
 
     Returns:
-        str: Path to the generated image file, or None if generation failed
+        StoredImage: Main image path and variant metadata, or None if generation failed
     """
-    # Ensure the generated/images directory exists
-    output_dir = "generated/images"
-    os.makedirs(output_dir, exist_ok=True)
     aspect_ratio = "9:16" if image_format == "vertical" else "16:9"
     
     logger.info(f"Generating image with model: {model}")
@@ -69,18 +64,12 @@ async def generate_image(prompt: str, image_format: str, model: str = get_image_
         image_saved = False
         for generated_image in response.generated_images:
             if generated_image.image is not None:
-                # Create a filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"gemini_{timestamp}.png"
-                filepath = os.path.join(output_dir, filename)
-
-                # Save the image
-                image = Image.open(BytesIO(generated_image.image.image_bytes))
-                await asyncio.to_thread(image.save, filepath, "PNG")
-                logger.info(f"Image saved to: {filepath}")
+                # Encode size variants under their content hashes
+                stored = await encode_image(generated_image.image.image_bytes)
+                logger.info(f"Image saved to: {stored.path}")
                 image_saved = True
 
-                return filepath, prompt
+                return stored, prompt
 
         if not image_saved:
             logger.warning("Image was censored by Google!")
@@ -103,9 +92,6 @@ async def modify_image(image_path: str, modification_prompt: str) -> str | None:
     Returns:
         str: Path to the modified image file, or None if modification failed
     """
-    # Ensure the generated/images directory exists
-    output_dir = "generated/images"
-    os.makedirs(output_dir, exist_ok=True)
 
     logger.info(f"Modifying current scene image with prompt: {modification_prompt}")
 
@@ -135,18 +121,12 @@ async def modify_image(image_path: str, modification_prompt: str) -> str | None:
         image_saved = False
         for part in response.candidates[0].content.parts:
             if part.inline_data is not None:
-                # Create a filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"gemini_modified_{timestamp}.png"
-                filepath = os.path.join(output_dir, filename)
-
-                # Save the modified image
-                modified_image = Image.open(BytesIO(part.inline_data.data))
-                await asyncio.to_thread(modified_image.save, filepath, "PNG")
-                logger.info(f"Modified image saved to: {filepath}")
+                # Encode the modified image like a generated one
+                stored = await encode_image(part.inline_data.data)
+                logger.info(f"Modified image saved to: {stored.path}")
                 image_saved = True
 
-                return filepath, modification_prompt
+                return stored.path, modification_prompt
 
         if not image_saved:
             logger.warning("Updated image was censored by Google!")
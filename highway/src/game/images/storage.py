@@ -0,0 +1,65 @@
+"""Content-addressed storage for generated images.
+
+Images are written to ``IMAGE_DIR`` under the SHA-256 of their bytes, so a
+file never changes once written and its name doubles as a strong ETag.
+Clients get ``/api/v1/images/<name>`` URLs instead of inline image data.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+IMAGE_DIR = "generated/images"
+IMAGE_URL_PREFIX = "/api/v1/images/"
+
+_HASHED_NAME = re.compile(r"^[0-9a-f]{64}\.(png|webp|avif)$")
+# Files written before content addressing, e.g. gemini_20250101_120000.png.
+# Their names are guessable, so they are only served to their owner.
+_SAFE_NAME = re.compile(r"^[\w.-]+\.(png|webp|avif|jpg|jpeg)$")
+
+
+def is_content_addressed(name: str) -> bool:
+    return bool(_HASHED_NAME.match(name))
+
+
+def write_image_bytes(data: bytes, ext: str, directory: str | None = None) -> str:
+    """Store ``data`` under its hash and return the file path."""
+    directory = directory or IMAGE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{hashlib.sha256(data).hexdigest()}.{ext}")
+    if os.path.exists(path):
+        return path
+    # Write to a temp file first so a reader never sees a partial image
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+
+def image_url(path: str | None) -> str | None:
+    """URL of a stored image, or ``None`` if ``path`` is not servable."""
+    if not path or os.path.dirname(os.path.normpath(path)) != os.path.normpath(IMAGE_DIR):
+        return None
+    name = os.path.basename(path)
+    return IMAGE_URL_PREFIX + name if _SAFE_NAME.match(name) else None
+
+
+def path_from_url(url: str) -> str:
+    """Map an image URL back to its stored path; other values pass through."""
+    if url.startswith(IMAGE_URL_PREFIX):
+        return os.path.join(IMAGE_DIR, url[len(IMAGE_URL_PREFIX):])
+    return url
+
+
+def resolve_image(name: str) -> str | None:
+    """Path of the stored image ``name`` if it exists."""
+    if not _SAFE_NAME.match(name):
+        return None
+    path = os.path.join(IMAGE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -1,66 +1,354 @@
 import asyncio
+import hashlib
 import logging
+import threading
+import time
+from collections import deque
 from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any
+from uuid import UUID
+
 from google import genai
-import threading
+from google.api_core.exceptions import TooManyRequests
+from langchain_core.callbacks import BaseCallbackHandler
+from motor.motor_asyncio import AsyncIOMotorClient
 
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Window used for the "recent errors" health signal
+ERROR_WINDOW_SECONDS = 60
+SHARED_SYNC_INTERVAL_SECONDS = 5
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Return True if ``exc`` means the key hit its quota."""
+    if isinstance(exc, TooManyRequests):
+        return True
+    text = str(exc)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+
+@dataclass
+class _KeyState:
+    key: str
+    # Short hash used in logs, metrics and shared state instead of the key
+    key_id: str
+    tokens: float
+    refilled_at: float = field(default_factory=time.monotonic)
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    consecutive_limits: int = 0
+    cooldown_until: float = 0.0
+    recent_errors: deque = field(default_factory=deque)
+
+    def recent_error_count(self, now: float) -> int:
+        while self.recent_errors and now - self.recent_errors[0] > ERROR_WINDOW_SECONDS:
+            self.recent_errors.popleft()
+        return len(self.recent_errors)
+
 
 class ApiKeyPool:
-    """Manage Google API keys with round-robin selection."""
+    """Schedule Google API keys by load and health.
+
+    Every pick goes to the healthy key with the fewest in-flight requests
+    and recent errors; ties rotate round-robin. A key that reports a rate
+    limit is put into an exponentially growing cooldown, and with
+    ``api_key_rpm`` set each key also has a token bucket of that many
+    requests per minute. When every key is unavailable the one that
+    recovers first is used rather than failing the request.
+
+    With ``api_key_shared_state`` cooldowns are mirrored to MongoDB so all
+    uvicorn workers stop using a throttled key.
+    """
 
     def __init__(self) -> None:
-        self._keys: list[str] | None = None
+        self._keys: dict[str, _KeyState] | None = None
+        self._order: list[str] = []
         self._index = 0
-        self._lock = asyncio.Lock()
         self._sync_lock = threading.Lock()
+        self._sync_task: asyncio.Task | None = None
+        self._collection = None
 
     def _load_keys(self) -> None:
         keys_raw = settings.gemini_api_keys
-        keys_str = keys_raw.get_secret_value()
+        keys_str = keys_raw.get_secret_value() if keys_raw else ""
         keys = [k.strip() for k in keys_str.split(",") if k.strip()] if keys_str else []
         if not keys:
             msg = "Google API keys are not configured or invalid"
             logger.error(msg)
             raise ValueError(msg)
-        self._keys = keys
+        self._order = keys
+        self._keys = {
+            k: _KeyState(
+                key=k,
+                key_id=hashlib.sha256(k.encode()).hexdigest()[:8],
+                tokens=float(settings.api_key_rpm),
+            )
+            for k in keys
+        }
+
+    def _ensure_loaded(self) -> dict[str, _KeyState]:
+        if self._keys is None:
+            self._load_keys()
+        return self._keys
+
+    def keys(self) -> list[str]:
+        """Return all configured keys."""
+        with self._sync_lock:
+            self._ensure_loaded()
+            return list(self._order)
+
+    def key_for_id(self, key_id: str) -> str | None:
+        """Return the key with the given hash, if it is still configured."""
+        with self._sync_lock:
+            for state in self._ensure_loaded().values():
+                if state.key_id == key_id:
+                    return state.key
+        return None
+
+    def key_id(self, key: str) -> str:
+        with self._sync_lock:
+            return self._ensure_loaded()[key].key_id
+
+    def _refill(self, state: _KeyState, now: float) -> None:
+        rpm = settings.api_key_rpm
+        if rpm <= 0:
+            return
+        state.tokens = min(rpm, state.tokens + (now - state.refilled_at) * rpm / 60)
+        state.refilled_at = now
+
+    def _pick(self) -> str:
+        states = self._ensure_loaded()
+        now, wall = time.monotonic(), time.time()
+        rotation = {k: (i - self._index) % len(self._order) for i, k in enumerate(self._order)}
+        self._index = (self._index + 1) % len(self._order)
+
+        healthy = []
+        for state in states.values():
+            self._refill(state, now)
+            if state.cooldown_until > wall:
+                continue
+            if settings.api_key_rpm > 0 and state.tokens < 1:
+                continue
+            healthy.append(state)
+
+        if healthy:
+            chosen = min(
+                healthy,
+                key=lambda s: (s.in_flight, s.recent_error_count(now), rotation[s.key]),
+            )
+        else:
+            # Everything is throttled: use whatever frees up first
+            chosen = min(
+                states.values(),
+                key=lambda s: (max(s.cooldown_until - wall, 0), -s.tokens, rotation[s.key]),
+            )
+            logger.warning("All API keys are throttled; using key %s", chosen.key_id)
+        if settings.api_key_rpm > 0:
+            chosen.tokens = max(chosen.tokens - 1, 0)
+        logger.debug("Using Google API key %s", chosen.key_id)
+        return chosen.key
 
     async def get_key(self) -> str:
-        async with self._lock:
-            if self._keys is None:
-                self._load_keys()
-            key = self._keys[self._index]
-            self._index = (self._index + 1) % len(self._keys)
-            logger.debug("Using Google API key index %s", self._index)
-            return key
+        with self._sync_lock:
+            return self._pick()
 
     def get_key_sync(self) -> str:
         """Synchronous helper for environments without an event loop."""
         with self._sync_lock:
-            if self._keys is None:
-                self._load_keys()
-            key = self._keys[self._index]
-            self._index = (self._index + 1) % len(self._keys)
-            logger.debug("Using Google API key index %s", self._index)
-            return key
+            return self._pick()
+
+    def started(self, key: str) -> None:
+        with self._sync_lock:
+            state = self._ensure_loaded().get(key)
+            if state is not None:
+                state.in_flight += 1
+                state.requests += 1
+
+    def finished(self, key: str, error: BaseException | None = None) -> None:
+        """Record the outcome of a request made with ``key``."""
+        cooldown_until = None
+        with self._sync_lock:
+            state = self._ensure_loaded().get(key)
+            if state is None:
+                return
+            state.in_flight = max(state.in_flight - 1, 0)
+            if error is None:
+                state.consecutive_limits = 0
+                return
+            state.errors += 1
+            state.recent_errors.append(time.monotonic())
+            if not is_rate_limited(error):
+                return
+            state.rate_limited += 1
+            state.consecutive_limits += 1
+            delay = min(
+                settings.api_key_cooldown_seconds * 2 ** (state.consecutive_limits - 1),
+                settings.api_key_max_cooldown_seconds,
+            )
+            state.cooldown_until = max(state.cooldown_until, time.time() + delay)
+            cooldown_until = state.cooldown_until
+            logger.warning("API key %s rate limited; cooling down for %.0fs", state.key_id, delay)
+        if cooldown_until is not None and settings.api_key_shared_state:
+            self._publish_cooldown(state.key_id, cooldown_until)
+
+    def usage_callback(self, key: str) -> "KeyUsageCallback":
+        return KeyUsageCallback(self, key)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """Per-key metrics; keys are identified by hash only."""
+        with self._sync_lock:
+            states = self._ensure_loaded()
+            now, wall = time.monotonic(), time.time()
+            result = []
+            for key in self._order:
+                state = states[key]
+                self._refill(state, now)
+                result.append(
+                    {
+                        "key_id": state.key_id,
+                        "in_flight": state.in_flight,
+                        "requests": state.requests,
+                        "errors": state.errors,
+                        "recent_errors": state.recent_error_count(now),
+                        "rate_limited": state.rate_limited,
+                        "cooldown_remaining": round(max(state.cooldown_until - wall, 0), 1),
+                        "tokens": round(state.tokens, 1) if settings.api_key_rpm > 0 else None,
+                    }
+                )
+            return result
+
+    # Shared state across workers
+
+    def _publish_cooldown(self, key_id: str, until: float) -> None:
+        if self._sync_task is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        async def publish() -> None:
+            try:
+                await self._collection.update_one(
+                    {"_id": key_id}, {"$max": {"until": until}}, upsert=True
+                )
+            except Exception:
+                logger.exception("Failed to publish cooldown for API key %s", key_id)
+
+        loop.create_task(publish())
+
+    async def _sync_shared_state(self) -> None:
+        while True:
+            try:
+                wall = time.time()
+                cursor = self._collection.find({"until": {"$gt": wall}})
+                cooldowns = {doc["_id"]: doc["until"] async for doc in cursor}
+                with self._sync_lock:
+                    for state in self._ensure_loaded().values():
+                        until = cooldowns.get(state.key_id)
+                        if until is not None and until > state.cooldown_until:
+                            state.cooldown_until = until
+            except Exception:
+                logger.exception("Failed to sync shared API key state")
+            await asyncio.sleep(SHARED_SYNC_INTERVAL_SECONDS)
+
+    def start_shared_sync(self) -> None:
+        if not settings.api_key_shared_state or self._sync_task is not None:
+            return
+        client = AsyncIOMotorClient(settings.mongodb_uri)
+        self._collection = client[settings.mongodb_db]["api_key_cooldowns"]
+        self._sync_task = asyncio.create_task(self._sync_shared_state())
+
+    def stop_shared_sync(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+
+class KeyUsageCallback(BaseCallbackHandler):
+    """Report LangChain model calls made with one API key to the pool."""
+
+    # Keep bookkeeping on the event loop thread instead of an executor
+    run_inline = True
+
+    def __init__(self, pool: ApiKeyPool, key: str) -> None:
+        self._pool = pool
+        self._key = key
+        self._runs: set[UUID] = set()
+
+    def _start(self, run_id: UUID) -> None:
+        self._runs.add(run_id)
+        self._pool.started(self._key)
+
+    def _finish(self, run_id: UUID, error: BaseException | None = None) -> None:
+        if run_id in self._runs:
+            self._runs.discard(run_id)
+            self._pool.finished(self._key, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs) -> None:
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._finish(run_id, error)
+
+
+key_pool = ApiKeyPool()
 
 
 class GoogleClientFactory:
-    """Factory for thread-safe creation of Google GenAI clients."""
+    """Factory for shared Google GenAI clients.
+
+    The Vertex client is created once and reused, so auth and HTTP
+    connections stay warm between images.
+    """
 
-    _pool = ApiKeyPool()
+    _image_client: genai.Client | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_image_client(cls) -> genai.Client:
+        if cls._image_client is None:
+            with cls._lock:
+                if cls._image_client is None:
+                    cls._image_client = genai.Client(
+                        vertexai=True,
+                        project="gen-lang-client-0342725631",
+                        location="us-central1",
+                    )
+        return cls._image_client
 
     @classmethod
     @asynccontextmanager
     async def image(cls):
-        key = await cls._pool.get_key()
-        client = genai.Client(
-            vertexai=True, project="gen-lang-client-0342725631", location="us-central1"
-        )
+        yield cls._get_image_client().aio
+
+    @classmethod
+    def prewarm(cls) -> None:
+        try:
+            cls._get_image_client()
+        except Exception:
+            logger.exception("Failed to prewarm the image client")
+
+    @classmethod
+    async def close(cls) -> None:
+        with cls._lock:
+            client, cls._image_client = cls._image_client, None
+        if client is None:
+            return
         try:
-            yield client.aio
-        finally:
-            pass
+            await client.aio.aclose()
+            client.close()
+        except Exception:
+            logger.exception("Failed to close the image client")
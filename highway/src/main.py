@@ -12,8 +12,18 @@ from src.api.scenes.router import router as scenes_router
 from src.api.payments.router import router as payments_router
 from src.api.wish_payments.router import router as wish_payments_router
 from src.api.admin.router import router as admin_router
+from src.api.images.router import router as images_router
 from src.cron import energy_restore_worker
 from src.utils.import_stories_on_startup import import_stories_on_startup
+from src.game.agent.pregen import cancel_pregeneration
+from src.api.scenes.image_jobs import shutdown_image_jobs
+from src.game.images.encoder import shutdown_image_encoder
+from src.core.redis_client import close_redis
+from src.utils.cache import close_shared_caches
+from src.game.agent.context_cache import close_context_cache
+from src.game.agent.llm import close_llm_clients, prewarm_llm_clients
+from src.game.agent.mongo_state import start_state_store
+from src.game.services.google import GoogleClientFactory, key_pool
 
 import asyncio
 
@@ -46,6 +56,7 @@ app.include_router(scenes_router)
 app.include_router(payments_router)
 app.include_router(wish_payments_router)
 app.include_router(admin_router)
+app.include_router(images_router)
 
 @app.get("/health-check")
 def health_check() -> dict:
@@ -58,3 +69,21 @@ def health_check() -> dict:
 async def startup_tasks() -> None:
     asyncio.create_task(energy_restore_worker())
     asyncio.create_task(import_stories_on_startup())
+    start_state_store()
+    prewarm_llm_clients()
+    key_pool.start_shared_sync()
+    # Resolving Vertex credentials may block on the metadata server
+    await asyncio.to_thread(GoogleClientFactory.prewarm)
+
+
+@app.on_event("shutdown")
+async def shutdown_tasks() -> None:
+    cancel_pregeneration()
+    key_pool.stop_shared_sync()
+    await shutdown_image_jobs()
+    shutdown_image_encoder()
+    await close_llm_clients()
+    await close_context_cache()
+    await GoogleClientFactory.close()
+    await close_shared_caches()
+    await close_redis()
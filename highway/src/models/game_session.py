@@ -36,6 +36,8 @@ class GameSession(Base):
     )
     story_frame: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
     is_finished: Mapped[bool] = mapped_column(Boolean, default=False)
+    # order_num of the latest scene; replaces a MAX() scan per step
+    scene_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
     user: Mapped["User"] = relationship(back_populates="sessions")
     story: Mapped["Story | None"] = relationship(
@@ -2,7 +2,7 @@
 
 import uuid
 
-from sqlalchemy import Text, ForeignKey, Integer
+from sqlalchemy import Index, Text, ForeignKey, Integer
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -12,6 +12,8 @@ class Scene(Base):
     """A single scene in the interactive story."""
 
     __tablename__ = "scenes"
+    # History pages and the latest-scene lookup walk this index
+    __table_args__ = (Index("ix_scenes_session_id_order_num", "session_id", "order_num"),)
 
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -23,6 +25,11 @@ class Scene(Base):
     description: Mapped[str | None] = mapped_column(Text, nullable=True)
     generated_choices: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
     image_path: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Size variants, dimensions and placeholder of the encoded image
+    image_meta: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    # "pending" while the image is generated in the background, then
+    # "ready" or "failed"; None for scenes without an image
+    image_status: Mapped[str | None] = mapped_column(Text, nullable=True)
 
     session: Mapped["GameSession"] = relationship(back_populates="scenes")
     choices: Mapped[list["Choice"]] = relationship(back_populates="scene")
@@ -1,28 +1,235 @@
-"""Simple async-safe in-process TTL cache.
+"""Simple async-safe two-tier TTL cache.
 
-Avoids external dependencies (no Redis). Suitable for small datasets and
-read-heavy endpoints. Values expire after a configurable TTL.
+The in-process store is the first tier. An optional :class:`RedisCacheTier`
+is the second: it shares loaded values between workers and broadcasts
+invalidations so a write evicts the in-process copies everywhere. Without
+Redis the cache is process-local. Suitable for small datasets and
+read-heavy endpoints. Entries are fresh for ``ttl_seconds``; after that they
+are served stale for up to ``stale_seconds`` more while one background
+refresh runs, and only then dropped. ``None`` results are kept as negative
+entries for ``negative_ttl_seconds``.
+
+Entries carry tags such as ``world:<id>`` or ``user:<tg_id>``. Both tiers
+keep an index from tag to keys, so a write invalidates exactly the entries
+it affects instead of scanning the whole store.
 """
 
 from __future__ import annotations
 
 import time
 import asyncio
+import json
+import logging
+import uuid
 from collections import OrderedDict
-from typing import Any, Callable, Sequence
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable, Mapping, Sequence, get_type_hints
 import inspect
 from functools import wraps
 
+from pydantic import TypeAdapter
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAMESPACE = "default"
+
+# Stored entry: (fresh_until, expires_at, value, namespace, tags)
+_Entry = tuple[float, float, Any, str, tuple[str, ...]]
+
+# Listener tasks of all shared tiers, cancelled on shutdown
+_listeners: set[asyncio.Task] = set()
+# Named caches, for stats
+_caches: dict[str, "AsyncTTLCache"] = {}
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    # Served past the soft TTL while a refresh ran
+    stale_hits: int = 0
+    misses: int = 0
+    # Misses answered by the shared tier instead of the loader
+    shared_hits: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+class RedisCacheTier:
+    """Redis tier of one cache.
+
+    Values are stored as JSON under ``cache:<name>:<key>`` and every tag is
+    a Redis set of the keys carrying it. Invalidations delete the matching
+    Redis keys and are published on ``cache_invalidate:<name>`` so every
+    other worker drops them from its in-process tier.
+    """
+
+    RECONNECT_DELAY_SECONDS = 1.0
+    MAX_RECONNECT_DELAY_SECONDS = 60.0
+
+    def __init__(self, name: str, redis_getter: Callable[[], "Redis | None"]) -> None:
+        self.name = name
+        self._redis_getter = redis_getter
+        # Our own broadcasts come back through the subscription; skip them
+        self._origin = uuid.uuid4().hex
+
+    @property
+    def channel(self) -> str:
+        return f"cache_invalidate:{self.name}"
+
+    def _key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def _tag(self, tag: str) -> str:
+        return f"cache_tag:{self.name}:{tag}"
+
+    async def get(self, key: str) -> str | None:
+        redis = self._redis_getter()
+        if redis is None:
+            return None
+        try:
+            return await redis.get(self._key(key))
+        except Exception as exc:
+            logger.warning("Shared cache read failed for %s: %r", key, exc)
+            return None
+
+    async def set(self, key: str, payload: str, ttl_seconds: int, tags: Iterable[str] = ()) -> None:
+        redis = self._redis_getter()
+        if redis is None:
+            return
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set(self._key(key), payload, ex=ttl_seconds or None)
+                for tag in tags:
+                    pipe.sadd(self._tag(tag), self._key(key))
+                    # The index must outlive every member: give a new set
+                    # this TTL and only ever extend it (short-lived negative
+                    # entries share tags with regular ones)
+                    if ttl_seconds:
+                        pipe.expire(self._tag(tag), ttl_seconds, nx=True)
+                        pipe.expire(self._tag(tag), ttl_seconds, gt=True)
+                    else:
+                        pipe.persist(self._tag(tag))
+                await pipe.execute()
+        except Exception as exc:
+            logger.warning("Shared cache write failed for %s: %r", key, exc)
+
+    async def invalidate(
+        self,
+        *,
+        key: str | None = None,
+        prefix: str | None = None,
+        tags: Sequence[str] = (),
+    ) -> None:
+        """Delete ``key``, the keys under ``tags`` or under ``prefix`` and
+        tell the other workers."""
+        redis = self._redis_getter()
+        if redis is None:
+            return
+        try:
+            if key is not None:
+                await redis.unlink(self._key(key))
+            elif tags:
+                for tag in tags:
+                    keys = await redis.smembers(self._tag(tag))
+                    await redis.unlink(self._tag(tag), *keys)
+            else:
+                # Only used to clear a whole cache
+                keys = [k async for k in redis.scan_iter(match=self._key(prefix or "") + "*")]
+                if keys:
+                    await redis.unlink(*keys)
+            message = {"origin": self._origin, "key": key, "prefix": prefix, "tags": list(tags)}
+            await redis.publish(self.channel, json.dumps(message))
+        except Exception as exc:
+            logger.warning("Shared cache invalidation failed in %s: %r", self.name, exc)
+
+    def start(self, on_invalidate: Callable[[dict], None]) -> None:
+        """Subscribe to invalidations of other workers in the background."""
+        if self._redis_getter() is None:
+            return
+        task = asyncio.create_task(self._listen(on_invalidate))
+        _listeners.add(task)
+        task.add_done_callback(_listeners.discard)
+
+    async def _listen(self, on_invalidate: Callable[[dict], None]) -> None:
+        delay = self.RECONNECT_DELAY_SECONDS
+        # Whether the last attempt failed, so an outage is logged once
+        failing = False
+        while True:
+            redis = self._redis_getter()
+            if redis is None:
+                return
+            pubsub = redis.pubsub()
+            subscribed = False
+            try:
+                await pubsub.subscribe(self.channel)
+                subscribed = True
+                if failing:
+                    logger.info("Cache invalidation listener for %s reconnected", self.name)
+                failing = False
+                delay = self.RECONNECT_DELAY_SECONDS
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") != self._origin:
+                        on_invalidate(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                if not failing:
+                    logger.warning("Cache invalidation listener for %s failed: %r", self.name, exc)
+                failing = True
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            if subscribed:
+                # Anything published while we were away was missed; only a
+                # lost subscription can miss messages, not a failed connect
+                on_invalidate({"prefix": ""})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY_SECONDS)
+
 
 class AsyncTTLCache:
-    """A lightweight async-safe TTL cache with basic LRU eviction."""
+    """A lightweight async-safe TTL cache with basic LRU eviction.
+
+    All bookkeeping happens between awaits on the event loop thread, so no
+    lock is needed around the store. Concurrent misses for one key share a
+    single in-flight load (see :meth:`get_or_load`).
+    """
 
-    def __init__(self, max_items: int, ttl_seconds: int) -> None:
+    def __init__(
+        self,
+        max_items: int,
+        ttl_seconds: int,
+        stale_seconds: int = 0,
+        negative_ttl_seconds: int = 0,
+        shared: RedisCacheTier | None = None,
+        name: str | None = None,
+    ) -> None:
         self._max_items = max(1, int(max_items))
         # ttl_seconds == 0 means unlimited TTL (no expiration)
         self._ttl_seconds = max(0, int(ttl_seconds))
-        self._store: OrderedDict[str, tuple[float, Any]] = OrderedDict()
-        self._lock = asyncio.Lock()
+        # Soft TTL is ttl_seconds, hard TTL is ttl_seconds + stale_seconds
+        self._stale_seconds = max(0, int(stale_seconds))
+        # 0 disables negative caching
+        self._negative_ttl_seconds = max(0, int(negative_ttl_seconds))
+        self._store: OrderedDict[str, _Entry] = OrderedDict()
+        self._tag_keys: dict[str, set[str]] = {}
+        # key -> (task, tags) of loads in progress
+        self._inflight: dict[str, tuple[asyncio.Task, tuple[str, ...]]] = {}
+        # Bumped by every invalidation; loads started before it are not stored
+        self._epoch = 0
+        self._shared = shared
+        self._listening = False
+        self._stats: dict[str, CacheStats] = {}
+        if name:
+            _caches[name] = self
 
     def _now(self) -> float:
         return time.monotonic()
@@ -30,42 +237,232 @@ class AsyncTTLCache:
     def _is_expired(self, expires_at: float) -> bool:
         return self._now() >= expires_at
 
+    def _stat(self, namespace: str) -> CacheStats:
+        stats = self._stats.get(namespace)
+        if stats is None:
+            stats = self._stats[namespace] = CacheStats()
+        return stats
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Counters per namespace (the ``prefix`` of :func:`cached`)."""
+        return {ns: asdict(stats) for ns, stats in sorted(self._stats.items())}
+
+    def _drop(self, key: str) -> _Entry | None:
+        item = self._store.pop(key, None)
+        if item is not None:
+            for tag in item[4]:
+                keys = self._tag_keys.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tag_keys[tag]
+        return item
+
+    def _entry(self, key: str) -> _Entry | None:
+        item = self._store.get(key)
+        if not item:
+            return None
+        if self._is_expired(item[1]):
+            # Drop expired
+            self._drop(key)
+            return None
+        # Mark as recently used
+        self._store.move_to_end(key)
+        return item
+
+    def _set(
+        self,
+        key: str,
+        value: Any,
+        namespace: str = DEFAULT_NAMESPACE,
+        tags: tuple[str, ...] = (),
+    ) -> None:
+        now = self._now()
+        if value is None:
+            if not self._negative_ttl_seconds:
+                return
+            fresh_until = expires_at = now + self._negative_ttl_seconds
+        elif self._ttl_seconds > 0:
+            fresh_until = now + self._ttl_seconds
+            expires_at = fresh_until + self._stale_seconds
+        else:
+            fresh_until = expires_at = float("inf")
+        self._drop(key)
+        self._store[key] = (fresh_until, expires_at, value, namespace, tags)
+        for tag in tags:
+            self._tag_keys.setdefault(tag, set()).add(key)
+        # Evict oldest if over capacity
+        while len(self._store) > self._max_items:
+            evicted = self._drop(next(iter(self._store)))
+            self._stat(evicted[3]).evictions += 1
+
     async def get(self, key: str) -> Any | None:
-        async with self._lock:
-            item = self._store.get(key)
-            if not item:
-                return None
-            expires_at, value = item
-            if self._ttl_seconds > 0 and self._is_expired(expires_at):
-                # Drop expired
-                self._store.pop(key, None)
-                return None
-            # Mark as recently used
-            self._store.move_to_end(key)
+        entry = self._entry(key)
+        return entry[2] if entry else None
+
+    async def set(self, key: str, value: Any, tags: Sequence[str] = ()) -> None:
+        self._set(key, value, tags=tuple(tags))
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        adapter: TypeAdapter | None = None,
+        *,
+        namespace: str = DEFAULT_NAMESPACE,
+        tags: Sequence[str] = (),
+    ) -> Any:
+        """Return the cached value or run ``loader`` once for all callers.
+
+        Callers missing the same key while a load runs await that load
+        instead of starting their own. A failing loader raises in every
+        waiter and nothing is cached. A stale entry is returned right away
+        and refreshed in the background, so ``loader`` must not depend on
+        the caller's request scope. ``adapter`` serializes the value for
+        the shared tier; without it the value stays in this process.
+        ``tags`` are the handles :meth:`invalidate_tags` evicts it by.
+        """
+        self._ensure_listening()
+        stats = self._stat(namespace)
+        entry = self._entry(key)
+        if entry is not None:
+            fresh_until, _, value, _, _ = entry
+            if not self._is_expired(fresh_until):
+                stats.hits += 1
+                return value
+            stats.stale_hits += 1
+            if key not in self._inflight:
+                task = self._start_load(key, loader, adapter, namespace, tuple(tags))
+                task.add_done_callback(self._log_refresh_error)
             return value
+        stats.misses += 1
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            task = inflight[0]
+        else:
+            task = self._start_load(key, loader, adapter, namespace, tuple(tags))
+        # A cancelled caller must not cancel the load the others wait for
+        return await asyncio.shield(task)
+
+    def _ensure_listening(self) -> None:
+        if self._shared is not None and not self._listening:
+            self._listening = True
+            self._shared.start(self._apply_invalidation)
+
+    def _start_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        adapter: TypeAdapter | None,
+        namespace: str,
+        tags: tuple[str, ...],
+    ) -> asyncio.Task:
+        task = asyncio.create_task(
+            self._load(key, loader, adapter, namespace, tags, self._epoch)
+        )
+        self._inflight[key] = (task, tags)
+        return task
+
+    async def _load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        adapter: TypeAdapter | None,
+        namespace: str,
+        tags: tuple[str, ...],
+        epoch: int,
+    ) -> Any:
+        shared = self._shared if adapter is not None else None
+        try:
+            payload = await shared.get(key) if shared else None
+            if payload is not None:
+                self._stat(namespace).shared_hits += 1
+                value = adapter.validate_json(payload)
+            else:
+                value = await loader()
+                if shared and epoch == self._epoch:
+                    await self._store_shared(shared, key, value, adapter, tags)
+            if epoch == self._epoch:
+                self._set(key, value, namespace, tags)
+            return value
+        finally:
+            inflight = self._inflight.get(key)
+            if inflight is not None and inflight[0] is asyncio.current_task():
+                self._inflight.pop(key, None)
+
+    async def _store_shared(
+        self,
+        shared: RedisCacheTier,
+        key: str,
+        value: Any,
+        adapter: TypeAdapter,
+        tags: tuple[str, ...],
+    ) -> None:
+        # Redis keeps values only while they are fresh; past that each worker
+        # serves its own stale copy while refreshing
+        if value is None:
+            if not self._negative_ttl_seconds:
+                return
+            ttl = self._negative_ttl_seconds
+        else:
+            ttl = self._ttl_seconds
+        await shared.set(key, adapter.dump_json(value).decode(), ttl, tags)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task) -> None:
+        # The stale entry stays until its hard TTL, so a failed refresh
+        # only costs another attempt on the next read
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Background cache refresh failed: %r", task.exception())
+
+    def _invalidate(self, keys: Iterable[str]) -> None:
+        self._epoch += 1
+        for k in keys:
+            item = self._drop(k)
+            if item is not None:
+                self._stat(item[3]).invalidations += 1
+            # Later callers start a fresh load instead of joining a stale one
+            self._inflight.pop(k, None)
 
-    async def set(self, key: str, value: Any) -> None:
-        async with self._lock:
-            expires_at = self._now() + self._ttl_seconds if self._ttl_seconds > 0 else float("inf")
-            self._store[key] = (expires_at, value)
-            self._store.move_to_end(key)
-            # Evict oldest if over capacity
-            while len(self._store) > self._max_items:
-                self._store.popitem(last=False)
+    def _apply_invalidation(self, message: Mapping[str, Any]) -> None:
+        """Evict the local entries named by an invalidation broadcast."""
+        if message.get("key") is not None:
+            self._invalidate([message["key"]])
+        elif message.get("tags"):
+            self._invalidate_tags_local(message["tags"])
+        else:
+            prefix = message.get("prefix") or ""
+            keys = {k for k in self._store if k.startswith(prefix)}
+            keys.update(k for k in self._inflight if k.startswith(prefix))
+            self._invalidate(keys)
+
+    def _invalidate_tags_local(self, tags: Iterable[str]) -> None:
+        wanted = set(tags)
+        keys: set[str] = set()
+        for tag in wanted:
+            keys.update(self._tag_keys.get(tag, ()))
+        keys.update(k for k, (_, t) in self._inflight.items() if wanted.intersection(t))
+        self._invalidate(keys)
 
     async def delete(self, key: str) -> None:
-        async with self._lock:
-            self._store.pop(key, None)
+        self._apply_invalidation({"key": key})
+        if self._shared is not None:
+            await self._shared.invalidate(key=key)
+
+    async def invalidate_tags(self, *tags: str) -> None:
+        """Evict every entry carrying any of ``tags`` from both tiers."""
+        self._invalidate_tags_local(tags)
+        if self._shared is not None:
+            await self._shared.invalidate(tags=tags)
 
     async def delete_prefix(self, prefix: str) -> None:
-        async with self._lock:
-            keys_to_delete = [k for k in self._store.keys() if k.startswith(prefix)]
-            for k in keys_to_delete:
-                self._store.pop(k, None)
+        """Evict all keys under ``prefix``; walks every key, prefer tags."""
+        self._apply_invalidation({"prefix": prefix})
+        if self._shared is not None:
+            await self._shared.invalidate(prefix=prefix)
 
     async def clear(self) -> None:
-        async with self._lock:
-            self._store.clear()
+        await self.delete_prefix("")
 
 
 def _build_key_from_args(
@@ -80,41 +477,85 @@ def _build_key_from_args(
     return ":".join(parts)
 
 
+def _build_tags_from_args(
+    func: Callable[..., Any], tags: Mapping[str, str] | None, args: tuple[Any, ...], kwargs: dict[str, Any]
+) -> tuple[str, ...]:
+    if not tags:
+        return ()
+    bound = inspect.signature(func).bind_partial(*args, **kwargs)
+    return tuple(f"{tag}:{bound.arguments.get(name)}" for tag, name in tags.items())
+
+
 def cached(
     cache_getter: Callable[[], AsyncTTLCache | None],
     *,
     include: Sequence[str] | None = None,
     prefix: str | None = None,
+    tags: Mapping[str, str] | None = None,
 ):
     """Decorator to cache async function results in an AsyncTTLCache.
 
     - cache_getter: function returning the cache instance (or None to disable)
     - include: parameter names to include in the key
     - prefix: key prefix namespace (defaults to module.qualname)
+    - tags: tag name -> parameter name, e.g. ``{"world": "world_id"}`` tags
+      the entry ``world:<world_id>`` for :func:`invalidate_tags`
+
+    Concurrent calls with the same key run the function only once. The
+    return annotation decides how values are serialized for the shared tier;
+    unannotated functions are cached in-process only.
     """
 
     def decorator(func: Callable[..., Any]):
+        adapter: list[TypeAdapter | None] = []
+        namespace = prefix or f"{func.__module__}.{func.__qualname__}"
+
+        def get_adapter() -> TypeAdapter | None:
+            # Resolved on first call, when all annotated types exist
+            if not adapter:
+                hint = get_type_hints(func).get("return")
+                adapter.append(TypeAdapter(hint) if hint is not None else None)
+            return adapter[0]
+
         @wraps(func)
         async def wrapper(*args: Any, **kwargs: Any):
             cache = cache_getter()
             if cache is None:
                 return await func(*args, **kwargs)
             key = _build_key_from_args(func, include, prefix, args, kwargs)
-            cached_value = await cache.get(key)
-            if cached_value is not None:
-                return cached_value
-            result = await func(*args, **kwargs)
-            await cache.set(key, result)
-            return result
+            return await cache.get_or_load(
+                key,
+                lambda: func(*args, **kwargs),
+                get_adapter(),
+                namespace=namespace,
+                tags=_build_tags_from_args(func, tags, args, kwargs),
+            )
 
         return wrapper
 
     return decorator
 
 
-async def invalidate_prefix(cache_getter: Callable[[], AsyncTTLCache | None], prefix: str) -> None:
+async def invalidate_tags(cache_getter: Callable[[], AsyncTTLCache | None], *tags: str) -> None:
     cache = cache_getter()
     if cache:
-        await cache.delete_prefix(prefix)
+        await cache.invalidate_tags(*tags)
+
+
+async def clear_cache(cache_getter: Callable[[], AsyncTTLCache | None]) -> None:
+    cache = cache_getter()
+    if cache:
+        await cache.clear()
+
+
+def cache_stats() -> dict[str, dict[str, dict[str, int]]]:
+    """Per-namespace counters of every named cache in this worker."""
+    return {name: cache.stats() for name, cache in sorted(_caches.items())}
 
 
+async def close_shared_caches() -> None:
+    """Stop all invalidation listeners."""
+    tasks = list(_listeners)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
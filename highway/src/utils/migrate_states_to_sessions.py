@@ -0,0 +1,117 @@
+"""Re-key agent state documents from user id to session id.
+
+Before states were stored per session, each user had one document with
+``_id`` = user id holding the state of whichever game was played last. This
+script moves every such document to the session it belongs to. The agent's
+scene ids never appear in PostgreSQL, so the match is by content: the
+user's session whose latest scene has the description of the state's
+current scene. Documents that cannot be matched unambiguously, or whose
+session already has a state, are dropped; the scene step rebuilds them from
+PostgreSQL. Archived scenes are re-keyed the same way.
+
+Safe to run more than once. Usage::
+
+    python -m src.utils.migrate_states_to_sessions [--dry-run]
+"""
+
+import argparse
+import asyncio
+import logging
+import uuid
+
+from sqlalchemy import select
+
+from src.core.database import AsyncSessionLocal
+from src.game.agent.mongo_state import _archive, _repo
+from src.models.game_session import GameSession
+from src.models.scene import Scene
+
+logger = logging.getLogger(__name__)
+
+
+def _current_description(data: dict) -> str | None:
+    """Description of the scene the state was last showing."""
+    scene = (data.get("scenes") or {}).get(data.get("current_scene_id") or "")
+    return scene.get("description") if scene else None
+
+
+async def _find_session(db, user_id: int, data: dict) -> uuid.UUID | None:
+    description = _current_description(data)
+    if not description:
+        return None
+    res = await db.execute(
+        select(GameSession.id)
+        .join(Scene, Scene.session_id == GameSession.id)
+        .where(
+            GameSession.user_id == user_id,
+            Scene.description == description,
+            # Only the newest scene of a session can be its current one
+            Scene.order_num == GameSession.scene_count,
+        )
+        .distinct()
+        .limit(2)
+    )
+    matches = res.scalars().all()
+    if len(matches) != 1:
+        return None
+    return matches[0]
+
+
+async def _move_archive(user_key: str, session_key: str, dry_run: bool) -> int:
+    docs = [doc async for doc in _archive.collection.find({"user_id": user_key})]
+    if dry_run or not docs:
+        return len(docs)
+    for doc in docs:
+        scene_id = doc["_id"].split(":", 1)[1]
+        await _archive.collection.replace_one(
+            {"_id": f"{session_key}:{scene_id}"},
+            {"session_id": session_key, "data": doc["data"]},
+            upsert=True,
+        )
+    await _archive.collection.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    return len(docs)
+
+
+async def migrate(dry_run: bool = False) -> dict[str, int]:
+    stats = {"moved": 0, "dropped": 0, "archived_scenes": 0}
+    states = _repo.collection
+    async with AsyncSessionLocal() as db:
+        async for doc in states.find({"user_id": {"$exists": False}}):
+            user_key = str(doc["_id"])
+            try:
+                user_id = int(user_key)
+            except ValueError:
+                continue
+            data = doc.get("data") or {}
+            session_id = await _find_session(db, user_id, data)
+            session_key = str(session_id) if session_id else None
+            if session_key is None or await states.count_documents({"_id": session_key}):
+                logger.info("Dropping state of user %s: no matching free session", user_key)
+                stats["dropped"] += 1
+                if not dry_run:
+                    await states.delete_one({"_id": doc["_id"]})
+                continue
+            logger.info("Moving state of user %s to session %s", user_key, session_key)
+            stats["archived_scenes"] += await _move_archive(user_key, session_key, dry_run)
+            stats["moved"] += 1
+            if dry_run:
+                continue
+            await states.insert_one(
+                {
+                    "_id": session_key,
+                    "user_id": user_key,
+                    "data": data,
+                    "version": doc.get("version", 0) + 1,
+                }
+            )
+            await states.delete_one({"_id": doc["_id"]})
+    await _repo.ensure_indexes()
+    await _archive.ensure_indexes()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    print(asyncio.run(migrate(args.dry_run)))
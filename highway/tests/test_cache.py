@@ -0,0 +1,351 @@
+import asyncio
+
+import pytest
+
+from src.utils.cache import AsyncTTLCache, RedisCacheTier, cached, close_shared_caches
+
+
+def test_concurrent_misses_share_one_load():
+    cache = AsyncTTLCache(max_items=10, ttl_seconds=0)
+    calls = 0
+
+    @cached(lambda: cache, include=["lang"], prefix="stories:list")
+    async def load(lang: str):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [lang]
+
+    async def run():
+        results = await asyncio.gather(*(load("en") for _ in range(5)))
+        return results, await load("en")
+
+    results, again = asyncio.run(run())
+    assert results == [["en"]] * 5
+    assert again == ["en"]
+    assert calls == 1
+
+
+def test_loader_error_reaches_all_waiters_and_is_not_cached():
+    cache = AsyncTTLCache(max_items=10, ttl_seconds=0)
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("db down")
+
+    async def run():
+        results = await asyncio.gather(
+            *(cache.get_or_load("k", failing) for _ in range(3)), return_exceptions=True
+        )
+        value = await cache.get_or_load("k", lambda: asyncio.sleep(0, "ok"))
+        return results, value
+
+    results, value = asyncio.run(run())
+    assert calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert value == "ok"
+
+
+def test_invalidation_during_load_is_not_overwritten():
+    cache = AsyncTTLCache(max_items=10, ttl_seconds=0)
+    versions = iter(["old", "new"])
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        return next(versions)
+
+    async def run():
+        first = asyncio.create_task(cache.get_or_load("stories:get:1", loader))
+        await asyncio.sleep(0)
+        await cache.delete_prefix("stories:")
+        stale = await first
+        return stale, await cache.get_or_load("stories:get:1", loader)
+
+    assert asyncio.run(run()) == ("old", "new")
+
+
+def test_cancelled_caller_does_not_cancel_shared_load():
+    cache = AsyncTTLCache(max_items=10, ttl_seconds=0)
+
+    async def loader():
+        await asyncio.sleep(0.02)
+        return "value"
+
+    async def run():
+        first = asyncio.create_task(cache.get_or_load("k", loader))
+        second = asyncio.create_task(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "value"
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_missing_value_is_cached_as_negative_entry():
+    cache = AsyncTTLCache(max_items=10, ttl_seconds=300, negative_ttl_seconds=30)
+    cache._now = clock = _Clock()
+    calls = 0
+
+    async def missing():
+        nonlocal calls
+        calls += 1
+        return None
+
+    async def run():
+        first = await cache.get_or_load("stories:get:ru:1", missing)
+        second = await cache.get_or_load("stories:get:ru:1", missing)
+        clock.now = 31
+        third = await cache.get_or_load("stories:get:ru:1", missing)
+        return first, second, third
+
+    assert asyncio.run(run()) == (None, None, None)
+    assert calls == 2
+
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    cache = AsyncTTLCache(max_items=10, ttl_seconds=10, stale_seconds=100)
+    cache._now = clock = _Clock()
+    versions = iter(["v1", "v2", "v3"])
+    refresh_started = 0
+
+    async def loader():
+        nonlocal refresh_started
+        refresh_started += 1
+        await asyncio.sleep(0.01)
+        return next(versions)
+
+    async def run():
+        assert await cache.get_or_load("k", loader) == "v1"
+        clock.now = 11
+        # Past the soft TTL: the old value comes back without waiting
+        stale = await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(3)))
+        await asyncio.sleep(0.02)
+        fresh = await cache.get_or_load("k", loader)
+        clock.now = 200
+        # Past the hard TTL the entry is gone and the caller waits for a load
+        return stale, fresh, await cache.get_or_load("k", loader)
+
+    stale, fresh, reloaded = asyncio.run(run())
+    assert stale == ["v1"] * 3
+    assert fresh == "v2"
+    assert reloaded == "v3"
+    assert refresh_started == 3
+
+
+class FakePubSub:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self._redis = redis
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._channels: list[str] = []
+
+    async def subscribe(self, channel: str) -> None:
+        self._channels.append(channel)
+        self._redis.subscribers.setdefault(channel, []).append(self._queue)
+
+    async def listen(self):
+        while True:
+            yield await self._queue.get()
+
+    async def aclose(self) -> None:
+        for channel in self._channels:
+            self._redis.subscribers[channel].remove(self._queue)
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self._redis = redis
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self._redis.data[key] = value
+
+    def sadd(self, key, member):
+        self._redis.sets.setdefault(key, set()).add(member)
+
+    def expire(self, key, seconds, nx=False, gt=False):
+        current = self._redis.ttls.get(key)
+        if nx and current is not None:
+            return
+        if gt and (current is None or seconds <= current):
+            return
+        self._redis.ttls[key] = seconds
+
+    def persist(self, key):
+        self._redis.ttls.pop(key, None)
+
+    async def execute(self):
+        return []
+
+
+class FakeRedis:
+    """Just enough of redis.asyncio.Redis for the shared cache tier."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, str] = {}
+        self.sets: dict[str, set[str]] = {}
+        self.ttls: dict[str, int] = {}
+        self.subscribers: dict[str, list[asyncio.Queue]] = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def unlink(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.sets.pop(key, None)
+
+    async def smembers(self, key):
+        return set(self.sets.get(key, ()))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def scan_iter(self, match):
+        for key in list(self.data):
+            if key.startswith(match.rstrip("*")):
+                yield key
+
+    async def publish(self, channel, message):
+        for queue in self.subscribers.get(channel, []):
+            queue.put_nowait({"type": "message", "data": message})
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+
+def test_shared_tier_serves_and_invalidates_other_workers():
+    redis = FakeRedis()
+    calls = 0
+
+    def worker():
+        cache = AsyncTTLCache(
+            max_items=10, ttl_seconds=300, shared=RedisCacheTier("stories", lambda: redis)
+        )
+
+        @cached(lambda: cache, include=["lang"], prefix="stories:list_preset", tags={"lang": "lang"})
+        async def load(lang: str) -> list[dict]:
+            nonlocal calls
+            calls += 1
+            return [{"title": f"{lang}-{calls}"}]
+
+        return cache, load
+
+    async def run():
+        cache_a, load_a = worker()
+        cache_b, load_b = worker()
+        first_a = await load_a("en")
+        # The second worker reads the value the first one loaded
+        first_b = await load_b("en")
+        await asyncio.sleep(0)
+        await cache_a.invalidate_tags("lang:en")
+        await asyncio.sleep(0)
+        # Both tiers were cleared, so worker B loads again
+        second_b = await load_b("en")
+        second_a = await load_a("en")
+        await close_shared_caches()
+        return first_a, first_b, second_b, second_a
+
+    first_a, first_b, second_b, second_a = asyncio.run(run())
+    assert first_a == first_b == [{"title": "en-1"}]
+    assert second_b == second_a == [{"title": "en-2"}]
+    assert calls == 2
+
+
+def test_tag_invalidation_evicts_only_tagged_entries_and_counts():
+    cache = AsyncTTLCache(max_items=2, ttl_seconds=0)
+    calls: list[str] = []
+
+    @cached(lambda: cache, include=["world_id"], prefix="stories:list", tags={"world": "world_id"})
+    async def load(world_id: str):
+        calls.append(world_id)
+        return [world_id]
+
+    async def run():
+        await load("w1")
+        await load("w2")
+        await load("w1")
+        await cache.invalidate_tags("world:w1")
+        await load("w1")
+        await load("w2")
+        # Third key evicts the least recently used one (w1)
+        await load("w3")
+
+    asyncio.run(run())
+    assert calls == ["w1", "w2", "w1", "w3"]
+    assert cache.stats()["stories:list"] == {
+        "hits": 2,
+        "stale_hits": 0,
+        "misses": 4,
+        "shared_hits": 0,
+        "evictions": 1,
+        "invalidations": 1,
+    }
+    # Evicted and invalidated keys leave the tag index
+    assert set(cache._tag_keys) == {"world:w2", "world:w3"}
+
+
+class DownPubSub:
+    async def subscribe(self, channel: str) -> None:
+        raise ConnectionError("redis unreachable")
+
+    async def aclose(self) -> None:
+        pass
+
+
+class DownRedis:
+    def pubsub(self):
+        return DownPubSub()
+
+
+def test_unreachable_redis_backs_off_and_keeps_local_tier(monkeypatch):
+    tier = RedisCacheTier("stories", DownRedis)
+    delays: list[float] = []
+    invalidations: list[dict] = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        if len(delays) == 5:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(tier._listen(invalidations.append))
+
+    assert delays == [1.0, 2.0, 4.0, 8.0, 16.0]
+    # A connect that never succeeded cannot have missed anything
+    assert invalidations == []
+
+
+def test_tag_index_ttl_is_only_extended():
+    redis = FakeRedis()
+    tier = RedisCacheTier("stories", lambda: redis)
+
+    async def run():
+        await tier.set("a", "[]", 300, ["lang:en"])
+        # A negative entry with a shorter TTL shares the tag
+        await tier.set("b", "null", 30, ["lang:en"])
+        await tier.set("c", "[]", 600, ["lang:en"])
+
+    asyncio.run(run())
+    assert redis.ttls["cache_tag:stories:lang:en"] == 600
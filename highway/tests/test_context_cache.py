@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from pydantic import SecretStr
+
+from src.config import settings
+from src.game.agent import context_cache
+from src.game.agent.context_cache import (
+    FakeContextCacheProvider,
+    StoryContextCache,
+    render_story_context,
+)
+from src.game.agent.models import NPCCharacter, StoryFrame, UserState
+from src.game.agent.prompts import CACHED_STORY_CONTEXT_NOTE
+from src.game.services.google import ApiKeyPool
+
+
+@pytest.fixture(autouse=True)
+def key_pool(monkeypatch):
+    monkeypatch.setattr(settings, "gemini_api_keys", SecretStr("test-key"))
+    pool = ApiKeyPool()
+    monkeypatch.setattr(context_cache, "key_pool", pool)
+    return pool
+
+
+def _state() -> UserState:
+    frame = StoryFrame(
+        lore="An old lighthouse on a cursed shore. " * 20,
+        goal="Escape the island",
+        milestones=[],
+        endings=[],
+        setting="Island",
+        character={"name": "Sailor"},
+        visual_style="watercolor",
+        genre="mystery",
+        npc_characters=[],
+    )
+    return UserState(story_frame=frame)
+
+
+def test_story_context_is_cached_once_per_session(monkeypatch):
+    monkeypatch.setattr(settings, "context_cache_min_tokens", 50)
+    provider = FakeContextCacheProvider()
+    cache = StoryContextCache(provider)
+    state = _state()
+
+    async def run():
+        return [await cache.resolve(state) for _ in range(3)]
+
+    contexts = asyncio.run(run())
+
+    assert len(provider.contents) == 1
+    assert all(c.cached_content == "cachedContents/fake-1" for c in contexts)
+    assert all(c.text == CACHED_STORY_CONTEXT_NOTE for c in contexts)
+    assert cache.stats.misses == 1
+    assert cache.stats.hits == 3
+    assert cache.stats.tokens_saved == 3 * state.context_cache.tokens
+
+
+def test_npc_change_invalidates_cache(monkeypatch):
+    monkeypatch.setattr(settings, "context_cache_min_tokens", 50)
+    provider = FakeContextCacheProvider()
+    cache = StoryContextCache(provider)
+    state = _state()
+
+    asyncio.run(cache.resolve(state))
+    state.story_frame.npc_characters.append(
+        NPCCharacter(
+            char_name="Keeper",
+            char_age="60",
+            char_background="lighthouse keeper",
+            char_personality="gruff, loyal",
+            visual_description="grey beard, oilskin coat",
+        )
+    )
+    context = asyncio.run(cache.resolve(state))
+
+    assert len(provider.contents) == 2
+    assert "Keeper" in provider.contents[context.cached_content]
+
+
+def test_small_context_is_sent_inline(monkeypatch):
+    monkeypatch.setattr(settings, "context_cache_min_tokens", 100_000)
+    provider = FakeContextCacheProvider()
+    cache = StoryContextCache(provider)
+    state = _state()
+
+    context = asyncio.run(cache.resolve(state))
+
+    assert not provider.contents
+    assert context.cached_content is None
+    assert context.text == render_story_context(state.story_frame)
+    assert cache.stats.inline == 1
@@ -0,0 +1,41 @@
+import asyncio
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from src.config import settings
+from src.game.images import storage
+from src.game.images.encoder import encode_image, public_image_meta
+
+
+def _png(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (200, 80, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_image_is_encoded_into_webp_variants(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "IMAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "image_encoder_workers", 0)
+    monkeypatch.setattr(settings, "image_variant_widths", {"app": 400, "thumb": 100, "big": 2000})
+
+    stored = asyncio.run(encode_image(_png(900, 1600)))
+
+    variants = stored.meta["variants"]
+    assert list(variants) == ["big", "app", "thumb"]
+    # Images are never upscaled
+    assert (variants["big"]["width"], variants["big"]["height"]) == (900, 1600)
+    assert (variants["thumb"]["width"], variants["thumb"]["height"]) == (100, 178)
+    assert stored.path == os.path.join(str(tmp_path), variants["big"]["webp"])
+    for variant in variants.values():
+        assert storage.is_content_addressed(variant["webp"])
+        with Image.open(tmp_path / variant["webp"]) as image:
+            assert image.format == "WEBP"
+    assert stored.meta["placeholder"].startswith("data:image/webp;base64,")
+    assert not any(name.endswith(".png") for name in os.listdir(tmp_path))
+
+    public = public_image_meta(stored.meta)
+    assert public["variants"]["thumb"]["webp"] == storage.image_url(
+        str(tmp_path / variants["thumb"]["webp"])
+    )
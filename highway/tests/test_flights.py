@@ -0,0 +1,45 @@
+import asyncio
+import uuid
+
+import pytest
+
+from src.api.scenes.flights import SceneFlights, SessionBusyError
+from src.config import settings
+
+
+def test_duplicate_choice_joins_running_step(monkeypatch):
+    monkeypatch.setattr(settings, "redis_url", None)
+    flights = SceneFlights()
+    scene_id = uuid.uuid4()
+    calls = 0
+
+    async def request():
+        nonlocal calls
+        flight = await flights.begin("s1", "Open the door")
+        if flight.joined:
+            return await flight.wait()
+        calls += 1
+        await asyncio.sleep(0.01)
+        await flight.finish(scene_id)
+        return scene_id
+
+    async def run():
+        return await asyncio.gather(request(), request(), request())
+
+    assert asyncio.run(run()) == [scene_id] * 3
+    assert calls == 1
+
+
+def test_other_choice_is_rejected_while_running(monkeypatch):
+    monkeypatch.setattr(settings, "redis_url", None)
+    flights = SceneFlights()
+
+    async def run():
+        leader = await flights.begin("s1", "Open the door")
+        with pytest.raises(SessionBusyError):
+            await flights.begin("s1", "Run away")
+        await leader.fail(RuntimeError("boom"))
+        # The session is free again once the step ends
+        return await flights.begin("s1", "Run away")
+
+    assert not asyncio.run(run()).joined
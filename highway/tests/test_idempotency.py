@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.idempotency import IdempotencyKeys
+from src.config import settings
+
+
+def test_retry_replays_first_result(monkeypatch):
+    monkeypatch.setattr(settings, "redis_url", None)
+    keys = IdempotencyKeys()
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"scene_id": f"scene-{calls}"}
+
+    async def run():
+        # The second attempt arrives while the first is still running
+        return await asyncio.gather(
+            keys.run("k1", "1:scene", {"choice_text": "Go"}, call),
+            keys.run("k1", "1:scene", {"choice_text": "Go"}, call),
+        )
+
+    assert asyncio.run(run()) == [{"scene_id": "scene-1"}] * 2
+    assert calls == 1
+
+
+def test_key_reused_for_other_request(monkeypatch):
+    monkeypatch.setattr(settings, "redis_url", None)
+    keys = IdempotencyKeys()
+
+    async def call():
+        return {"scene_id": "scene-1"}
+
+    async def run():
+        await keys.run("k1", "1:scene", {"choice_text": "Go"}, call)
+        await keys.run("k1", "1:scene", {"choice_text": "Stay"}, call)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(run())
+    assert exc.value.detail == "idempotency_key_reused"
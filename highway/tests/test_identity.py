@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from src.api import identity
+from src.api.utils import is_pro_user
+from src.config import settings
+from src.models.subscription import Subscription
+from src.models.user import User
+
+
+class FakeResult:
+    def __init__(self, row):
+        self._row = row
+
+    def first(self):
+        return self._row
+
+
+class FakeSessions:
+    """Stands in for AsyncSessionLocal and serves one user row."""
+
+    def __init__(self, row) -> None:
+        self.row = row
+        self.queries = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        self.queries += 1
+        return FakeResult(self.row)
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    monkeypatch.setattr(settings, "redis_url", None)
+    monkeypatch.setattr(identity, "_identity_cache", None)
+    user = User(id=7, tg_id=42, language="en", image_format="vertical")
+    fake = FakeSessions((user, "pro", "active", None))
+    monkeypatch.setattr(identity, "AsyncSessionLocal", fake)
+    return fake
+
+
+def test_context_is_cached_until_invalidated(sessions):
+    async def run():
+        first = await identity.get_user_context(42)
+        second = await identity.get_user_context(42)
+        sessions.row = (sessions.row[0], "pro", "inactive", None)
+        await identity.invalidate_user_context(42)
+        third = await identity.get_user_context(42)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == second
+    assert (first.id, first.language, first.is_pro) == (7, "en", True)
+    assert not third.is_pro
+    assert sessions.queries == 2
+
+
+def test_unknown_user_is_not_found(sessions):
+    sessions.row = None
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(identity.get_user_context(1))
+    assert exc.value.status_code == 404
+
+
+def test_pro_status_ends_at_subscription_expiry():
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    future = datetime.now(timezone.utc) + timedelta(days=1)
+    assert not identity.UserContext(id=1, tg_id=1, pro=True, pro_expires_at=past).is_pro
+    assert identity.UserContext(id=1, tg_id=1, pro=True, pro_expires_at=future).is_pro
+    assert not identity.UserContext(id=1, tg_id=1, pro=False).is_pro
+
+
+def test_scene_pro_check_honours_expiry():
+    started = datetime.now(timezone.utc) - timedelta(days=30)
+    expired = Subscription(
+        plan="pro",
+        status="active",
+        started_at=started,
+        expires_at=datetime.now(timezone.utc) - timedelta(minutes=1),
+    )
+    assert not is_pro_user(User(id=1, tg_id=1, subscriptions=[expired]))
+    expired.expires_at = None
+    assert is_pro_user(User(id=1, tg_id=1, subscriptions=[expired]))
@@ -0,0 +1,40 @@
+from fastapi.testclient import TestClient
+
+from src.game.images import storage
+from src.main import app
+
+client = TestClient(app)
+
+
+def test_image_is_served_by_content_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "IMAGE_DIR", str(tmp_path))
+    path = storage.write_image_bytes(b"\x89PNG fake image bytes", "png")
+    url = storage.image_url(path)
+    name = url.rsplit("/", 1)[1]
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == b"\x89PNG fake image bytes"
+    assert response.headers["etag"] == f'"{name[:-4]}"'
+    assert "immutable" in response.headers["cache-control"]
+
+    cached = client.get(url, headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+    partial = client.get(url, headers={"Range": "bytes=0-3"})
+    assert partial.status_code == 206
+    assert partial.content == b"\x89PNG"
+
+
+def test_unknown_or_unsafe_names_are_not_served(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "IMAGE_DIR", str(tmp_path))
+    assert client.get(storage.IMAGE_URL_PREFIX + "0" * 64 + ".png").status_code == 404
+    assert client.get(storage.IMAGE_URL_PREFIX + "..%2Fsecret.png").status_code == 404
+
+
+def test_legacy_names_require_auth(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "IMAGE_DIR", str(tmp_path))
+    (tmp_path / "gemini_20250101_120000.png").write_bytes(b"\x89PNG old")
+    url = storage.image_url(str(tmp_path / "gemini_20250101_120000.png"))
+
+    assert client.get(url).status_code == 401
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+from pydantic import SecretStr
+
+from src.config import settings
+from src.game.services import google
+from src.game.services.google import ApiKeyPool
+
+
+class Clock:
+    """Real clocks shifted by ``offset`` seconds."""
+
+    def __init__(self) -> None:
+        self.offset = 0.0
+
+    def monotonic(self) -> float:
+        return time.monotonic() + self.offset
+
+    def time(self) -> float:
+        return time.time() + self.offset
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(google, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def pool(monkeypatch, clock):
+    monkeypatch.setattr(settings, "gemini_api_keys", SecretStr("k1,k2"))
+    monkeypatch.setattr(settings, "api_key_rpm", 0)
+    monkeypatch.setattr(settings, "api_key_cooldown_seconds", 30)
+    monkeypatch.setattr(settings, "api_key_max_cooldown_seconds", 300)
+    monkeypatch.setattr(settings, "api_key_shared_state", False)
+    return ApiKeyPool()
+
+
+def test_rate_limited_key_cools_down(pool, clock):
+    pool.started("k1")
+    pool.finished("k1", Exception("429 RESOURCE_EXHAUSTED"))
+    pool.started("k2")
+
+    # Skipped even though k2 is busier
+    assert [pool.get_key_sync() for _ in range(3)] == ["k2"] * 3
+
+    clock.offset += 31
+    assert pool.get_key_sync() == "k1"
+
+
+def test_least_loaded_key_is_preferred(pool):
+    pool.started("k1")
+    assert [pool.get_key_sync() for _ in range(3)] == ["k2"] * 3
+
+    pool.finished("k1")
+    pool.started("k2")
+    pool.finished("k2", ValueError("bad request"))
+    # Equal load: the key without recent errors wins
+    assert [pool.get_key_sync() for _ in range(3)] == ["k1"] * 3
+
+
+def test_empty_token_bucket_defers_key(pool, clock, monkeypatch):
+    monkeypatch.setattr(settings, "api_key_rpm", 1)
+    pool.started("k2")
+
+    assert pool.get_key_sync() == "k1"
+    # k1 spent its only token, so the busier k2 is used instead
+    assert pool.get_key_sync() == "k2"
+
+    clock.offset += 60
+    assert pool.get_key_sync() == "k1"
+
+
+def test_snapshot_reports_counters(pool):
+    pool.started("k1")
+    pool.started("k1")
+    pool.finished("k1", Exception("429"))
+
+    k1, k2 = pool.snapshot()
+    assert k1["in_flight"] == 1
+    assert k1["requests"] == 2
+    assert k1["errors"] == 1
+    assert k1["recent_errors"] == 1
+    assert k1["rate_limited"] == 1
+    assert 29 <= k1["cooldown_remaining"] <= 30
+    assert k1["tokens"] is None
+    assert k1["key_id"] == pool.key_id("k1") != "k1"
+    assert k2["requests"] == 0
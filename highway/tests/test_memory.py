@@ -0,0 +1,29 @@
+from src.config import settings
+from src.game.agent.memory import render_history
+from src.game.agent.models import StoryMemory, UserChoice, UserState
+
+
+def _state(n: int) -> UserState:
+    return UserState(
+        user_choices=[UserChoice(scene_id=f"s{i}", choice_text=f"c{i}") for i in range(n)]
+    )
+
+
+def test_render_history_without_summary_is_verbatim():
+    state = _state(3)
+    assert render_history(state) == "s0:c0; s1:c1; s2:c2"
+
+
+def test_render_history_skips_summarized_choices():
+    state = _state(10)
+    state.memory = StoryMemory(summary="The hero left home.", summarized_count=7)
+    history = render_history(state)
+    assert history.startswith("Story so far: The hero left home.")
+    assert "s6:c6" not in history
+    assert history.endswith("s7:c7; s8:c8; s9:c9")
+
+
+def test_render_history_is_bounded():
+    state = _state(100)
+    limit = settings.memory_recent_choices + settings.memory_refresh_every
+    assert render_history(state).count(";") == limit - 1
@@ -0,0 +1,60 @@
+import asyncio
+import uuid
+
+from src.utils import migrate_states_to_sessions as migration
+
+
+class FakeResult:
+    def __init__(self, ids) -> None:
+        self._ids = ids
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return list(self._ids)
+
+
+class FakeDB:
+    """Returns fixed session ids and keeps the statements it was given."""
+
+    def __init__(self, ids) -> None:
+        self.ids = ids
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult(self.ids)
+
+
+def _data(description: str | None = "The lighthouse door creaks open") -> dict:
+    # Agent scene ids are its own uuid4s, never PostgreSQL scene ids
+    scene_id = str(uuid.uuid4())
+    scenes = {scene_id: {"scene_id": scene_id, "description": description, "choices": []}}
+    return {"current_scene_id": scene_id, "scenes": scenes}
+
+
+def test_state_is_matched_by_current_scene_description():
+    session_id = uuid.uuid4()
+    db = FakeDB([session_id])
+
+    assert asyncio.run(migration._find_session(db, 7, _data())) == session_id
+    params = db.statements[0].compile().params
+    assert 7 in params.values()
+    assert "The lighthouse door creaks open" in params.values()
+
+
+def test_ambiguous_or_missing_match_is_dropped():
+    db = FakeDB([uuid.uuid4(), uuid.uuid4()])
+    assert asyncio.run(migration._find_session(db, 7, _data())) is None
+
+    db = FakeDB([])
+    assert asyncio.run(migration._find_session(db, 7, _data())) is None
+
+
+def test_state_without_current_scene_is_not_guessed():
+    db = FakeDB([uuid.uuid4()])
+    assert asyncio.run(migration._find_session(db, 7, {"scenes": {}})) is None
+    assert asyncio.run(migration._find_session(db, 7, _data(None))) is None
+    # No fallback to the user's latest session
+    assert db.statements == []
@@ -0,0 +1,42 @@
+import asyncio
+
+from src.game.agent import pregen
+from src.game.agent.models import Scene, SceneChoice, StoryMemory, UserState
+from src.game.agent.runner import SceneResponse
+
+
+def _state() -> UserState:
+    scene = Scene(
+        scene_id="s1",
+        description="A fork in the road",
+        choices=[SceneChoice(text="Go left"), SceneChoice(text="Go right")],
+    )
+    return UserState(scenes={"s1": scene}, current_scene_id="s1")
+
+
+def test_branches_share_one_memory_refresh(monkeypatch):
+    refreshes: list[int] = []
+
+    async def fake_refresh(state, pending_choices=0):
+        refreshes.append(pending_choices)
+        state.memory = StoryMemory(summary="So far", summarized_count=1)
+        return True
+
+    async def fake_process_step(state, choice_text, on_event=None, memory=None):
+        state.memory = await memory
+        scene = Scene(scene_id=choice_text, description=choice_text, choices=[], image="x.png")
+        return SceneResponse(scene=scene, game_over=False)
+
+    monkeypatch.setattr(pregen, "refresh_memory", fake_refresh)
+    monkeypatch.setattr(pregen, "process_step", fake_process_step)
+    pregenerator = pregen.ScenePregenerator()
+
+    async def run():
+        pregenerator.schedule("session", 1, _state())
+        return await pregenerator.take("session", 1, "Go right")
+
+    step = asyncio.run(run())
+
+    assert refreshes == [1]
+    assert step.response.scene.description == "Go right"
+    assert step.state.memory.summary == "So far"
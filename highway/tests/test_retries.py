@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from src.game.agent import utils
+from src.game.agent.utils import LatencyTracker, RetryPolicy, deadline, with_retries
+
+
+def test_non_retryable_error_is_raised_after_one_attempt():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        raise google_exceptions.InvalidArgument("bad prompt")
+
+    with pytest.raises(google_exceptions.InvalidArgument):
+        asyncio.run(with_retries(call, RetryPolicy(attempts=3, backoff=0)))
+    assert calls == 1
+
+
+def test_backoff_stops_when_the_deadline_is_closer_than_the_pause():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("503 unavailable")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with deadline(0.2):
+            with pytest.raises(RuntimeError):
+                await with_retries(call, RetryPolicy(attempts=3, backoff=1.0, jitter=0))
+        return loop.time() - started
+
+    elapsed = asyncio.run(run())
+    assert calls == 1
+    assert elapsed < 0.2
+
+
+def test_attempt_timeout_is_clamped_to_the_deadline():
+    async def call():
+        await asyncio.sleep(5)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with deadline(0.05):
+            with pytest.raises(asyncio.TimeoutError):
+                await with_retries(call, RetryPolicy(attempts=1, timeout=10))
+        return loop.time() - started
+
+    assert asyncio.run(run()) < 1
+
+
+def test_exhausted_deadline_raises_before_the_first_attempt():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+
+    async def run():
+        with deadline(0):
+            await with_retries(call)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+    assert calls == 0
+
+
+def _slow_history(monkeypatch, name: str, seconds: float) -> None:
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record(seconds)
+    monkeypatch.setitem(utils._latencies, name, tracker)
+
+
+def test_hedge_fires_after_the_percentile_and_first_success_wins(monkeypatch):
+    _slow_history(monkeypatch, "hedged", 0.05)
+    policy = RetryPolicy(attempts=1, timeout=5, hedge_percentile=0.5)
+    starts: list[float] = []
+    cancelled: list[int] = []
+
+    async def call():
+        loop = asyncio.get_running_loop()
+        index = len(starts)
+        starts.append(loop.time())
+        try:
+            await asyncio.sleep(1 if index == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        return index
+
+    async def run():
+        result = await with_retries(call, policy, name="hedged")
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 1
+    assert len(starts) == 2
+    assert starts[1] - starts[0] >= 0.04
+    assert cancelled == [0]
+
+
+def test_fast_call_is_not_hedged(monkeypatch):
+    _slow_history(monkeypatch, "fast", 0.2)
+    policy = RetryPolicy(attempts=1, timeout=5, hedge_percentile=0.5)
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(with_retries(call, policy, name="fast")) == "done"
+    assert calls == 1
@@ -0,0 +1,150 @@
+"""Query budget of a scene step.
+
+The recording-session test always runs; the PostgreSQL one also counts the
+SQL actually sent and needs TEST_DATABASE_URL.
+"""
+
+import asyncio
+import os
+import uuid
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from src.api.scenes import scene_service
+from src.game.agent.models import Scene as AgentScene, SceneChoice, UserChoice, UserState
+from src.game.agent.runner import SceneResponse
+from src.models import Base
+from src.models.game_session import GameSession
+from src.models.story import Story
+from src.models.user import User
+from src.models.world import World
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+needs_postgres = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+
+def _patch_agent(monkeypatch):
+    state = UserState(user_choices=[UserChoice(scene_id="s1", choice_text="Go")])
+
+    async def get_state(session_id, user_id):
+        return state
+
+    async def set_state(session_id, state, user_id):
+        pass
+
+    async def take(key, order_num, choice_text):
+        return None
+
+    async def step(state, choice_text, on_event=None):
+        scene = AgentScene(
+            scene_id="s2",
+            description="A corridor",
+            choices=[SceneChoice(text="Left"), SceneChoice(text="Right")],
+            image="images/s2.png",
+        )
+        return SceneResponse(scene=scene, game_over=False)
+
+    monkeypatch.setattr(scene_service, "get_session_state", get_state)
+    monkeypatch.setattr(scene_service, "set_session_state", set_state)
+    monkeypatch.setattr(scene_service, "take_pregenerated", take)
+    monkeypatch.setattr(scene_service, "process_step", step)
+    monkeypatch.setattr(scene_service, "schedule_pregeneration", lambda *a: None)
+
+
+class RecordingResult:
+    def __init__(self, row) -> None:
+        self._row = row
+
+    def unique(self):
+        return self
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self._row
+
+
+class RecordingSession:
+    """Stands in for AsyncSession and records every database round trip."""
+
+    def __init__(self, game: GameSession) -> None:
+        self.game = game
+        self.calls: list[str] = []
+        self.added: list[object] = []
+
+    async def execute(self, statement):
+        self.calls.append("execute")
+        return RecordingResult(self.game)
+
+    async def flush(self):
+        self.calls.append("flush")
+
+    async def commit(self):
+        self.calls.append("commit")
+
+    def add(self, obj):
+        self.added.append(obj)
+
+
+def test_scene_step_issues_one_load_and_one_commit(monkeypatch):
+    _patch_agent(monkeypatch)
+    user = User(id=1, tg_id=1, language="en")
+    story = Story(genre="Adventure")
+    game = GameSession(id=uuid.uuid4(), user=user, story=story, scene_count=1)
+    db = RecordingSession(game)
+
+    async def run():
+        session = await scene_service.load_step_session(db, game.id)
+        return await scene_service.create_and_store_scene(db, session, "Go")
+
+    scene = asyncio.run(run())
+
+    assert scene.order_num == 2
+    assert game.scene_count == 2
+    # One eager load, then everything goes out in a single commit
+    assert db.calls == ["execute", "commit"]
+    assert [type(obj).__name__ for obj in db.added] == ["Scene", "Choice"]
+
+
+@needs_postgres
+def test_scene_step_query_count(monkeypatch):
+    _patch_agent(monkeypatch)
+
+    async def run() -> list[str]:
+        engine = create_async_engine(DATABASE_URL)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        async with sessions() as db:
+            user = User(tg_id=1, language="en")
+            world = World(user=user)
+            story = Story(world=world, user=user, genre="Adventure")
+            game = GameSession(user=user, story=story, scene_count=1)
+            db.add(game)
+            await db.commit()
+            session_id = game.id
+
+        statements: list[str] = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement.split()[0])
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count)
+        async with sessions() as db:
+            session = await scene_service.load_step_session(db, session_id)
+            scene = await scene_service.create_and_store_scene(db, session, "Go")
+        event.remove(engine.sync_engine, "before_cursor_execute", count)
+        await engine.dispose()
+        assert scene.order_num == 2
+        return statements
+
+    statements = asyncio.run(run())
+    # One eager load, then one flush: scene and choice inserts plus the
+    # scene counter update
+    assert statements[0] == "SELECT"
+    assert sorted(statements[1:]) == ["INSERT", "INSERT", "UPDATE"]
@@ -0,0 +1,150 @@
+import asyncio
+from collections import defaultdict
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from src.config import settings
+from src.game.agent.models import Scene, SceneChoice, UserState
+from src.game.agent.mongo_state import SceneArchive, StateConflictError, UserStateCache
+
+
+class FakeRepo:
+    def __init__(self) -> None:
+        self.docs: dict[str, int] = {}
+        self.data: dict[str, dict] = {}
+        self.db = defaultdict(FakeCollection)
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def get(self, session_id):
+        return UserState(), self.docs.get(session_id, 0), None
+
+    async def get_version(self, session_id):
+        return self.docs.get(session_id, 0)
+
+    async def save_many(self, states):
+        await self.release.wait()
+        conflicts = set()
+        for sid, (data, version, *_) in states.items():
+            if self.docs.get(sid, 0) != version:
+                conflicts.add(sid)
+            else:
+                self.docs[sid] = version + 1
+                self.data[sid] = data
+        return conflicts
+
+    async def reset(self, session_id):
+        self.docs.pop(session_id, None)
+
+
+class FakeCollection:
+    """Insert-only slice of a Motor collection, enough for SceneArchive."""
+
+    def __init__(self) -> None:
+        self.docs: dict[str, dict] = {}
+        self.inserts = 0
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            if doc["_id"] in self.docs:
+                errors.append({"index": index, "code": 11000})
+                continue
+            self.docs[doc["_id"]] = doc
+            self.inserts += 1
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def find(self, query):
+        for _id in query["_id"]["$in"]:
+            if _id in self.docs:
+                yield self.docs[_id]
+
+
+class FakeArchive:
+    async def append(self, scenes):
+        pass
+
+    async def load(self, session_id, scene_ids):
+        return {}
+
+    async def delete(self, session_id):
+        pass
+
+
+def test_save_raises_on_conflict():
+    repo = FakeRepo()
+    cache = UserStateCache(repo, FakeArchive())
+
+    async def run():
+        state = await cache.get("s1", "u1")
+        # Another worker saves the session in between
+        repo.docs["s1"] = 1
+        state.language = "de"
+        await cache.set("s1", state, "u1")
+
+    with pytest.raises(StateConflictError) as exc:
+        asyncio.run(run())
+
+    assert exc.value.session_ids == {"s1"}
+    assert repo.docs["s1"] == 1
+
+
+def test_reset_waits_for_running_save():
+    repo = FakeRepo()
+    cache = UserStateCache(repo, FakeArchive())
+
+    async def run():
+        state = await cache.get("s1", "u1")
+        state.language = "de"
+        repo.release.clear()
+        save = asyncio.create_task(cache.set("s1", state, "u1"))
+        await asyncio.sleep(0)
+        reset = asyncio.create_task(cache.reset("s1"))
+        await asyncio.sleep(0)
+        repo.release.set()
+        await asyncio.gather(save, reset)
+
+    asyncio.run(run())
+
+    assert "s1" not in repo.docs
+
+
+def _scene(scene_id: str) -> Scene:
+    return Scene(
+        scene_id=scene_id,
+        description=f"Scene {scene_id}",
+        choices=[SceneChoice(text="Go left"), SceneChoice(text="Go right")],
+    )
+
+
+def test_old_scenes_move_to_the_archive(monkeypatch):
+    monkeypatch.setattr(settings, "hot_scene_window", 2)
+    repo = FakeRepo()
+    archive = SceneArchive(repo)
+    collection = archive.collection
+    cache = UserStateCache(repo, archive)
+
+    async def run():
+        state = await cache.get("s1", "u1")
+        for i in range(5):
+            state.scenes[f"sc{i}"] = _scene(f"sc{i}")
+        # The current scene stays inline however old it is
+        state.current_scene_id = "sc1"
+        await cache.set("s1", state, "u1")
+        # Re-archiving after a failed save must not fail or duplicate
+        await archive.append([("s1", _scene("sc0"))])
+        fresh = await cache.get("s1", "u1")
+        return await fresh.load_scenes(["sc0", "sc2", "sc4"])
+
+    loaded = asyncio.run(run())
+
+    stored = repo.data["s1"]
+    assert set(stored["scenes"]) == {"sc1", "sc3", "sc4"}
+    assert stored["current_scene_id"] == "sc1"
+    assert stored["archived_scene_count"] == 2
+    assert set(collection.docs) == {"s1:sc0", "s1:sc2"}
+    assert collection.inserts == 2
+    assert set(loaded) == {"sc0", "sc2", "sc4"}
+    assert loaded["sc0"].description == "Scene sc0"
@@ -0,0 +1,56 @@
+import copy
+
+from src.game.agent.models import Scene, SceneChoice, UserChoice, UserState
+from src.game.agent.state_delta import apply_delta, diff_state, encode_state
+
+
+def _scene(scene_id: str) -> Scene:
+    return Scene(
+        scene_id=scene_id,
+        description=f"Scene {scene_id}",
+        choices=[SceneChoice(text="Go left"), SceneChoice(text="Go right")],
+    )
+
+
+def test_step_is_saved_as_push_and_set():
+    state = UserState(scenes={"a": _scene("a")}, current_scene_id="a")
+    old = encode_state(state)
+
+    state.scenes["b"] = _scene("b")
+    state.user_choices.append(UserChoice(scene_id="a", choice_text="Go left"))
+    state.current_scene_id = "b"
+    state.last_image_prompt = "A dark corridor"
+    update = diff_state(old, encode_state(state))
+
+    assert set(update["$set"]) == {
+        "data.scenes.b",
+        "data.current_scene_id",
+        "data.last_image_prompt",
+    }
+    assert update["$push"] == {
+        "data.user_choices": {"$each": [encode_state(state)["user_choices"][0]]}
+    }
+    assert "$unset" not in update
+
+
+def test_delta_round_trips():
+    state = UserState(
+        scenes={"a": _scene("a"), "b": _scene("b")},
+        user_choices=[UserChoice(scene_id="a", choice_text="Go left")],
+        assets={"music": "old.mp3"},
+    )
+    old = encode_state(state)
+    state.scenes.pop("a")
+    state.scenes["b"].image = "b.png"
+    state.user_choices.append(UserChoice(scene_id="b", choice_text="Go right"))
+    state.assets = {}
+    new = encode_state(state)
+
+    doc = apply_delta({"data": copy.deepcopy(old)}, diff_state(old, new))
+
+    assert UserState.model_validate(doc["data"]) == state
+
+
+def test_unchanged_state_has_no_delta():
+    state = UserState(scenes={"a": _scene("a")})
+    assert diff_state(encode_state(state), encode_state(state)) == {}